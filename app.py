@@ -35,6 +35,7 @@ cdk.Tags.of(network_stack).add(
 network_service_stack = NetworkServiceStack(
     scope=app,
     network_stack=network_stack,
+    network_config=config.network,
     env=get_environment()
 )
 cdk.Tags.of(network_service_stack).add(
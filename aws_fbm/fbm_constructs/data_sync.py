@@ -1,10 +1,28 @@
+from aws_fbm.utils.utils import repo_path
+
 from constructs import Construct
-from aws_cdk import aws_ec2, aws_iam, aws_s3, aws_efs, aws_datasync
+from aws_cdk import aws_ec2, aws_iam, aws_s3, aws_efs, aws_datasync, \
+    aws_events, aws_events_targets, aws_lambda, aws_lambda_event_sources, \
+    aws_sqs, Duration
 import aws_cdk.aws_logs as logs
 
+from typing import Optional
+
 
 class DataSync(Construct):
-    """Set up automatic AWS DataSync from an existing S3 bucket to an EFS"""
+    """Set up automatic AWS DataSync from an existing S3 bucket to an EFS
+
+    With events, objects created or deleted in the bucket start a task
+    execution which only transfers their directories. Events are collected
+    for up to debounce_seconds, so that a burst of uploads starts a single
+    execution. The bucket must send events to EventBridge. Executions of
+    the whole bucket are also started on the schedule, if any.
+
+    bandwidth_mibps limits the bandwidth used by executions. verify_mode is
+    "only_files_transferred", "point_in_time_consistent" or "none". With
+    queueing, executions started while another is running wait for it to
+    complete; otherwise they fail, and changes are retried later.
+    """
 
     def __init__(
             self,
@@ -16,9 +34,28 @@ class DataSync(Construct):
             vpc: aws_ec2.Vpc,
             subnet_arn: str,
             region: str,
-            account: str):
+            account: str,
+            events: bool = False,
+            schedule: Optional[str] = "cron(0 0 * ? * * *)",
+            debounce_seconds: int = 60,
+            bandwidth_mibps: Optional[int] = None,
+            verify_mode: str = "only_files_transferred",
+            queueing: bool = True):
         super().__init__(scope, id)
 
+        verify_modes = {
+            "only_files_transferred": "ONLY_FILES_TRANSFERRED",
+            "point_in_time_consistent": "POINT_IN_TIME_CONSISTENT",
+            "none": "NONE"
+        }
+        if verify_mode not in verify_modes:
+            raise ValueError(f"Configuration file error: unknown DataSync "
+                             f"verify mode {verify_mode}")
+        if not 0 <= debounce_seconds <= 300:
+            raise ValueError(f"Configuration file error: DataSync debounce "
+                             f"{debounce_seconds} must be between 0 and 300 "
+                             f"seconds")
+
         self.import_bucket = aws_s3.Bucket.from_bucket_name(
             scope=self, id="NodeImportBucket", bucket_name=bucket_name
         )
@@ -128,9 +165,68 @@ class DataSync(Construct):
                 log_level="BASIC",
                 preserve_deleted_files="REMOVE",
                 transfer_mode="CHANGED",
-                verify_mode="ONLY_FILES_TRANSFERRED"
+                verify_mode=verify_modes[verify_mode],
+                bytes_per_second=bandwidth_mibps * 1024 * 1024
+                if bandwidth_mibps else -1,
+                task_queueing="ENABLED" if queueing else "DISABLED"
             ),
             schedule=aws_datasync.CfnTask.TaskScheduleProperty(
-                schedule_expression="cron(0 0 * ? * * *)"
-            )
+                schedule_expression=schedule
+            ) if schedule else None
         )
+
+        if events:
+            self.start_on_events(debounce_seconds)
+
+    def start_on_events(self, debounce_seconds: int):
+        """Start task executions when objects are created or deleted"""
+        # Failed executions are retried after the visibility timeout, until
+        # the events are moved to the dead letter queue
+        dead_letter_queue = aws_sqs.Queue(
+            self, "EventsDeadLetterQueue",
+            retention_period=Duration.days(14))
+        queue = aws_sqs.Queue(
+            self, "EventsQueue",
+            visibility_timeout=Duration.minutes(10),
+            dead_letter_queue=aws_sqs.DeadLetterQueue(
+                max_receive_count=10, queue=dead_letter_queue))
+
+        aws_events.Rule(
+            self, "BucketEventsRule",
+            event_pattern=aws_events.EventPattern(
+                source=["aws.s3"],
+                detail_type=["Object Created", "Object Deleted"],
+                detail={"bucket": {
+                    "name": [self.import_bucket.bucket_name]}}
+            ),
+            targets=[aws_events_targets.SqsQueue(queue)])
+
+        start_function = aws_lambda.Function(
+            self, "StartFunction",
+            runtime=aws_lambda.Runtime(
+                "python3.12", aws_lambda.RuntimeFamily.PYTHON),
+            handler="index.handler",
+            code=aws_lambda.Code.from_asset(str(
+                repo_path() / "aws_fbm" / "lambdas" / "start_data_sync")),
+            timeout=Duration.minutes(1),
+            environment={"TASK_ARN": self.datasync_task.attr_task_arn})
+        logs.LogGroup(
+            self, "StartFunctionLogGroup",
+            log_group_name=f"/aws/lambda/{start_function.function_name}",
+            retention=logs.RetentionDays.ONE_MONTH)
+        start_function.add_to_role_policy(aws_iam.PolicyStatement(
+            actions=["datasync:StartTaskExecution"],
+            resources=[self.datasync_task.attr_task_arn]))
+        # Starting executions of a task with an EFS location requires
+        # describing its network interfaces
+        start_function.add_to_role_policy(aws_iam.PolicyStatement(
+            actions=["ec2:DescribeNetworkInterfaces"],
+            resources=["*"]))
+        # Events are delivered once the queue has held them for the debounce
+        # time, or the batch is full
+        start_function.add_event_source(
+            aws_lambda_event_sources.SqsEventSource(
+                queue,
+                batch_size=10000 if debounce_seconds else 10,
+                max_batching_window=Duration.seconds(debounce_seconds),
+                max_concurrency=2))
@@ -0,0 +1,67 @@
+from constructs import Construct
+from aws_cdk import aws_ec2 as ec2
+from aws_cdk import aws_ecs as ecs
+from aws_cdk import aws_rds as rds
+from aws_cdk import Duration, RemovalPolicy
+
+
+class Database(Construct):
+    """A Postgres database for a Fed-BioMed network service. The credentials
+    are generated and stored in Secrets Manager"""
+
+    def __init__(self,
+                 scope: Construct,
+                 id: str,
+                 vpc: ec2.Vpc,
+                 database_name: str,
+                 instance_type: str):
+        super().__init__(scope=scope, id=id)
+        self.database_name = database_name
+        self.port = 5432
+
+        self.instance = rds.DatabaseInstance(
+            self,
+            "DatabaseInstance",
+            engine=rds.DatabaseInstanceEngine.postgres(
+                version=rds.PostgresEngineVersion.VER_14
+            ),
+            instance_type=ec2.InstanceType(instance_type),
+            vpc=vpc,
+            vpc_subnets=ec2.SubnetSelection(
+                subnet_type=ec2.SubnetType.PRIVATE_ISOLATED),
+            database_name=database_name,
+            credentials=rds.Credentials.from_generated_secret("fedbiomed"),
+            port=self.port,
+            allocated_storage=20,
+            max_allocated_storage=100,
+            storage_encrypted=True,
+            backup_retention=Duration.days(7),
+            removal_policy=RemovalPolicy.SNAPSHOT,
+            deletion_protection=False
+        )
+
+    def environment(self):
+        """Container environment variables for connecting to the database"""
+        return {
+            "DATABASE_ENGINE": "postgres",
+            "DATABASE_NAME": self.database_name,
+            "DATABASE_HOST": self.instance.db_instance_endpoint_address,
+            "DATABASE_PORT": str(self.port)
+        }
+
+    def secrets(self):
+        """Container secrets holding the database credentials"""
+        return {
+            "DATABASE_USER": ecs.Secret.from_secrets_manager(
+                self.instance.secret, "username"),
+            "DATABASE_PASSWORD": ecs.Secret.from_secrets_manager(
+                self.instance.secret, "password")
+        }
+
+    def allow_from(self, connectable: ec2.IConnectable):
+        """Permit connections to the database from the given resource"""
+        connectable.connections.allow_to(
+            other=self.instance,
+            port_range=ec2.Port.tcp(self.port),
+            description='Allow access to database'
+        )
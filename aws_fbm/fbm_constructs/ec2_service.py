@@ -8,9 +8,60 @@ from aws_cdk import aws_ecs as ecs
 from aws_cdk import aws_ec2 as ec2
 from aws_cdk import aws_logs as logs
 from aws_cdk import aws_autoscaling as autoscaling
+from aws_cdk import aws_iam as iam
 
 from typing import Optional, Sequence, Mapping
 
+# Lifecycle hook which holds new instances until their user data has run
+PREPARE_HOOK_NAME = "PrepareInstance"
+
+# Script run by instances on every boot when using a warm pool. While the
+# instance is prepared for the warm pool, it pulls the image of the task, so
+# that the task starts without pulling it when the instance is later put in
+# service. The launch lifecycle hook is then completed, which lets the
+# instance be stopped in the warm pool or put in service
+WARM_POOL_SCRIPT = """#!/bin/bash
+source /etc/warm-pool.env
+TOKEN=$(curl -s -X PUT http://169.254.169.254/latest/api/token \\
+  -H "X-aws-ec2-metadata-token-ttl-seconds: 300")
+metadata() {
+  curl -sf -H "X-aws-ec2-metadata-token: ${TOKEN}" \\
+    "http://169.254.169.254/latest/meta-data/$1"
+}
+INSTANCE_ID=$(metadata instance-id)
+REGION=$(metadata placement/region)
+until STATE=$(metadata autoscaling/target-lifecycle-state); do sleep 5; done
+# The AWS CLI is not part of the ECS-optimized AMI. It is installed from the
+# Amazon Linux core repository, which is hosted in S3 and reached through the
+# S3 gateway endpoint of the VPC, as the VPC has no internet access
+command -v aws > /dev/null || \
+  yum install -y --disablerepo='*' --enablerepo=amzn2-core awscli
+if [[ "${STATE}" == Warmed:* ]]; then
+  systemctl start docker
+  aws ecr get-login-password --region "${REGION}" | \\
+    docker login --username AWS --password-stdin "${IMAGE%%/*}"
+  docker pull "${IMAGE}"
+fi
+ASG_NAME=$(aws autoscaling describe-auto-scaling-instances \\
+  --region "${REGION}" --instance-ids "${INSTANCE_ID}" \\
+  --query "AutoScalingInstances[0].AutoScalingGroupName" --output text)
+aws autoscaling complete-lifecycle-action --region "${REGION}" \\
+  --lifecycle-hook-name "${HOOK_NAME}" --auto-scaling-group-name "${ASG_NAME}" \\
+  --instance-id "${INSTANCE_ID}" --lifecycle-action-result CONTINUE
+"""
+
+# Script run by instances on every boot to mount their first NVMe instance
+# store at MOUNT_DIR. The instance store is erased when the instance stops,
+# so it is formatted on every boot. Instances without an instance store use
+# a directory of their root volume instead
+INSTANCE_STORE_SCRIPT = """mkdir -p "${MOUNT_DIR}"
+DEVICE=$(lsblk -dpno NAME,MODEL | awk '/Instance Storage/ {print $1; exit}')
+if [ -n "${DEVICE}" ] && ! mountpoint -q "${MOUNT_DIR}"; then
+  mkfs.xfs -f "${DEVICE}"
+  mount -o noatime "${DEVICE}" "${MOUNT_DIR}"
+fi
+"""
+
 
 class EC2Service(Construct):
     """Create an EC2 service for running a Docker container"""
@@ -27,6 +78,14 @@ class EC2Service(Construct):
         docker_image_asset: ecr_assets.DockerImageAsset,
         task_name: str,
         file_system: FileSystem,
+        instance_types: Sequence[str] = ("g3s.xlarge",),
+        min_capacity: int = 0,
+        max_capacity: int = 1,
+        spot_percent: int = 0,
+        warm_pool_size: int = 0,
+        warm_pool_reuse: bool = True,
+        instance_store_dir: Optional[str] = None,
+        fuse: bool = False,
         entry_point: Optional[Sequence[str]] = None,
         environment: Optional[Mapping[str, str]] = None,
         secrets: Optional[Mapping[str, ecs.Secret]] = None,
@@ -34,6 +93,12 @@ class EC2Service(Construct):
     ):
         super().__init__(scope, id)
         volumes = volumes or []
+        if not instance_types:
+            raise ValueError("Configuration file error: at least one "
+                             "instance type must be specified")
+        if not 0 <= spot_percent <= 100:
+            raise ValueError(f"Configuration file error: spot percentage "
+                             f"{spot_percent} must be between 0 and 100")
 
         # Create the task definition
         self.task_definition = ecs.Ec2TaskDefinition(
@@ -65,6 +130,47 @@ class EC2Service(Construct):
         # Tell ECS to use GPU
         user_data.add_commands(
             f'echo "ECS_ENABLE_GPU_SUPPORT=true" >> /etc/ecs/ecs.config')
+        # Move the task to another instance when a spot instance is about to
+        # be interrupted
+        if spot_percent:
+            user_data.add_commands(
+                'echo "ECS_ENABLE_SPOT_INSTANCE_DRAINING=true" '
+                '>> /etc/ecs/ecs.config')
+        # The instance store is mounted before the ECS agent starts, which
+        # is after the user data and per-boot scripts have run
+        if instance_store_dir:
+            user_data.add_commands(
+                'STORE_SCRIPT=/var/lib/cloud/scripts/per-boot/'
+                'instance-store.sh',
+                'mkdir -p "$(dirname "${STORE_SCRIPT}")"',
+                f"cat > \"${{STORE_SCRIPT}}\" <<'EOF'\n"
+                f"#!/bin/bash\nMOUNT_DIR=\"{instance_store_dir}\"\n"
+                f"{INSTANCE_STORE_SCRIPT}EOF",
+                'chmod +x "${STORE_SCRIPT}"',
+                # Per-boot scripts run before the user data on the first boot
+                '"${STORE_SCRIPT}"')
+        # Instances in the warm pool pull the image of the task before being
+        # stopped, and do not join the cluster until they are put in service
+        if warm_pool_size:
+            user_data.add_commands(
+                'echo "ECS_WARM_POOLS_CHECK=true" >> /etc/ecs/ecs.config',
+                'echo "ECS_IMAGE_PULL_BEHAVIOR=prefer-cached" '
+                '>> /etc/ecs/ecs.config',
+                'SCRIPT=/var/lib/cloud/scripts/per-boot/warm-pool.sh',
+                'mkdir -p "$(dirname "${SCRIPT}")"',
+                f'echo \'IMAGE="{docker_image_asset.image_uri}"\' > '
+                f'/etc/warm-pool.env',
+                f'echo \'HOOK_NAME="{PREPARE_HOOK_NAME}"\' >> '
+                f'/etc/warm-pool.env',
+                f"cat > \"${{SCRIPT}}\" <<'EOF'\n"
+                f"{WARM_POOL_SCRIPT}EOF",
+                'chmod +x "${SCRIPT}"',
+                # Per-boot scripts run before the user data on the first boot,
+                # so it is run once the rest of the user data (which is added
+                # later, e.g. joining the cluster) has run, since the
+                # instance may be stopped as soon as the script completes
+                'systemd-run --no-block -p After=cloud-final.service '
+                '"${SCRIPT}"')
         # Register cluster - this additional user data is required if not using
         # the default cluster. If using the default cluster, it will be
         # added automatically so can be commented out here
@@ -82,26 +188,79 @@ class EC2Service(Construct):
             description='Allow access to file system from Fargate service'
         )
 
+        launch_role = Ec2LaunchRole(scope=self)
+
         launch_template = ec2.LaunchTemplate(
             self,
             "ASG-LaunchTemplate",
-            instance_type=ec2.InstanceType("g3s.xlarge"),
+            instance_type=ec2.InstanceType(instance_types[0]),
             machine_image=machine_image,
             user_data=user_data,
-            role=Ec2LaunchRole(scope=self),
+            role=launch_role,
             security_group=self.template_security_group,
             detailed_monitoring=True
          )
 
+        # Several instance types, or spot instances, require a mixed instances
+        # policy. Instances are launched from the first type which has
+        # capacity, in order of preference
+        if len(instance_types) > 1 or spot_percent:
+            mixed_instances_policy = autoscaling.MixedInstancesPolicy(
+                launch_template=launch_template,
+                launch_template_overrides=[
+                    autoscaling.LaunchTemplateOverrides(
+                        instance_type=ec2.InstanceType(instance_type))
+                    for instance_type in instance_types],
+                instances_distribution=autoscaling.InstancesDistribution(
+                    on_demand_allocation_strategy=autoscaling.
+                    OnDemandAllocationStrategy.PRIORITIZED,
+                    on_demand_base_capacity=0,
+                    on_demand_percentage_above_base_capacity=
+                    100 - spot_percent,
+                    spot_allocation_strategy=autoscaling.
+                    SpotAllocationStrategy.CAPACITY_OPTIMIZED_PRIORITIZED
+                )
+            )
+            launch_template = None
+        else:
+            mixed_instances_policy = None
+
         self.auto_scaling_group = autoscaling.AutoScalingGroup(
             self,
             "ASG",
             vpc=vpc,
             launch_template=launch_template,
-            min_capacity=0,
-            max_capacity=1,
+            mixed_instances_policy=mixed_instances_policy,
+            min_capacity=min_capacity,
+            max_capacity=max_capacity,
             cooldown=Duration.seconds(60)
         )
+        # Replace spot instances at risk of interruption before they are
+        # interrupted
+        if spot_percent:
+            self.auto_scaling_group.node.default_child.capacity_rebalance = True
+
+        # A warm pool keeps stopped instances which are already initialised
+        # and have pulled the image, so that the task can be placed within
+        # seconds rather than after booting and pulling a new instance
+        if warm_pool_size:
+            self.auto_scaling_group.add_warm_pool(
+                min_size=warm_pool_size,
+                pool_state=autoscaling.PoolState.STOPPED,
+                reuse_on_scale_in=warm_pool_reuse)
+            self.auto_scaling_group.add_lifecycle_hook(
+                "PrepareInstanceHook",
+                lifecycle_hook_name=PREPARE_HOOK_NAME,
+                lifecycle_transition=autoscaling.LifecycleTransition.
+                INSTANCE_LAUNCHING,
+                default_result=autoscaling.DefaultResult.CONTINUE,
+                heartbeat_timeout=Duration.minutes(30))
+            # The group is not known when the role is created, as the group
+            # depends on the role through the launch template
+            launch_role.add_to_policy(iam.PolicyStatement(
+                actions=["autoscaling:DescribeAutoScalingInstances",
+                         "autoscaling:CompleteLifecycleAction"],
+                resources=["*"]))
 
         self.capacity_provider = ecs.AsgCapacityProvider(
             self,
@@ -112,6 +271,18 @@ class EC2Service(Construct):
 
         cluster.add_asg_capacity_provider(self.capacity_provider)
 
+        # FUSE file systems (e.g. an S3 bucket) may be mounted in the
+        # container
+        linux_parameters = None
+        if fuse:
+            linux_parameters = ecs.LinuxParameters(self, "LinuxParameters")
+            linux_parameters.add_capabilities(ecs.Capability.SYS_ADMIN)
+            linux_parameters.add_devices(ecs.Device(
+                host_path="/dev/fuse",
+                permissions=[ecs.DevicePermission.READ,
+                             ecs.DevicePermission.WRITE,
+                             ecs.DevicePermission.MKNOD]))
+
         # Add the Docker container
         self.container = self.task_definition.add_container(
             id=task_name,
@@ -123,6 +294,7 @@ class EC2Service(Construct):
             cpu=cpu,
             memory_limit_mib=memory_limit_mib,
             entry_point=entry_point,
+            linux_parameters=linux_parameters,
             logging=ecs.LogDrivers.aws_logs(
                 stream_prefix=task_name,
                 log_retention=logs.RetentionDays.THREE_DAYS)
@@ -12,7 +12,61 @@ from aws_cdk import aws_elasticloadbalancingv2 as elb
 from aws_cdk import aws_certificatemanager as acm
 from constructs import Construct
 
-from typing import Optional, Sequence, Mapping
+from dataclasses import dataclass
+from typing import Optional, Sequence, Mapping, Tuple
+
+
+@dataclass
+class ServiceScaling:
+    """Number of tasks of a service. When max_count is greater than
+    min_count, the number of tasks is scaled between them to keep each of the
+    given metrics near its target"""
+
+    # Minimum and maximum number of tasks
+    min_count: int = 1
+    max_count: int = 1
+
+    # Optional: target average cpu utilisation of the tasks, in percent
+    cpu_percent: Optional[int] = None
+
+    # Optional: target average memory utilisation of the tasks, in percent
+    memory_percent: Optional[int] = None
+
+    # Optional: target number of load balancer requests per task per minute.
+    # Only for http services
+    requests_per_target: Optional[int] = None
+
+    # Seconds to wait after scaling out before scaling in, and after scaling
+    # in before scaling in again. Scaling out is faster, so that tasks are
+    # added as soon as a round starts
+    scale_in_cooldown: int = 300
+    scale_out_cooldown: int = 60
+
+    def __post_init__(self):
+        if not 1 <= self.min_count <= self.max_count:
+            raise ValueError(f"Configuration file error: the minimum number "
+                             f"of tasks {self.min_count} must be at least 1 "
+                             f"and at most the maximum {self.max_count}")
+        if self.scales and not (self.cpu_percent or self.memory_percent or
+                                self.requests_per_target):
+            raise ValueError("Configuration file error: a scaling target "
+                             "(cpu, memory or requests) is required when the "
+                             "maximum number of tasks exceeds the minimum")
+
+    @property
+    def scales(self) -> bool:
+        return self.max_count > self.min_count
+
+
+def healthy_percents(scaling: ServiceScaling) -> Tuple[int, int]:
+    """Minimum and maximum percent of the desired tasks kept running during a
+    deployment. A single fixed task is stopped before its replacement starts,
+    so that deployments do not need capacity for two tasks. Other services
+    start replacements before stopping half of their tasks, so that they keep
+    serving even when auto scaling has brought them down to a single task"""
+    if not scaling.scales and scaling.min_count == 1:
+        return 0, 100
+    return 50, 200
 
 
 class FargateService(Construct):
@@ -36,6 +90,8 @@ class FargateService(Construct):
         redirect_http: bool,
         use_https: bool,
         idle_timeout: int = 60,
+        health_check_path: Optional[str] = None,
+        scaling: Optional[ServiceScaling] = None,
         file_system: Optional[FileSystem] = None,
         entry_point: Optional[Sequence[str]] = None,
         environment: Optional[Mapping[str, str]] = None,
@@ -46,6 +102,8 @@ class FargateService(Construct):
         self.listener_port = listener_port
         self.use_https = use_https
         self.redirect_http = redirect_http
+        self.health_check_path = health_check_path
+        scaling = scaling or ServiceScaling()
 
         if volumes and not file_system:
             raise RuntimeError("file_system must be specified if volumes are"
@@ -105,11 +163,17 @@ class FargateService(Construct):
             dns_name=dns_name,
             domain_zone=domain_zone,
             public_zone=public_zone,
-            idle_timeout=idle_timeout
+            idle_timeout=idle_timeout,
+            # With auto scaling, the scalable target owns the number of tasks,
+            # so that a deployment does not reset it to the minimum
+            desired_count=None if scaling.scales else scaling.min_count,
+            healthy_percents=healthy_percents(scaling)
         )
 
         self.service = self.load_balanced_service.service
         self.load_balancer = self.load_balanced_service.load_balancer
+        if scaling.scales:
+            self.configure_scaling(scaling)
 
         # Allow service to access EFS file system
         if file_system:
@@ -124,10 +188,42 @@ class FargateService(Construct):
                        dns_name: str,
                        domain_zone: route53.IHostedZone,
                        public_zone: route53.IHostedZone,
-                       idle_timeout: int):
-        """Create the load balanced service"""
+                       idle_timeout: int,
+                       desired_count: Optional[int],
+                       healthy_percents: Tuple[int, int]):
+        """Create the load balanced service, with `desired_count` tasks unless
+        auto scaling sets the number of tasks"""
         raise NotImplementedError
 
+    def configure_scaling(self, scaling: ServiceScaling):
+        """Scale the number of tasks with target tracking policies"""
+        task_count = self.service.auto_scale_task_count(
+            min_capacity=scaling.min_count,
+            max_capacity=scaling.max_count)
+        cooldowns = dict(
+            scale_in_cooldown=Duration.seconds(scaling.scale_in_cooldown),
+            scale_out_cooldown=Duration.seconds(scaling.scale_out_cooldown))
+        if scaling.cpu_percent:
+            task_count.scale_on_cpu_utilization(
+                "CpuScaling",
+                target_utilization_percent=scaling.cpu_percent,
+                **cooldowns)
+        if scaling.memory_percent:
+            task_count.scale_on_memory_utilization(
+                "MemoryScaling",
+                target_utilization_percent=scaling.memory_percent,
+                **cooldowns)
+        if scaling.requests_per_target:
+            self.scale_on_requests(task_count, scaling, cooldowns)
+
+    def scale_on_requests(self,
+                          task_count: ecs.ScalableTaskCount,
+                          scaling: ServiceScaling,
+                          cooldowns: Mapping[str, Duration]):
+        """Scale on the number of load balancer requests per task"""
+        raise ValueError("Configuration file error: scaling on requests is "
+                         "only supported by http services")
+
     def allow_from_ip_range(self, cidr_range: str):
         """Permit access to this service from the given range"""
         raise NotImplementedError
@@ -141,7 +237,9 @@ class HttpService(FargateService):
                        dns_name: str,
                        domain_zone: route53.IHostedZone,
                        public_zone: route53.IHostedZone,
-                       idle_timeout: int):
+                       idle_timeout: int,
+                       desired_count: Optional[int],
+                       healthy_percents: Tuple[int, int]):
         if self.use_https and not public_zone:
             raise ValueError("Configuration file error: if use_https is True, "
                              "then public_zone must be defined")
@@ -152,26 +250,60 @@ class HttpService(FargateService):
             validation=acm.CertificateValidation.from_dns(public_zone),
         ) if self.use_https else None
 
-        return ecs_patterns.ApplicationLoadBalancedFargateService(
-            self, "LbFargateService",
-            cluster=cluster,
-            desired_count=1,
-            min_healthy_percent=0,
-            max_healthy_percent=100,
-            task_definition=self.task_definition,
-            circuit_breaker=ecs.DeploymentCircuitBreaker(rollback=True),
-            assign_public_ip=False,
-            domain_name=dns_name,
-            listener_port=self.listener_port,
-            protocol=elb.ApplicationProtocol.HTTPS if
-            self.use_https else elb.ApplicationProtocol.HTTP,
-            certificate=certificate,
-            redirect_http=self.redirect_http,
-            open_listener=False,
-            public_load_balancer=False,
-            domain_zone=domain_zone,
-            idle_timeout=Duration.seconds(idle_timeout)
-        )
+        load_balanced_service = \
+            ecs_patterns.ApplicationLoadBalancedFargateService(
+                self, "LbFargateService",
+                cluster=cluster,
+                desired_count=desired_count,
+                min_healthy_percent=healthy_percents[0],
+                max_healthy_percent=healthy_percents[1],
+                task_definition=self.task_definition,
+                circuit_breaker=ecs.DeploymentCircuitBreaker(rollback=True),
+                assign_public_ip=False,
+                domain_name=dns_name,
+                listener_port=self.listener_port,
+                protocol=elb.ApplicationProtocol.HTTPS if
+                self.use_https else elb.ApplicationProtocol.HTTP,
+                certificate=certificate,
+                redirect_http=self.redirect_http,
+                open_listener=False,
+                public_load_balancer=False,
+                domain_zone=domain_zone,
+                idle_timeout=Duration.seconds(idle_timeout)
+            )
+
+        # A dedicated health check endpoint is checked more often than the
+        # default (every 30s, healthy after 5 successes), so that new tasks
+        # receive requests within seconds of being ready
+        if self.health_check_path:
+            load_balanced_service.target_group.configure_health_check(
+                path=self.health_check_path,
+                interval=Duration.seconds(5),
+                timeout=Duration.seconds(4),
+                healthy_threshold_count=2,
+                unhealthy_threshold_count=3,
+                healthy_http_codes="200"
+            )
+        return load_balanced_service
+
+    def scale_on_requests(self,
+                          task_count: ecs.ScalableTaskCount,
+                          scaling: ServiceScaling,
+                          cooldowns: Mapping[str, Duration]):
+        task_count.scale_on_request_count(
+            "RequestCountScaling",
+            requests_per_target=scaling.requests_per_target,
+            target_group=self.load_balanced_service.target_group,
+            **cooldowns)
+
+    def deny_path(self, path_pattern: str, priority: int):
+        """Answer requests for the given path on the load balancer with 404,
+        so that they never reach the tasks"""
+        self.load_balanced_service.listener.add_action(
+            f"Deny{priority}",
+            priority=priority,
+            conditions=[elb.ListenerCondition.path_patterns([path_pattern])],
+            action=elb.ListenerAction.fixed_response(404))
 
     def allow_from_ip_range(self, cidr_range: str):
         self.load_balancer.connections.allow_from(
@@ -192,13 +324,15 @@ class TcpService(FargateService):
                        dns_name: str,
                        domain_zone: route53.IHostedZone,
                        public_zone: route53.IHostedZone,
-                       idle_timeout: int):
+                       idle_timeout: int,
+                       desired_count: Optional[int],
+                       healthy_percents: Tuple[int, int]):
         load_balanced_service = ecs_patterns.NetworkLoadBalancedFargateService(
             self, "LbFargateService",
             cluster=cluster,
-            desired_count=1,
-            min_healthy_percent=0,
-            max_healthy_percent=100,
+            desired_count=desired_count,
+            min_healthy_percent=healthy_percents[0],
+            max_healthy_percent=healthy_percents[1],
             task_definition=self.task_definition,
             circuit_breaker=ecs.DeploymentCircuitBreaker(rollback=True),
             assign_public_ip=False,
@@ -213,3 +347,11 @@ class TcpService(FargateService):
         self.service.connections.allow_from(
             ec2.Peer.ipv4(cidr_range),
             ec2.Port.tcp(self.listener_port))
+
+    def enable_source_ip_stickiness(self):
+        """Route the connections of each client to the same task while it is
+        healthy, e.g. so that a client which reconnects finds the session
+        state kept by the task"""
+        target_group = self.load_balanced_service.target_group
+        target_group.set_attribute("stickiness.enabled", "true")
+        target_group.set_attribute("stickiness.type", "source_ip")
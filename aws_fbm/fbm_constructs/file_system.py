@@ -1,5 +1,7 @@
 from constructs import Construct
-from aws_cdk import aws_ec2, aws_efs, RemovalPolicy
+from aws_cdk import aws_ec2, aws_efs, RemovalPolicy, Size
+
+from typing import Optional
 
 
 class Volume(Construct):
@@ -36,23 +38,77 @@ class Volume(Construct):
 
 
 class FileSystem(Construct):
-    """An ECS file system which may host multiple volumes"""
+    """An ECS file system which may host multiple volumes
+
+    throughput_mode is "bursting" (throughput grows with the amount stored,
+    and is limited once burst credits are spent), "elastic" (throughput
+    scales with the workload, charged per GiB transferred) or "provisioned"
+    (provisioned_throughput_mibps is always available). performance_mode is
+    "general_purpose" or "max_io". Files which have not been accessed for
+    infrequent_access_days days are moved to infrequent access storage, and
+    moved back when next accessed"""
 
-    def __init__(self, scope: Construct, id: str, vpc: aws_ec2.Vpc):
+    def __init__(self, scope: Construct, id: str, vpc: aws_ec2.Vpc,
+                 throughput_mode: str = "bursting",
+                 provisioned_throughput_mibps: Optional[int] = None,
+                 performance_mode: str = "general_purpose",
+                 infrequent_access_days: Optional[int] = None):
         super().__init__(scope=scope, id=id)
 
+        throughput_modes = {
+            "bursting": aws_efs.ThroughputMode.BURSTING,
+            "elastic": aws_efs.ThroughputMode.ELASTIC,
+            "provisioned": aws_efs.ThroughputMode.PROVISIONED
+        }
+        performance_modes = {
+            "general_purpose": aws_efs.PerformanceMode.GENERAL_PURPOSE,
+            "max_io": aws_efs.PerformanceMode.MAX_IO
+        }
+        lifecycle_policies = {
+            1: aws_efs.LifecyclePolicy.AFTER_1_DAY,
+            7: aws_efs.LifecyclePolicy.AFTER_7_DAYS,
+            14: aws_efs.LifecyclePolicy.AFTER_14_DAYS,
+            30: aws_efs.LifecyclePolicy.AFTER_30_DAYS,
+            60: aws_efs.LifecyclePolicy.AFTER_60_DAYS,
+            90: aws_efs.LifecyclePolicy.AFTER_90_DAYS
+        }
+        if throughput_mode not in throughput_modes:
+            raise ValueError(f"Configuration file error: unknown EFS "
+                             f"throughput mode {throughput_mode}")
+        if performance_mode not in performance_modes:
+            raise ValueError(f"Configuration file error: unknown EFS "
+                             f"performance mode {performance_mode}")
+        if (throughput_mode == "provisioned") != \
+                bool(provisioned_throughput_mibps):
+            raise ValueError("Configuration file error: a provisioned EFS "
+                             "throughput is required for, and only for, the "
+                             "provisioned throughput mode")
+        if throughput_mode == "elastic" and performance_mode == "max_io":
+            raise ValueError("Configuration file error: the elastic EFS "
+                             "throughput mode requires the general_purpose "
+                             "performance mode")
+        if infrequent_access_days and \
+                infrequent_access_days not in lifecycle_policies:
+            raise ValueError(f"Configuration file error: EFS infrequent "
+                             f"access days must be one of "
+                             f"{', '.join(map(str, lifecycle_policies))}")
+
         self.file_system = aws_efs.FileSystem(
             self,
             "EfsFileSystem",
             vpc=vpc,
             removal_policy=RemovalPolicy.DESTROY,  # ToDo: change to persist
-            # lifecycle_policy=efs.LifecyclePolicy.AFTER_7_DAYS,
-            # files are not transitioned to infrequent access (IA) storage by
-            # default
-            # performance_mode=efs.PerformanceMode.GENERAL_PURPOSE,
-            # default
-            # out_of_infrequent_access_policy=
-            #   efs.OutOfInfrequentAccessPolicy.AFTER_1_ACCESS,
+            throughput_mode=throughput_modes[throughput_mode],
+            provisioned_throughput_per_second=Size.mebibytes(
+                provisioned_throughput_mibps)
+            if provisioned_throughput_mibps else None,
+            # Note: changing the performance mode replaces the file system
+            performance_mode=performance_modes[performance_mode],
+            lifecycle_policy=lifecycle_policies[infrequent_access_days]
+            if infrequent_access_days else None,
+            out_of_infrequent_access_policy=
+            aws_efs.OutOfInfrequentAccessPolicy.AFTER_1_ACCESS
+            if infrequent_access_days else None
         )
 
     def create_volume(self, name: str, root_directory: str, mount_dir: str):
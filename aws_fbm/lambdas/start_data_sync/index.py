@@ -0,0 +1,58 @@
+"""Lambda function starting a DataSync task for objects changed in a bucket
+
+The function receives batches of S3 object created and deleted events,
+delivered by EventBridge to an SQS queue. The queue holds the events of a
+burst of uploads so that they start a single task execution, which only
+transfers the directories containing the changed objects.
+"""
+
+import json
+import os
+
+# Maximum length of the include filter of a task execution
+MAX_FILTER_LENGTH = 102400
+
+
+def changed_directories(keys):
+    """Return the directories of the bucket containing the given object keys,
+    excluding directories within another directory of the result. An empty
+    string stands for the whole bucket"""
+    directories = set()
+    for key in keys:
+        directories.add(key.rstrip("/").rpartition("/")[0])
+    if "" in directories:
+        return [""]
+    result = []
+    for directory in sorted(directories):
+        if not result or not directory.startswith(result[-1] + "/"):
+            result.append(directory)
+    return result
+
+
+def include_filter(directories):
+    """Return the DataSync include filter transferring only the given
+    directories, or None to transfer the whole bucket"""
+    if not directories or "" in directories:
+        return None
+    value = "|".join(f"/{directory}" for directory in directories)
+    return value if len(value) <= MAX_FILTER_LENGTH else None
+
+
+def handler(event, context):
+    # boto3 is provided by the Lambda runtime, but is not a dependency of the
+    # CDK app, whose unit tests import this module
+    import boto3
+
+    keys = [json.loads(record["body"])["detail"]["object"]["key"]
+            for record in event["Records"]]
+    arguments = {"TaskArn": os.environ["TASK_ARN"]}
+    includes = include_filter(changed_directories(keys))
+    if includes:
+        arguments["Includes"] = [{"FilterType": "SIMPLE_PATTERN",
+                                  "Value": includes}]
+    # If an execution is running, this execution is queued when task
+    # queueing is enabled, and otherwise fails so that the events are
+    # received again after the visibility timeout of the queue
+    execution = boto3.client("datasync").start_task_execution(**arguments)
+    print(f"Started {execution['TaskExecutionArn']} for {len(keys)} "
+          f"changed objects, including {includes or 'all objects'}")
@@ -26,5 +26,8 @@ class DataImportStack(Stack):
             object_ownership=s3.ObjectOwnership.BUCKET_OWNER_ENFORCED,
             enforce_ssl=True,
             versioned=False,
-            access_control=s3.BucketAccessControl.PRIVATE
+            access_control=s3.BucketAccessControl.PRIVATE,
+            # Changes to the bucket start copies of the data to the node
+            event_bridge_enabled=node_config.data_sync_events and
+            node_config.node_data_source == "efs"
         )
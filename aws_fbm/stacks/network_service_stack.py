@@ -1,6 +1,8 @@
-from aws_fbm.fbm_constructs.fargate_service import HttpService, TcpService
+from aws_fbm.fbm_constructs.fargate_service import HttpService, TcpService, \
+    ServiceScaling
 from aws_fbm.stacks.network_stack import NetworkStack
-from aws_fbm.utils.utils import repo_path
+from aws_fbm.utils.config import NetworkConfig
+from aws_fbm.utils.utils import repo_path, gunicorn_environment
 
 from constructs import Construct
 from aws_cdk import Stack
@@ -21,6 +23,7 @@ class NetworkServiceStack(Stack):
 
     def __init__(self, scope: Construct,
                  network_stack: NetworkStack,
+                 network_config: NetworkConfig,
                  env: Environment):
         super().__init__(scope=scope,
                          id=f"{network_stack.name_prefix}NetworkServiceStack",
@@ -50,6 +53,56 @@ class NetworkServiceStack(Stack):
             directory=str(repo_path() / "docker" / "mqtt"),
             file='Dockerfile'
         )
+        # The mosquitto configuration is generated from these variables (see
+        # docker/mqtt/entrypoint.sh)
+        mqtt_environment = {
+            "MQTT_MAX_INFLIGHT_MESSAGES":
+                str(network_config.mqtt_max_inflight_messages),
+            "MQTT_MAX_QUEUED_MESSAGES":
+                str(network_config.mqtt_max_queued_messages),
+            "MQTT_PERSISTENCE":
+                "true" if network_config.mqtt_persistence else "false",
+            "MQTT_AUTOSAVE_INTERVAL":
+                str(network_config.mqtt_autosave_interval)
+        }
+        if network_config.mqtt_max_message_size_mib:
+            mqtt_environment["MQTT_MAX_PACKET_SIZE"] = \
+                str(network_config.mqtt_max_message_size_mib * 1024 * 1024)
+        if network_config.mqtt_max_keepalive:
+            mqtt_environment["MQTT_MAX_KEEPALIVE"] = \
+                str(network_config.mqtt_max_keepalive)
+
+        # With bridged brokers, clients connect to one of several brokers,
+        # which exchange all messages through a central broker. mosquitto
+        # uses a single thread, so each broker has one vCPU
+        self.mqtt_core_service = None
+        if network_config.mqtt_bridged_brokers:
+            self.mqtt_core_service = TcpService(
+                scope=self,
+                id="MqttCoreService",
+                cluster=self.cluster,
+                dns_name=f"mqtt-core.{network_stack.dns_domain}",
+                domain_zone=network_stack.hosted_zone,
+                public_zone=network_stack.public_hosted_zone,
+                cpu=1024,
+                memory_limit_mib=4096,
+                ephemeral_storage_gib=40,
+                docker_image_asset=mqtt_docker_image,
+                task_name="mqtt-core",
+                container_port=self.mqtt_port,
+                listener_port=self.mqtt_port,
+                use_https=False,
+                redirect_http=False,
+                environment=mqtt_environment
+            )
+            self.mqtt_core_service.allow_from_ip_range(
+                network_stack.vpc.vpc_cidr_block)
+            mqtt_environment = {
+                **mqtt_environment,
+                "MQTT_BRIDGE_ADDRESS":
+                    f"mqtt-core.{network_stack.dns_domain}:{self.mqtt_port}"
+            }
+
         # Create mqtt service
         self.mqtt_service = TcpService(
             scope=self,
@@ -58,7 +111,7 @@ class NetworkServiceStack(Stack):
             dns_name=self.mqtt_dns_host,
             domain_zone=network_stack.hosted_zone,
             public_zone=network_stack.public_hosted_zone,
-            cpu=512,
+            cpu=1024,
             memory_limit_mib=4096,
             ephemeral_storage_gib=40,
             docker_image_asset=mqtt_docker_image,
@@ -66,8 +119,17 @@ class NetworkServiceStack(Stack):
             container_port=self.mqtt_port,
             listener_port=self.mqtt_port,
             use_https=False,
-            redirect_http=False
+            redirect_http=False,
+            scaling=ServiceScaling(
+                min_count=max(1, network_config.mqtt_bridged_brokers),
+                max_count=max(1, network_config.mqtt_bridged_brokers)),
+            environment=mqtt_environment
         )
+        # Persistent sessions and their queued messages are held by the
+        # broker to which the client was connected, so a client which
+        # reconnects must reach the same broker
+        if network_config.mqtt_bridged_brokers:
+            self.mqtt_service.enable_source_ip_stickiness()
 
         # Restful container
         restful_docker_image = DockerImageAsset(
@@ -76,6 +138,77 @@ class NetworkServiceStack(Stack):
             directory=str(repo_path() / "docker" / "restful"),
             file='Dockerfile'
         )
+        # gunicorn workers are sized for the cpu and memory of the task,
+        # unless set in the configuration. The default uvicorn workers serve
+        # requests from event loops, so that many nodes can transfer files at
+        # the same time
+        restful_cpu = 512
+        restful_memory_limit_mib = 4096
+        restful_environment = gunicorn_environment(
+            cpu=restful_cpu,
+            memory_limit_mib=restful_memory_limit_mib,
+            worker_class=network_config.restful_worker_class,
+            workers=network_config.restful_workers,
+            threads=network_config.restful_threads,
+            log_level=network_config.restful_log_level)
+        # Uploaded files are stored in the S3 bucket if there is one,
+        # otherwise on the ephemeral storage of the task
+        if network_stack.uploads_bucket:
+            restful_environment.update({
+                "STORAGE_BACKEND": "s3",
+                "STORAGE_BUCKET_NAME": network_stack.uploads_bucket.bucket_name,
+                "STORAGE_REGION": self.region
+            })
+        # The database persists uploads metadata across deployments if there
+        # is one, otherwise a SQLite file on the ephemeral storage is used
+        restful_secrets = {}
+        if network_stack.database:
+            restful_environment.update(network_stack.database.environment())
+            restful_secrets.update(network_stack.database.secrets())
+
+        # Uploads are deleted after the retention period, and the least
+        # recently used are deleted when over quota. Uploads stored on the
+        # ephemeral storage are limited to 75% of that storage by default
+        restful_ephemeral_storage_gib = 40
+        quota_gib = network_config.restful_quota_gib
+        if quota_gib is None and not network_stack.uploads_bucket:
+            quota_gib = restful_ephemeral_storage_gib * 3 // 4
+        if quota_gib:
+            restful_environment["RETENTION_QUOTA_BYTES"] = \
+                str(quota_gib * 1024 ** 3)
+        if network_config.restful_retention_days:
+            restful_environment["RETENTION_MAX_AGE_DAYS"] = \
+                str(network_config.restful_retention_days)
+        if network_config.restful_compression:
+            if network_config.restful_compression not in \
+                    ("zstd", "gzip", "none"):
+                raise ValueError(f"Configuration file error: unknown "
+                                 f"restful_compression "
+                                 f"{network_config.restful_compression}")
+            restful_environment["STORAGE_COMPRESSION"] = \
+                network_config.restful_compression
+
+        # Several restful tasks share the uploads bucket and the database, and
+        # keep resumable upload sessions on the network file system, so that
+        # the chunks of a session may be sent to any task
+        restful_scaling = ServiceScaling(
+            min_count=network_config.restful_min_count,
+            max_count=network_config.restful_max_count,
+            cpu_percent=network_config.restful_scaling_cpu_percent,
+            memory_percent=network_config.restful_scaling_memory_percent,
+            requests_per_target=
+            network_config.restful_scaling_requests_per_target)
+        restful_volumes = []
+        if restful_scaling.max_count > 1:
+            if not (network_stack.uploads_bucket and network_stack.database):
+                raise ValueError("Configuration file error: more than one "
+                                 "restful task requires restful_storage s3 "
+                                 "and restful_database postgres")
+            restful_volumes.append(network_stack.file_system.create_volume(
+                name="restful-sessions", root_directory="/restful/sessions",
+                mount_dir="/data/sessions"))
+            restful_environment["UPLOAD_SESSION_ROOT"] = "/data/sessions/"
+
         # Create restful service
         self.restful_service = HttpService(
             scope=self,
@@ -84,16 +217,32 @@ class NetworkServiceStack(Stack):
             dns_name=self.restful_dns_host,
             domain_zone=network_stack.hosted_zone,
             public_zone=network_stack.public_hosted_zone,
-            cpu=512,
-            memory_limit_mib=4096,
-            ephemeral_storage_gib=40,
+            cpu=restful_cpu,
+            memory_limit_mib=restful_memory_limit_mib,
+            ephemeral_storage_gib=restful_ephemeral_storage_gib,
             docker_image_asset=restful_docker_image,
             task_name="restful",
             container_port=self.restful_port,
             listener_port=443 if network_stack.use_https else 80,
             use_https=network_stack.use_https,
-            redirect_http=network_stack.use_https
+            redirect_http=network_stack.use_https,
+            # New tasks are ready as soon as gunicorn serves the readiness
+            # check, as the image is pre-baked (see docker/restful)
+            health_check_path="/healthz",
+            scaling=restful_scaling,
+            environment=restful_environment,
+            secrets=restful_secrets,
+            file_system=network_stack.file_system if restful_volumes else None,
+            volumes=restful_volumes
         )
+        # Metrics are for monitoring within the VPC, not for the clients of
+        # the load balancer
+        self.restful_service.deny_path("/metrics", priority=1)
+        if network_stack.uploads_bucket:
+            network_stack.uploads_bucket.grant_read_write(
+                self.restful_service.task_definition.task_role)
+        if network_stack.database:
+            network_stack.database.allow_from(self.restful_service.service)
 
     def allow_from_ip_range(self, cidr_range: str):
         """Allow connections to network services from the given cidr range"""
@@ -1,15 +1,17 @@
 from aws_fbm.stacks.base_stack import BaseStack
+from aws_fbm.fbm_constructs.database import Database
 from aws_fbm.fbm_constructs.file_system import FileSystem
 from aws_fbm.utils.config import NetworkConfig
 
-from aws_cdk import Environment
+from aws_cdk import Duration, Environment
+from aws_cdk import aws_s3 as s3
 from constructs import Construct
 
 
 class NetworkStack(BaseStack):
     """CDK stack defining the core configuration for the FBM network
-    component. This defines stateful configuration such as VPC, VPN and
-    the file system.
+    component. This defines stateful configuration such as VPC, VPN,
+    the file system and the database.
     """
 
     def __init__(self, scope: Construct,
@@ -37,5 +39,47 @@ class NetworkStack(BaseStack):
         self.file_system = FileSystem(
             scope=self,
             id="FileSystem",
-            vpc=self.vpc
+            vpc=self.vpc,
+            throughput_mode=network_config.efs_throughput_mode,
+            provisioned_throughput_mibps=
+            network_config.efs_provisioned_throughput_mibps,
+            performance_mode=network_config.efs_performance_mode,
+            infrequent_access_days=network_config.efs_infrequent_access_days
         )
+
+        # Create bucket for files uploaded to the restful service
+        if network_config.restful_storage == "s3":
+            self.uploads_bucket = s3.Bucket(
+                self,
+                "UploadsBucket",
+                block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+                object_ownership=s3.ObjectOwnership.BUCKET_OWNER_ENFORCED,
+                encryption=s3.BucketEncryption.S3_MANAGED,
+                enforce_ssl=True,
+                versioned=False,
+                lifecycle_rules=[s3.LifecycleRule(
+                    abort_incomplete_multipart_upload_after=Duration.days(1)
+                )]
+            )
+        elif network_config.restful_storage == "filesystem":
+            self.uploads_bucket = None
+        else:
+            raise ValueError(f"Configuration file error: unknown "
+                             f"restful_storage "
+                             f"{network_config.restful_storage}")
+
+        # Create database for the restful service
+        if network_config.restful_database == "postgres":
+            self.database = Database(
+                scope=self,
+                id="RestfulDatabase",
+                vpc=self.vpc,
+                database_name="fedbiomed",
+                instance_type=network_config.restful_database_instance_type
+            )
+        elif network_config.restful_database == "sqlite":
+            self.database = None
+        else:
+            raise ValueError(f"Configuration file error: unknown "
+                             f"restful_database "
+                             f"{network_config.restful_database}")
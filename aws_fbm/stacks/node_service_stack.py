@@ -35,6 +35,8 @@ class NodeServiceStack(Stack):
                          env=env)
 
         self.gui_dns_host = f"gui.{node_stack.hosted_zone.zone_name}"
+        self.instance_store_dir = "/scratch"
+        self.data_staging_source = "/efs-data"
 
         # Create cluster
         self.cluster = ecs.Cluster(
@@ -55,6 +57,35 @@ class NodeServiceStack(Stack):
             name="common", root_directory='/node/common',
             mount_dir="/fedbiomed/envs/common")
 
+        # The node reads its data from /data, which holds the node data on
+        # EFS, or a copy of it on the local disk of the instance if staging
+        # data. With the s3 data source, the import bucket is mounted at
+        # /data instead, with a cache on the local disk if staging data
+        node_environment = {}
+        node_volumes = [node_config_volume, node_etc_volume, node_var_volume,
+                        node_common_volume]
+        local_data_dir = None
+        if node_config.node_data_source == "s3":
+            node_environment.update({
+                "DATA_BUCKET": node_config.import_bucket_name,
+                "DATA_BUCKET_REGION": self.region
+            })
+            if node_config.node_data_staging:
+                local_data_dir = "/data-cache"
+                node_environment["DATA_BUCKET_CACHE"] = local_data_dir
+        elif node_config.node_data_staging:
+            local_data_dir = "/data"
+            node_volumes.append(file_system.create_volume(
+                name="data-source", root_directory='/node/data',
+                mount_dir=self.data_staging_source))
+            node_environment.update({
+                "DATA_STAGING_SOURCE": self.data_staging_source,
+                "DATA_STAGING_INTERVAL":
+                    f"{node_config.node_data_staging_interval}"
+            })
+        else:
+            node_volumes.append(node_data_volume)
+
         # Docker image for node
         node_docker_image = DockerImageAsset(
             self,
@@ -68,12 +99,21 @@ class NodeServiceStack(Stack):
             id="NodeService",
             vpc=node_stack.vpc,
             cluster=self.cluster,
-            cpu=4096,
-            gpu_count=1,
-            memory_limit_mib=30000,
+            cpu=node_config.node_cpu,
+            gpu_count=node_config.node_gpu_count,
+            memory_limit_mib=node_config.node_memory_limit_mib,
             docker_image_asset=node_docker_image,
             task_name="node",
             file_system=file_system,
+            instance_types=node_config.node_instance_types,
+            min_capacity=node_config.node_min_capacity,
+            max_capacity=node_config.node_max_capacity,
+            spot_percent=node_config.node_spot_percent,
+            warm_pool_size=node_config.node_warm_pool_size,
+            warm_pool_reuse=node_config.node_warm_pool_reuse,
+            instance_store_dir=self.instance_store_dir
+            if local_data_dir else None,
+            fuse=node_config.node_data_source == "s3",
             environment={
                 "MQTT_BROKER": mqtt_broker,
                 "MQTT_BROKER_PORT": f"{mqtt_port}",
@@ -81,11 +121,20 @@ class NodeServiceStack(Stack):
                 "ENABLE_TRAINING_PLAN_APPROVAL":
                     bool_to_str(node_config.enable_training_plan_approval),
                 "ALLOW_DEFAULT_TRAINING_PLANS":
-                    bool_to_str(node_config.allow_default_training_plans)
+                    bool_to_str(node_config.allow_default_training_plans),
+                **node_environment
             },
-            volumes=[node_config_volume, node_data_volume, node_etc_volume,
-                     node_var_volume, node_common_volume]
+            volumes=node_volumes
         )
+        if local_data_dir:
+            self.node_service.task_definition.add_volume(
+                name="staged-data",
+                host=ecs.Host(source_path=f"{self.instance_store_dir}/data"))
+            self.node_service.container.add_mount_points(ecs.MountPoint(
+                source_volume="staged-data",
+                container_path=local_data_dir,
+                read_only=False
+            ))
 
         # Docker image for gui
         gui_docker_image = DockerImageAsset(
@@ -5,6 +5,7 @@ from aws_fbm.utils.config import NodeConfig
 from aws_fbm.stacks.data_import_stack import DataImportStack
 
 from aws_cdk import Environment
+from aws_cdk import aws_ec2 as ec2
 from constructs import Construct
 
 
@@ -38,23 +39,57 @@ class NodeStack(BaseStack):
         )
         self.name_prefix = node_config.name_prefix
 
+        # Instances of the warm pool complete their lifecycle hook through
+        # the Auto Scaling API, which the VPC cannot reach otherwise
+        if node_config.node_warm_pool_size:
+            self.add_interface_endpoint(
+                name="AutoScalingEndpoint",
+                service=ec2.InterfaceVpcEndpointAwsService.AUTOSCALING)
+
         # Create file system and volumes for node stack
         self.file_system = FileSystem(
             scope=self,
             id="FileSystem",
-            vpc=self.vpc
-        )
-
-        # Set up DataSync from S3 bucket to EFS node storage
-        self.data_sync = DataSync(
-            scope=self,
-            id="DataSync",
-            bucket_name=data_import_stack.import_bucket.bucket_name,
-            site_description=node_config.site_description,
-            file_system=self.file_system.file_system,
             vpc=self.vpc,
-            subnet_arn=f'arn:aws:ec2:{self.region}:{self.account}:'
-                       f'subnet/{self.first_subnet_id}',
-            region=self.region,
-            account=self.account
+            throughput_mode=node_config.efs_throughput_mode,
+            provisioned_throughput_mibps=
+            node_config.efs_provisioned_throughput_mibps,
+            performance_mode=node_config.efs_performance_mode,
+            infrequent_access_days=node_config.efs_infrequent_access_days
         )
+
+        # Set up DataSync from S3 bucket to EFS node storage, unless the node
+        # reads the bucket directly
+        self.data_sync = None
+        if node_config.node_data_source == "efs":
+            self.data_sync = DataSync(
+                scope=self,
+                id="DataSync",
+                bucket_name=data_import_stack.import_bucket.bucket_name,
+                site_description=node_config.site_description,
+                file_system=self.file_system.file_system,
+                vpc=self.vpc,
+                subnet_arn=f'arn:aws:ec2:{self.region}:{self.account}:'
+                           f'subnet/{self.first_subnet_id}',
+                region=self.region,
+                account=self.account,
+                events=node_config.data_sync_events,
+                schedule=node_config.data_sync_schedule or (
+                    "cron(0 0 * * ? *)" if node_config.data_sync_events
+                    else "cron(0 0 * ? * * *)"),
+                debounce_seconds=node_config.data_sync_debounce_seconds,
+                bandwidth_mibps=node_config.data_sync_bandwidth_mibps,
+                verify_mode=node_config.data_sync_verify_mode,
+                queueing=node_config.data_sync_queueing
+            )
+        elif node_config.node_data_source == "s3":
+            # The gui registers datasets by reading them from /data. It runs
+            # on Fargate, which cannot mount the import bucket with FUSE, so
+            # it would only see the empty node data directory on EFS
+            raise ValueError("Configuration file error: node_data_source s3 "
+                             "is not supported, as the node gui cannot "
+                             "mount the import bucket to register datasets")
+        else:
+            raise ValueError(f"Configuration file error: unknown "
+                             f"node_data_source "
+                             f"{node_config.node_data_source}")
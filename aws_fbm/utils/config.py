@@ -56,6 +56,121 @@ class NetworkConfig:
     # a default stack name will be created
     stack_name: Optional[str] = None
 
+    # Where the restful service stores uploaded files: "s3" uses an S3 bucket,
+    # which clients access directly using presigned URLs; "filesystem" uses
+    # the ephemeral storage of the restful task
+    restful_storage: str = "s3"
+
+    # Database used by the restful service: "postgres" creates an RDS
+    # Postgres instance which persists across deployments; "sqlite" uses a
+    # file on the ephemeral storage of the restful task, which is lost when
+    # the task is replaced
+    restful_database: str = "postgres"
+
+    # EC2 instance type of the restful service database, if using postgres
+    restful_database_instance_type: str = "t4g.micro"
+
+    # Optional: uploads to the restful service which are older than this
+    # number of days are deleted, unless they are pinned
+    restful_retention_days: Optional[int] = None
+
+    # Optional: the least recently downloaded uploads which are not pinned are
+    # deleted while the stored uploads exceed this size in GiB. When uploads
+    # are stored on the ephemeral storage of the restful task, defaults to
+    # 75% of that storage
+    restful_quota_gib: Optional[int] = None
+
+    # Optional: content coding used to compress the uploads stored by the
+    # restful service, "zstd", "gzip" or "none". Defaults to "none" with
+    # restful_storage "s3", so that transfers use presigned URLs, and "zstd"
+    # otherwise
+    restful_compression: Optional[str] = None
+
+    # gunicorn worker class of the restful service: "uvicorn" serves many
+    # requests concurrently from an event loop in each worker; "gthread"
+    # serves them from threads; "gevent" from greenlets; "sync" serves one
+    # request at a time in each worker
+    restful_worker_class: str = "uvicorn"
+
+    # Optional: number of gunicorn workers of the restful service. Defaults to
+    # a number suited to the worker class and the cpu and memory of the task
+    restful_workers: Optional[int] = None
+
+    # Optional: number of threads of each worker, if using gthread workers.
+    # Defaults to 8
+    restful_threads: Optional[int] = None
+
+    # Log level of the restful service gunicorn server: "debug", "info",
+    # "warning", "error" or "critical"
+    restful_log_level: str = "info"
+
+    # Minimum and maximum number of restful tasks. When the maximum is greater
+    # than the minimum, tasks are added during rounds and removed afterwards
+    # to keep the targets below near their values, at least one of which must
+    # be set. More than one task requires restful_storage "s3" and
+    # restful_database "postgres", which are shared by the tasks
+    restful_min_count: int = 1
+    restful_max_count: int = 1
+
+    # Optional: target average cpu utilisation of the restful tasks, in percent
+    restful_scaling_cpu_percent: Optional[int] = None
+
+    # Optional: target average memory utilisation of the restful tasks, in
+    # percent
+    restful_scaling_memory_percent: Optional[int] = None
+
+    # Optional: target number of requests per minute to each restful task
+    restful_scaling_requests_per_target: Optional[int] = None
+
+    # Throughput mode of the network EFS file system: "bursting" (throughput
+    # grows with the amount stored, and is limited once burst credits are
+    # spent), "elastic" (throughput scales with the workload, charged per GiB
+    # transferred) or "provisioned" (efs_provisioned_throughput_mibps)
+    efs_throughput_mode: str = "bursting"
+
+    # Optional: throughput of the network EFS file system in MiB/s, if using
+    # the provisioned throughput mode
+    efs_provisioned_throughput_mibps: Optional[int] = None
+
+    # Performance mode of the network EFS file system: "general_purpose" or
+    # "max_io". Changing the performance mode replaces the file system, which
+    # deletes its contents
+    efs_performance_mode: str = "general_purpose"
+
+    # Optional: files on the network EFS file system which have not been
+    # accessed for this number of days (1, 7, 14, 30, 60 or 90) are moved to
+    # cheaper infrequent access storage, and moved back when next accessed
+    efs_infrequent_access_days: Optional[int] = None
+
+    # Number of QoS 1 and 2 messages the MQTT broker delivers to each client
+    # at once
+    mqtt_max_inflight_messages: int = 100
+
+    # Number of messages the MQTT broker queues for each client beyond those
+    # being delivered
+    mqtt_max_queued_messages: int = 10000
+
+    # Optional: largest message accepted by the MQTT broker, in MiB
+    mqtt_max_message_size_mib: Optional[int] = None
+
+    # Optional: longest MQTT keepalive interval allowed to MQTT clients, in
+    # seconds. This is the interval within which clients must send a packet
+    # (or PINGREQ) to the broker, not a TCP keepalive. MQTT v3 clients asking
+    # for a longer interval are rejected
+    mqtt_max_keepalive: Optional[int] = None
+
+    # True if the MQTT broker saves retained messages and sessions to disk
+    # every mqtt_autosave_interval seconds, so that they survive a restart of
+    # the broker within its task
+    mqtt_persistence: bool = True
+    mqtt_autosave_interval: int = 60
+
+    # Number of MQTT brokers serving clients, each bridged to a central
+    # broker, for more capacity as the number of nodes grows. 0 uses a single
+    # broker. Clients stick to one broker, which holds their sessions; the
+    # sessions are lost if that broker is replaced
+    mqtt_bridged_brokers: int = 0
+
     # Autogenerated name of parameter storing ARN of the VPN server certificate
     param_vpn_cert_arn: str = field(init=False)
 
@@ -124,6 +239,98 @@ class NodeConfig:
     # True if FBM GUI should use the gunicorn production webserver
     use_production_gui: bool = True
 
+    # EC2 instance types of the node, as a comma-separated list in order of
+    # preference, e.g. "g5.xlarge,g4dn.xlarge". Each must have at least
+    # node_gpu_count GPUs and fit the cpu and memory of the node task
+    node_instance_types: List[str] = field(
+        default_factory=lambda: ["g3s.xlarge"])
+
+    # Number of GPUs used by the node task
+    node_gpu_count: int = 1
+
+    # cpu units (1024 per vCPU) and memory in MiB of the node task
+    node_cpu: int = 4096
+    node_memory_limit_mib: int = 30000
+
+    # Minimum and maximum number of instances of the node auto scaling group
+    node_min_capacity: int = 0
+    node_max_capacity: int = 1
+
+    # Percentage of the node instances which are spot instances, from 0 (all
+    # on-demand) to 100. Spot instances cost less but may be interrupted, in
+    # which case the node task is restarted on another instance
+    node_spot_percent: int = 0
+
+    # Number of stopped node instances kept in a warm pool, with the node
+    # image already pulled, so that the node task starts within seconds when
+    # the node is started or replaced. 0 disables the warm pool. Stopped
+    # instances incur storage costs only
+    node_warm_pool_size: int = 0
+
+    # True if node instances are returned to the warm pool when scaled in,
+    # rather than terminated
+    node_warm_pool_reuse: bool = True
+
+    # Where the node reads its data: "efs" copies the import bucket to the
+    # node EFS file system with DataSync. "s3", which would mount the import
+    # bucket read-only in the node container without DataSync, is rejected
+    # until the gui can mount the bucket too
+    node_data_source: str = "efs"
+
+    # True if the node trains from a copy of its data on the local disk of
+    # the instance (the NVMe instance store, e.g. of g4dn and g5 instances,
+    # or the root volume otherwise), which is updated from the data on EFS
+    # when the node starts and when the data changes. With the s3 data
+    # source, the local disk caches the data read from the import bucket
+    node_data_staging: bool = False
+
+    # Seconds between checks for changes to the data on EFS, if staging data
+    node_data_staging_interval: int = 300
+
+    # True if data is copied from the import bucket to EFS as soon as objects
+    # are created or deleted in the bucket, copying only their directories
+    data_sync_events: bool = True
+
+    # Seconds for which bucket changes are collected before starting a copy,
+    # so that a burst of uploads is copied at once. At most 300
+    data_sync_debounce_seconds: int = 60
+
+    # Optional: schedule expression on which the whole import bucket is
+    # copied, e.g. "cron(0 0 * ? * * *)" for hourly. Defaults to daily when
+    # data_sync_events is True, and hourly otherwise
+    data_sync_schedule: Optional[str] = None
+
+    # Optional: bandwidth limit of copies from the import bucket, in MiB/s
+    data_sync_bandwidth_mibps: Optional[int] = None
+
+    # How copied data is verified: "only_files_transferred",
+    # "point_in_time_consistent" (the whole destination) or "none"
+    data_sync_verify_mode: str = "only_files_transferred"
+
+    # True if copies started while another is running wait for it to
+    # complete, rather than failing and being retried later
+    data_sync_queueing: bool = True
+
+    # Throughput mode of the node EFS file system: "bursting" (throughput
+    # grows with the amount stored, and is limited once burst credits are
+    # spent), "elastic" (throughput scales with the workload, charged per GiB
+    # transferred) or "provisioned" (efs_provisioned_throughput_mibps)
+    efs_throughput_mode: str = "elastic"
+
+    # Optional: throughput of the node EFS file system in MiB/s, if using
+    # the provisioned throughput mode
+    efs_provisioned_throughput_mibps: Optional[int] = None
+
+    # Performance mode of the node EFS file system: "general_purpose" or
+    # "max_io". Changing the performance mode replaces the file system, which
+    # deletes its contents
+    efs_performance_mode: str = "general_purpose"
+
+    # Optional: files on the node EFS file system which have not been
+    # accessed for this number of days (1, 7, 14, 30, 60 or 90) are moved to
+    # cheaper infrequent access storage, and moved back when next accessed
+    efs_infrequent_access_days: Optional[int] = None
+
     # Optional: if specified, will override the prefix used to construct stack
     # names
     name_prefix: Optional[str] = None
@@ -214,4 +421,11 @@ def convert_inputs(dataclass_type: Type, section: SectionProxy, **kwargs):
 def convert_to(section: SectionProxy, key: str, field_type: Type):
     """Fetch the given key from the config section, converting to the specified
     type if required"""
-    return section.getboolean(key) if field_type == bool else section.get(key)
+    if field_type == bool:
+        return section.getboolean(key)
+    if field_type in (int, Optional[int]):
+        return section.getint(key)
+    if field_type == List[str]:
+        return [value.strip() for value in section.get(key).split(",")
+                if value.strip()]
+    return section.get(key)
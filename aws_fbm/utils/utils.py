@@ -1,6 +1,8 @@
 import aws_cdk as cdk
 
 from pathlib import Path
+from typing import Dict, Optional
+import math
 import os
 
 
@@ -17,3 +19,36 @@ def get_environment() -> cdk.Environment:
 
 def bool_to_str(value: bool) -> str:
     return "True" if value else "False"
+
+
+def gunicorn_environment(cpu: int,
+                         memory_limit_mib: int,
+                         worker_class: str,
+                         workers: Optional[int] = None,
+                         threads: Optional[int] = None,
+                         log_level: str = "info") -> Dict[str, str]:
+    """Return the GUNICORN_* environment variables of a service running
+    gunicorn (see docker/restful/app/gunicorn.conf.py), sizing the workers
+    for the cpu units and memory of its Fargate task unless given"""
+    if worker_class not in ("sync", "gthread", "gevent", "uvicorn"):
+        raise ValueError(f"Configuration file error: unknown gunicorn worker "
+                         f"class {worker_class}")
+    vcpus = math.ceil(cpu / 1024)
+    if workers is None:
+        # Synchronous workers each serve one request at a time, while the
+        # others serve many concurrently
+        workers = 2 * vcpus + 1 if worker_class == "sync" else max(2, vcpus)
+        # Allow around 256 MiB for each worker
+        workers = min(workers, max(1, memory_limit_mib // 256))
+    environment = {
+        "GUNICORN_WORKER_CLASS": worker_class,
+        "GUNICORN_WORKERS": str(workers),
+        # Large files may take minutes to transfer over the VPN
+        "GUNICORN_TIMEOUT": "300",
+        # Longer than the idle timeout of the load balancer
+        "GUNICORN_KEEPALIVE": "65",
+        "GUNICORN_LOG_LEVEL": log_level,
+    }
+    if worker_class == "gthread":
+        environment["GUNICORN_THREADS"] = str(threads or 8)
+    return environment
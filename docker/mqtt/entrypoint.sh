@@ -0,0 +1,54 @@
+#!/bin/sh
+
+# UCL PASSIAN - launch script for Fed-BioMed mqtt container
+
+echo "UCL PASSIAN Fed-BioMed mqtt container"
+
+# The mosquitto configuration is generated from MQTT_* environment variables,
+# which the AWS deployment derives from the network configuration:
+# - MQTT_MAX_INFLIGHT_MESSAGES: QoS 1 and 2 messages being delivered to each
+#   client at once
+# - MQTT_MAX_QUEUED_MESSAGES: messages queued for each client beyond those
+# - MQTT_MAX_PACKET_SIZE: optional largest accepted message, in bytes
+# - MQTT_MAX_KEEPALIVE: optional longest MQTT keepalive interval (within
+#   which clients must send a packet or PINGREQ, unrelated to TCP
+#   keepalive) allowed to clients, in seconds. MQTT v3 clients asking for
+#   more are rejected
+# - MQTT_PERSISTENCE and MQTT_AUTOSAVE_INTERVAL: whether retained messages
+#   and sessions are saved to disk, and how often in seconds
+# - MQTT_BRIDGE_ADDRESS: optional host:port of a broker to which all topics
+#   are bridged, so that clients of several brokers exchange messages
+CONFIG=/mosquitto/config/mosquitto.conf
+cat > "${CONFIG}" <<CONF
+listener 1883
+allow_anonymous true
+max_inflight_messages ${MQTT_MAX_INFLIGHT_MESSAGES:-20}
+max_queued_messages ${MQTT_MAX_QUEUED_MESSAGES:-1000}
+# Small control messages are sent at once rather than coalesced
+set_tcp_nodelay true
+persistence ${MQTT_PERSISTENCE:-false}
+persistence_location /mosquitto/data/
+autosave_interval ${MQTT_AUTOSAVE_INTERVAL:-1800}
+log_dest stdout
+CONF
+
+if [ -n "${MQTT_MAX_PACKET_SIZE}" ]; then
+  echo "max_packet_size ${MQTT_MAX_PACKET_SIZE}" >> "${CONFIG}"
+fi
+if [ -n "${MQTT_MAX_KEEPALIVE}" ]; then
+  echo "max_keepalive ${MQTT_MAX_KEEPALIVE}" >> "${CONFIG}"
+fi
+
+if [ -n "${MQTT_BRIDGE_ADDRESS}" ]; then
+  cat >> "${CONFIG}" <<CONF
+connection bridge-$(hostname)
+address ${MQTT_BRIDGE_ADDRESS}
+topic # both 1
+cleansession true
+try_private true
+notifications false
+restart_timeout 1 30
+CONF
+fi
+
+exec /usr/sbin/mosquitto -c "${CONFIG}"
@@ -15,6 +15,42 @@ if [ -z "$(ls -1 $COMMON_DIR)" ]; then
   rsync -auxt "/fedbiomed/envs/common_reference/" "$COMMON_DIR"
 fi
 
+# With the s3 data source, the import bucket DATA_BUCKET is mounted read-only
+# at /data. Files are streamed with parallel ranged requests, and cached on
+# the local disk of the instance in DATA_BUCKET_CACHE if set
+if [ -n "${DATA_BUCKET}" ]; then
+  MOUNT_OPTIONS=(--read-only --allow-other --region "${DATA_BUCKET_REGION}")
+  if [ -n "${DATA_BUCKET_CACHE}" ]; then
+    MOUNT_OPTIONS+=(--cache "${DATA_BUCKET_CACHE}")
+  fi
+  echo "Mounting s3://${DATA_BUCKET} at /data"
+  mount-s3 "${MOUNT_OPTIONS[@]}" "${DATA_BUCKET}" /data
+fi
+
+# When staging data, training reads /data from the local disk of the
+# instance, which is copied from the data on EFS in DATA_STAGING_SOURCE at
+# start. Only files which changed are copied, and the copy is updated when the
+# list, sizes or modification times of the files on EFS change
+if [ -n "${DATA_STAGING_SOURCE}" ]; then
+  data_manifest() {
+    find "${DATA_STAGING_SOURCE}" -printf '%P %s %T@\n' | sort | md5sum
+  }
+  stage_data() {
+    rsync -a --delete "${DATA_STAGING_SOURCE}/" /data/
+  }
+  echo "Staging data from ${DATA_STAGING_SOURCE}..."
+  MANIFEST=$(data_manifest)
+  stage_data
+  echo "...Data staged"
+  (
+    while sleep "${DATA_STAGING_INTERVAL:-300}"; do
+      NEW_MANIFEST=$(data_manifest)
+      if [ "${NEW_MANIFEST}" != "${MANIFEST}" ] && stage_data; then
+        MANIFEST="${NEW_MANIFEST}"
+      fi
+    done
+  ) &
+fi
 
 trap finish TERM INT QUIT
 
@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.core.signals import request_started
+from django.db.backends.signals import connection_created
 
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        from .db import configure_sqlite, close_unusable_connections
+        connection_created.connect(configure_sqlite)
+        request_started.connect(close_unusable_connections)
@@ -0,0 +1,67 @@
+"""ASGI handler for serving the restful service from an event loop"""
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """An ASGI handler which keeps the event loop free while request and
+    response bodies are transferred, so that slow clients do not hold a
+    worker:
+
+    - request bodies are received by the event loop before the view is
+      called (spooled to a temporary file if they are large)
+    - each request runs its views in its own thread, rather than in the single
+      thread shared by all requests in Django 3.1
+    - streaming response bodies (e.g. downloads) are read from storage in a
+      thread pool and sent as they are read, waiting whenever the client is
+      slower than the storage
+    """
+    # Size of the blocks read from files and sent to the client
+    chunk_size = 256 * 1024
+
+    async def __call__(self, scope, receive, send):
+        async with ThreadSensitiveContext():
+            await super().__call__(scope, receive, send)
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': self.response_headers(response),
+        })
+        read_part = sync_to_async(next, thread_sensitive=False)
+        parts = iter(response)
+        try:
+            while True:
+                part = await read_part(parts, None)
+                if part is None:
+                    break
+                for chunk, _ in self.chunk_bytes(part):
+                    await send({
+                        'type': 'http.response.body',
+                        'body': chunk,
+                        'more_body': True,
+                    })
+            await send({'type': 'http.response.body'})
+        finally:
+            await sync_to_async(response.close, thread_sensitive=True)()
+
+    @staticmethod
+    def response_headers(response):
+        """Encode the headers and cookies of a response for ASGI"""
+        headers = []
+        for header, value in response.items():
+            if isinstance(header, str):
+                header = header.encode('ascii')
+            if isinstance(value, str):
+                value = value.encode('latin1')
+            headers.append((bytes(header), bytes(value)))
+        for cookie in response.cookies.values():
+            headers.append(
+                (b'Set-Cookie', cookie.output(header='').encode('ascii').strip())
+            )
+        return headers
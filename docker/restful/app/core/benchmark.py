@@ -0,0 +1,308 @@
+"""Load test simulating the federated rounds served by the restful service
+
+In each round, the researcher uploads the model parameters, every node
+downloads them at the same time, and then every node uploads its updated
+parameters at the same time. The latency of each request and the throughput
+of each phase are reported, so that versions and settings can be compared.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.servers.basehttp import ThreadedWSGIServer, \
+    WSGIRequestHandler
+from django.db import connections
+from django.test.utils import override_settings
+
+import array
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+
+PHASES = ['researcher_upload', 'node_download', 'node_upload']
+
+
+def model_parameters(size, seed=0):
+    """Return `size` bytes resembling serialized float32 model parameters"""
+    generator = random.Random(seed)
+    values = array.array('f', (generator.gauss(0, 0.1)
+                               for _ in range(size // 4 + 1)))
+    return values.tobytes()[:size]
+
+
+def percentile(values, fraction):
+    """Percentile of a list of values, interpolating between the closest
+    ranks"""
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(latencies, errors, transferred, duration):
+    """Statistics of one phase over all rounds"""
+    return {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'duration_s': round(duration, 4),
+        'requests_per_s': round(len(latencies) / duration, 2)
+        if duration else None,
+        'megabytes_per_s': round(transferred / duration / 1e6, 2)
+        if duration else None,
+        'latency_s': {
+            'mean': round(sum(latencies) / len(latencies), 4)
+            if latencies else None,
+            'p50': _round(percentile(latencies, 0.50)),
+            'p95': _round(percentile(latencies, 0.95)),
+            'p99': _round(percentile(latencies, 0.99)),
+            'max': _round(max(latencies, default=None)),
+        },
+    }
+
+
+def _round(value):
+    return None if value is None else round(value, 4)
+
+
+class RoundClient:
+    """Sends the requests of the researcher and of the nodes"""
+
+    def __init__(self, base_url, timeout=300):
+        self.upload_url = urllib.parse.urljoin(base_url, 'upload/')
+        self.timeout = timeout
+
+    def upload(self, content, filename):
+        """Upload a file as a multipart form, as Fed-BioMed does. Returns the
+        URL from which the file is downloaded"""
+        boundary = uuid.uuid4().hex
+        body = b''.join([
+            f'--{boundary}\r\n'.encode(),
+            f'Content-Disposition: form-data; name="file"; '
+            f'filename="{filename}"\r\n'.encode(),
+            b'Content-Type: application/octet-stream\r\n\r\n',
+            content,
+            f'\r\n--{boundary}--\r\n'.encode(),
+        ])
+        request = urllib.request.Request(
+            self.upload_url, data=body, method='POST', headers={
+                'Content-Type': f'multipart/form-data; boundary={boundary}',
+                'Accept': 'application/json'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.load(response)['file']
+
+    def download(self, url):
+        """Download a file, returning its size"""
+        size = 0
+        with urllib.request.urlopen(url, timeout=self.timeout) as response:
+            while True:
+                chunk = response.read(1024 * 1024)
+                if not chunk:
+                    return size
+                size += len(chunk)
+
+
+def _timed(function, *args):
+    start = time.perf_counter()
+    try:
+        result = function(*args)
+    except Exception as e:
+        return None, time.perf_counter() - start, e
+    return result, time.perf_counter() - start, None
+
+
+def run_rounds(base_url, nodes, rounds, size):
+    """Simulate `rounds` federated rounds with `nodes` nodes exchanging model
+    parameters of `size` bytes, returning the results as a dict"""
+    client = RoundClient(base_url)
+    latencies = {phase: [] for phase in PHASES}
+    errors = {phase: 0 for phase in PHASES}
+    transferred = {phase: 0 for phase in PHASES}
+    durations = {phase: 0.0 for phase in PHASES}
+    parameters = model_parameters(size)
+
+    def record(phase, results, sizes):
+        for (result, latency, error), transfer_size in zip(results, sizes):
+            if error:
+                errors[phase] += 1
+            else:
+                latencies[phase].append(latency)
+                transferred[phase] += transfer_size
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=nodes) as executor:
+        for round_number in range(rounds):
+            # Each upload has different content, as real updated parameters
+            # do, so that uploads are not deduplicated
+            def content(node):
+                return f'{round_number}:{node}:'.encode() + parameters
+
+            phase_start = time.perf_counter()
+            researcher = _timed(client.upload, content('researcher'),
+                                f'aggregated_params_{round_number}.pt')
+            durations['researcher_upload'] += \
+                time.perf_counter() - phase_start
+            record('researcher_upload', [researcher], [size])
+            url = researcher[0]
+            if url is None:
+                errors['node_download'] += nodes
+                errors['node_upload'] += nodes
+                continue
+
+            phase_start = time.perf_counter()
+            downloads = list(executor.map(
+                lambda node: _timed(client.download, url), range(nodes)))
+            durations['node_download'] += time.perf_counter() - phase_start
+            record('node_download', downloads,
+                   [result or 0 for result, _, _ in downloads])
+
+            phase_start = time.perf_counter()
+            uploads = list(executor.map(
+                lambda node: _timed(client.upload, content(node),
+                                    f'node_params_{node}.pt'),
+                range(nodes)))
+            durations['node_upload'] += time.perf_counter() - phase_start
+            record('node_upload', uploads, [size] * nodes)
+    total = time.perf_counter() - start
+
+    return {
+        'url': base_url,
+        'nodes': nodes,
+        'rounds': rounds,
+        'size_bytes': size,
+        'duration_s': round(total, 4),
+        'rounds_per_minute': round(rounds * 60 / total, 2) if total else None,
+        'phases': {phase: summarize(latencies[phase], errors[phase],
+                                    transferred[phase], durations[phase])
+                   for phase in PHASES},
+    }
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def in_process_server():
+    """Serve the restful service from threads of this process, using a new
+    test database and storage directory which are deleted afterwards.
+    Yields the base URL of the service"""
+    directory = tempfile.mkdtemp()
+    connection = connections['default']
+    if connection.vendor == 'sqlite':
+        connection.settings_dict['TEST']['NAME'] = \
+            os.path.join(directory, 'benchmark.sqlite3')
+    old_name = connection.creation.create_test_db(
+        verbosity=0, autoclobber=True, serialize=False)
+    try:
+        with override_settings(
+                MEDIA_ROOT=os.path.join(directory, 'media/'),
+                UPLOAD_SESSION_ROOT=os.path.join(directory, 'sessions/'),
+                CACHE_DIR=os.path.join(directory, 'cache/'),
+                STORAGE_BACKEND='filesystem',
+                DEFAULT_FILE_STORAGE='django.core.files.storage.'
+                                     'FileSystemStorage'):
+            server = ThreadedWSGIServer(('127.0.0.1', 0),
+                                        QuietWSGIRequestHandler)
+            server.set_app(WSGIHandler())
+            thread = threading.Thread(target=server.serve_forever,
+                                      daemon=True)
+            thread.start()
+            try:
+                yield f'http://127.0.0.1:{server.server_port}/'
+            finally:
+                server.shutdown()
+                server.server_close()
+    finally:
+        connections.close_all()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_until_serving(url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with code {process.returncode}')
+        try:
+            urllib.request.urlopen(url, timeout=5).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'gunicorn did not start serving {url}')
+
+
+@contextmanager
+def gunicorn_server(worker_class, workers=None, threads=None):
+    """Run the restful service with gunicorn in a subprocess, as the
+    container does, with the given worker settings (see gunicorn.conf.py) and
+    a new SQLite database and storage directory which are deleted afterwards.
+    Yields the base URL of the service"""
+    directory = tempfile.mkdtemp()
+    port = _free_port()
+    environment = dict(
+        os.environ,
+        DATABASE_ENGINE='sqlite',
+        SQLITE_PATH=os.path.join(directory, 'benchmark.sqlite3'),
+        STORAGE_BACKEND='filesystem',
+        MEDIA_ROOT=os.path.join(directory, 'media/'),
+        UPLOAD_SESSION_ROOT=os.path.join(directory, 'sessions/'),
+        CACHE_DIR=os.path.join(directory, 'cache/'),
+        SERVER_MODE='asgi' if worker_class == 'uvicorn' else 'wsgi',
+        GUNICORN_WORKER_CLASS=worker_class,
+        GUNICORN_WORKERS=str(workers or ''),
+        GUNICORN_THREADS=str(threads or ''),
+        GUNICORN_BIND=f'127.0.0.1:{port}',
+        GUNICORN_LOG_LEVEL='warning')
+    environment.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    application = 'fedbiomed.asgi:application' if worker_class == 'uvicorn' \
+        else 'fedbiomed.wsgi'
+    url = f'http://127.0.0.1:{port}/'
+    try:
+        subprocess.run([sys.executable, 'manage.py', 'migrate', '-v0'],
+                       cwd=settings.BASE_DIR, env=environment, check=True)
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py',
+             application], cwd=settings.BASE_DIR, env=environment)
+        try:
+            _wait_until_serving(url, process)
+            yield url
+        finally:
+            process.terminate()
+            process.wait(timeout=60)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def compare_worker_classes(worker_classes, workers=None, threads=None,
+                           **parameters):
+    """Run the benchmark against gunicorn with each of the worker classes,
+    returning the results of each and the worker class which completed the
+    most rounds per minute"""
+    results = {}
+    for worker_class in worker_classes:
+        with gunicorn_server(worker_class, workers, threads) as url:
+            results[worker_class] = run_rounds(url, **parameters)
+    best = max(results, key=lambda name: results[name]['rounds_per_minute']
+               or 0)
+    return {'best_worker_class': best, 'worker_classes': results}
@@ -0,0 +1,221 @@
+"""Read-through cache of the content of blobs
+
+Right after the researcher uploads parameters, every node downloads them at
+nearly the same time. Content which must be decompressed, rebuilt from a
+delta or fetched from S3 is kept in a bounded cache, so that it is read from
+storage once rather than once per node:
+- in the memory of each worker, for files up to CACHE_MEMORY_ITEM_BYTES, up
+  to CACHE_MEMORY_BYTES in total
+- in CACHE_DIR on the local disk, which is shared by the workers and served
+  with sendfile, up to CACHE_DISK_BYTES in total
+
+Both tiers evict the least recently used content when full. Loading is
+single-flight: concurrent requests for content which is not cached wait for
+the first of them to load it, including requests served by other workers
+when the disk tier is enabled. Content is cached by digest, so cached
+content never becomes stale.
+"""
+
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from collections import OrderedDict
+import fcntl
+import io
+import logging
+import os
+import shutil
+import threading
+import uuid
+import zlib
+
+from .metrics import CACHE_HITS, CACHE_MISSES
+
+logger = logging.getLogger(__name__)
+
+# Loads of different content are serialized across workers by one of this
+# many lock files, which are never deleted
+LOCK_STRIPES = 256
+
+
+class ContentCache:
+    """A two-tier LRU cache of file contents, keyed by digest"""
+
+    def __init__(self, directory, disk_bytes, memory_bytes,
+                 memory_item_bytes):
+        self.directory = directory
+        self.disk_bytes = disk_bytes
+        self.memory_bytes = memory_bytes
+        self.memory_item_bytes = min(memory_item_bytes, memory_bytes)
+        self.memory = OrderedDict()
+        self.memory_size = 0
+        self.lock = threading.Lock()
+        self.key_locks = {}
+
+    def open(self, key, size, load):
+        """Open the content `key` of `size` bytes for reading. On a miss,
+        `load()` is called to open the content from storage, and the content
+        is cached if it fits"""
+        data = self._memory_get(key)
+        if data is not None:
+            CACHE_HITS.labels('memory').inc()
+            return io.BytesIO(data)
+
+        with self._key_lock(key):
+            # Another thread may have loaded the content while this waited
+            data = self._memory_get(key)
+            if data is not None:
+                CACHE_HITS.labels('memory').inc()
+                return io.BytesIO(data)
+
+            if 0 < size <= self.disk_bytes:
+                with self._disk_lock(key):
+                    path = self._path(key)
+                    if os.path.exists(path):
+                        CACHE_HITS.labels('disk').inc()
+                        os.utime(path)
+                    else:
+                        CACHE_MISSES.inc()
+                        with load() as source:
+                            self._disk_put(key, source)
+                    file = open(path, 'rb')
+                if size <= self.memory_item_bytes:
+                    self._memory_put(key, file.read())
+                    file.seek(0)
+                return file
+
+            CACHE_MISSES.inc()
+            if size > self.memory_item_bytes:
+                return load()
+            with load() as source:
+                data = source.read()
+            self._memory_put(key, data)
+            return io.BytesIO(data)
+
+    def put(self, key, size, file):
+        """Cache the content of the open `file`, e.g. when it has just been
+        uploaded, so that the first downloads are hits. Errors are logged,
+        as caching is never required"""
+        try:
+            if 0 < size <= self.disk_bytes:
+                with self._key_lock(key), self._disk_lock(key):
+                    if not os.path.exists(self._path(key)):
+                        file.seek(0)
+                        self._disk_put(key, file)
+            elif 0 < size <= self.memory_item_bytes:
+                file.seek(0)
+                self._memory_put(key, file.read())
+        except OSError:
+            logger.exception('Could not cache %s', key)
+
+    def _memory_get(self, key):
+        with self.lock:
+            data = self.memory.get(key)
+            if data is not None:
+                self.memory.move_to_end(key)
+            return data
+
+    def _memory_put(self, key, data):
+        if len(data) > self.memory_item_bytes:
+            return
+        with self.lock:
+            if key in self.memory:
+                return
+            self.memory[key] = data
+            self.memory_size += len(data)
+            while self.memory_size > self.memory_bytes:
+                _, evicted = self.memory.popitem(last=False)
+                self.memory_size -= len(evicted)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    @contextmanager
+    def _key_lock(self, key):
+        """Single-flight lock of the threads of this worker for one key"""
+        with self.lock:
+            lock, waiters = self.key_locks.get(key, (threading.Lock(), 0))
+            self.key_locks[key] = (lock, waiters + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self.lock:
+                lock, waiters = self.key_locks[key]
+                if waiters == 1:
+                    del self.key_locks[key]
+                else:
+                    self.key_locks[key] = (lock, waiters - 1)
+
+    @contextmanager
+    def _disk_lock(self, key):
+        """Single-flight lock of the workers for the keys of one stripe"""
+        lock_dir = os.path.join(self.directory, 'locks')
+        os.makedirs(lock_dir, exist_ok=True)
+        stripe = zlib.crc32(key.encode()) % LOCK_STRIPES
+        with open(os.path.join(lock_dir, str(stripe)), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _disk_put(self, key, source):
+        # Written to a temporary file and renamed, so that other workers
+        # never open partially written content
+        temporary = self._path(f'{key}.{uuid.uuid4().hex}.tmp')
+        try:
+            with open(temporary, 'wb') as destination:
+                shutil.copyfileobj(source, destination, 1024 * 1024)
+            os.replace(temporary, self._path(key))
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        self._disk_evict(keep=key)
+
+    def _disk_evict(self, keep):
+        """Delete the least recently used files until the cache fits"""
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.is_file() and '.' not in entry.name:
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name,
+                                    stat.st_size))
+                    total += stat.st_size
+        for _, name, size in sorted(entries):
+            if total <= self.disk_bytes:
+                break
+            if name == keep:
+                continue
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+_cache = None
+
+
+def content_cache():
+    """The content cache of this worker, configured by the CACHE_* settings"""
+    global _cache
+    if _cache is None:
+        _cache = ContentCache(
+            directory=settings.CACHE_DIR,
+            disk_bytes=settings.CACHE_DISK_BYTES,
+            memory_bytes=settings.CACHE_MEMORY_BYTES,
+            memory_item_bytes=settings.CACHE_MEMORY_ITEM_BYTES)
+    return _cache
+
+
+@receiver(setting_changed)
+def reset_content_cache(setting, **kwargs):
+    global _cache
+    if setting.startswith('CACHE_'):
+        _cache = None
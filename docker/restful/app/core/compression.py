@@ -0,0 +1,185 @@
+"""Content codings (compression) of stored files
+
+Blobs may be stored compressed with one of the supported content codings.
+Clients which accept that coding receive the stored bytes as they are, with a
+Content-Encoding header; other clients receive the decompressed content.
+Clients may also send compressed content, which is then stored as it is.
+"""
+
+from django.conf import settings
+
+import gzip
+import hashlib
+import io
+import re
+import tempfile
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+IDENTITY = ''
+GZIP = 'gzip'
+ZSTD = 'zstd'
+
+# Content is only stored compressed if this saves at least 5%
+MIN_COMPRESSION_RATIO = 1.05
+
+# Errors raised when decompressing invalid content
+_DECODE_ERRORS = (OSError, EOFError, zlib.error) + \
+    ((zstandard.ZstdError,) if zstandard else ())
+
+_ACCEPT_ENCODING_RE = re.compile(
+    r'^\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*$')
+
+
+def supported_encodings():
+    """Content codings which can be read and written"""
+    return [ZSTD, GZIP] if zstandard else [GZIP]
+
+
+def storage_encoding():
+    """Content coding used to compress blobs, or IDENTITY if blobs are stored
+    uncompressed (see STORAGE_COMPRESSION in the settings)"""
+    encoding = settings.STORAGE_COMPRESSION
+    if encoding == ZSTD and not zstandard:
+        return GZIP
+    return encoding
+
+
+def accepts_encoding(accept_encoding, encoding):
+    """Whether an Accept-Encoding header value allows a response with the
+    given content coding"""
+    if encoding == IDENTITY:
+        return True
+    qualities = {}
+    for item in (accept_encoding or '').split(','):
+        match = _ACCEPT_ENCODING_RE.match(item)
+        if match:
+            coding, quality = match.groups()
+            try:
+                qualities[coding.lower()] = float(quality or 1)
+            except ValueError:
+                continue
+    quality = qualities.get(encoding, qualities.get('*', 0))
+    return quality > 0
+
+
+def compress(source, destination, encoding, chunk_size=1024 * 1024):
+    """Compress the content of the file `source` into the binary file
+    `destination`, returning the number of compressed bytes"""
+    if encoding == ZSTD:
+        compressor = zstandard.ZstdCompressor(
+            level=settings.STORAGE_COMPRESSION_LEVEL or 3)
+        writer = compressor.stream_writer(destination, closefd=False)
+    elif encoding == GZIP:
+        writer = gzip.GzipFile(
+            fileobj=destination, mode='wb', mtime=0,
+            compresslevel=settings.STORAGE_COMPRESSION_LEVEL or 6)
+    else:
+        raise ValueError(f'Unsupported content coding {encoding!r}')
+    with writer:
+        for chunk in source.chunks(chunk_size):
+            writer.write(chunk)
+    return destination.tell()
+
+
+def compressed_copy(file, encoding):
+    """Return a temporary file holding the content of `file` compressed with
+    `encoding`, or None if compressing it would not save enough space"""
+    compressed = tempfile.TemporaryFile(dir=settings.FILE_UPLOAD_TEMP_DIR)
+    compressed_size = compress(file, compressed, encoding)
+    if not compressed_size or \
+            file.size / compressed_size < MIN_COMPRESSION_RATIO:
+        compressed.close()
+        return None
+    compressed.seek(0)
+    return compressed
+
+
+class DecodedFile(io.RawIOBase):
+    """A read-only file giving the decompressed content of a compressed
+    file.
+
+    Seeking forwards reads and discards the content in between. Unlike the
+    decompressing readers it wraps, it has no fileno(), so that WSGI servers
+    do not send the compressed file with sendfile.
+    """
+
+    def __init__(self, file, encoding, closefd=True):
+        super().__init__()
+        self.file = file
+        self.closefd = closefd
+        if encoding == ZSTD and zstandard:
+            self.reader = zstandard.ZstdDecompressor().stream_reader(
+                file, read_across_frames=True, closefd=False)
+        elif encoding == GZIP:
+            self.reader = gzip.GzipFile(fileobj=file, mode='rb')
+        else:
+            raise ValueError(f'Unsupported content coding {encoding!r}')
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        try:
+            data = self.reader.read(size)
+        except _DECODE_ERRORS as e:
+            raise ValueError(f'Invalid compressed content: {e}') from e
+        self.position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        if whence == io.SEEK_END or offset < self.position:
+            raise io.UnsupportedOperation('Can only seek forwards')
+        while self.position < offset:
+            if not self.read(min(offset - self.position, 1024 * 1024)):
+                break
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        if not self.closed:
+            self.reader.close()
+            if self.closefd:
+                self.file.close()
+        super().close()
+
+
+def hash_decoded(file, encoding, chunk_size=1024 * 1024):
+    """Return the hex SHA-256 digest and the size of the decompressed
+    content of a compressed file.
+
+    Raises:
+        ValueError: the file is not valid compressed content
+    """
+    file.seek(0)
+    decoded = DecodedFile(file, encoding, closefd=False)
+    sha256 = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = decoded.read(chunk_size)
+        if not chunk:
+            break
+        sha256.update(chunk)
+        size += len(chunk)
+    decoded.close()
+    file.seek(0)
+    return sha256.hexdigest(), size
+
@@ -0,0 +1,23 @@
+"""Database connection handling"""
+
+from django.db import connections
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """Use write-ahead logging for SQLite, so that readers in other gunicorn
+    workers are not blocked while a write is in progress"""
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+
+
+def close_unusable_connections(**kwargs):
+    """Close persistent connections which are no longer usable (e.g. the
+    database server was restarted), so that the request opens a new
+    connection instead of failing"""
+    for connection in connections.all():
+        if connection.connection is not None and \
+                connection.settings_dict['CONN_MAX_AGE'] and \
+                not connection.is_usable():
+            connection.close()
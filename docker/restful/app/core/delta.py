@@ -0,0 +1,102 @@
+"""Delta encoding of stored files against the content of a base blob
+
+Successive uploads of model parameters usually have the same layout as an
+earlier upload, with values which differ little or not at all. When an upload
+names a base upload, its content is XORed with the content of the base, which
+turns unchanged bytes (and the sign and exponent bytes of slightly changed
+values) into zeros, and the result is compressed. This delta is stored instead
+of the content if it is smaller, so that its size depends on how much the
+parameters changed rather than on the size of the model. Content beyond the
+end of the base is kept as it is.
+
+The content is rebuilt by XORing the delta with the content of the base, both
+read as streams, so deltas of large files are never held in memory.
+"""
+
+from django.conf import settings
+
+import tempfile
+
+from .compression import DecodedFile, compress, storage_encoding, \
+    supported_encodings, MIN_COMPRESSION_RATIO
+
+
+def xor_bytes(data, base):
+    """XOR `data` with the bytes of `base`, which may be shorter. Bytes of
+    `data` beyond the end of `base` are unchanged"""
+    length = len(base)
+    if not length:
+        return data
+    head = int.from_bytes(data[:length], 'little') ^ \
+        int.from_bytes(base, 'little')
+    return head.to_bytes(length, 'little') + data[length:]
+
+
+def read_exactly(file, size):
+    """Read `size` bytes from `file`, or fewer if it ends first"""
+    parts = []
+    while size > 0:
+        data = file.read(size)
+        if not data:
+            break
+        parts.append(data)
+        size -= len(data)
+    return b''.join(parts)
+
+
+def delta_encoding():
+    """Content coding used to compress deltas, which are mostly zeros and
+    are always compressed"""
+    return storage_encoding() or supported_encodings()[0]
+
+
+def can_be_base(blob):
+    """Whether deltas may be stored against a blob. Rebuilding content reads
+    every blob of the chain of bases, so chains are limited to
+    DELTA_MAX_DEPTH deltas"""
+    return blob.delta_depth < settings.DELTA_MAX_DEPTH
+
+
+class _DeltaSource:
+    """The delta of a file against a base, read in chunks to compress it"""
+
+    def __init__(self, file, base):
+        self.file = file
+        self.base = base
+
+    def chunks(self, chunk_size):
+        for chunk in self.file.chunks(chunk_size):
+            yield xor_bytes(chunk, read_exactly(self.base, len(chunk)))
+
+
+def delta_copy(file, base, max_size):
+    """Return a temporary file holding the compressed delta of `file`
+    against the content of the blob `base`, or None if the delta is not at
+    least 5% smaller than `max_size` bytes"""
+    delta = tempfile.TemporaryFile(dir=settings.FILE_UPLOAD_TEMP_DIR)
+    with base.open_content() as base_content:
+        delta_size = compress(_DeltaSource(file, base_content), delta,
+                              delta_encoding())
+    if delta_size * MIN_COMPRESSION_RATIO > max_size:
+        delta.close()
+        return None
+    delta.seek(0)
+    return delta
+
+
+class DeltaFile(DecodedFile):
+    """A read-only file giving the content rebuilt from a compressed delta
+    and the content of its base, with the same seeking as DecodedFile"""
+
+    def __init__(self, file, encoding, base, closefd=True):
+        self.base = base
+        super().__init__(file, encoding, closefd=closefd)
+
+    def read(self, size=-1):
+        data = super().read(size)
+        return xor_bytes(data, read_exactly(self.base, len(data)))
+
+    def close(self):
+        if not self.closed:
+            self.base.close()
+        super().close()
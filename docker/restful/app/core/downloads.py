@@ -0,0 +1,162 @@
+"""Helpers for serving stored files with conditional and range requests"""
+
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date, parse_http_date_safe
+
+import hashlib
+import io
+import re
+
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class DownloadResponse(FileResponse):
+    """A FileResponse which reads larger blocks when the WSGI server cannot
+    send the file directly from the kernel (sendfile)"""
+    block_size = 256 * 1024
+
+
+class FileRange:
+    """A read-only view of `length` bytes of an open file, starting at
+    `start`.
+
+    The underlying file descriptor is positioned at the start of the range
+    and exposed through fileno(), so WSGI servers which use sendfile together
+    with the Content-Length header (e.g. gunicorn) still transfer the range
+    without copying it through Python. Other servers read it in blocks.
+    """
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.start = start
+        self.remaining = length
+        self.file.seek(start)
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.file.seek(offset, whence)
+
+    def tell(self):
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+def file_etag(name, size):
+    """Strong ETag for a stored file. Stored files are never modified in
+    place, so the storage name and size identify the content"""
+    return quote_etag(hashlib.md5(f'{name}:{size}'.encode()).hexdigest())
+
+
+def parse_range(header, size):
+    """Parse a single byte range from a Range header.
+
+    Returns a (start, length) tuple, None if the header should be ignored
+    (missing, malformed or multiple ranges), or raises ValueError if the
+    range cannot be satisfied.
+    """
+    match = _RANGE_RE.match(header.strip()) if header else None
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the final N bytes
+        length = min(int(last), size)
+        if length == 0:
+            raise ValueError('Empty suffix range')
+        return size - length, length
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError('Range not satisfiable')
+    return start, end - start + 1
+
+
+def _if_range_passes(request, etag, last_modified):
+    """Whether the Range header should be honoured given If-Range"""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    if_range_date = parse_http_date_safe(if_range)
+    return if_range_date is not None and last_modified is not None and \
+        last_modified <= if_range_date
+
+
+def serve_file(request, file, size, etag, last_modified, filename='',
+               content_encoding=''):
+    """Return a streaming response for an open file, honouring the
+    If-None-Match, If-Modified-Since, Range and If-Range request headers.
+
+    `last_modified` is a timestamp in seconds. If `content_encoding` is
+    given, the file is sent compressed with that content coding, and ranges
+    refer to the compressed bytes. The file is closed by the response, or
+    here if no body is sent.
+    """
+    not_modified = get_conditional_response(
+        request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        file.close()
+        return not_modified
+
+    status = 200
+    content_range = None
+    content_length = size
+    body = file
+    if _if_range_passes(request, etag, last_modified):
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except ValueError:
+            file.close()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        if byte_range:
+            start, content_length = byte_range
+            status = 206
+            content_range = f'bytes {start}-{start + content_length - 1}/{size}'
+            body = FileRange(file, start, content_length)
+
+    response = DownloadResponse(body, status=status, as_attachment=True,
+                                filename=filename,
+                                content_type='application/octet-stream')
+    response['Content-Length'] = content_length
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    if content_range:
+        response['Content-Range'] = content_range
+    if content_encoding:
+        response['Content-Encoding'] = content_encoding
+    return response
+
+
+def redirect_to_storage(request, url, etag, last_modified):
+    """Redirect the client to a URL from which the file can be downloaded
+    directly, unless its conditional request headers show that it already
+    holds the file"""
+    not_modified = get_conditional_response(
+        request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+    response = HttpResponseRedirect(url)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-store'
+    return response
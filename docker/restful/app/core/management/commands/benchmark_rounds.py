@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand
+
+import json
+
+from core.benchmark import in_process_server, run_rounds, \
+    compare_worker_classes
+
+
+class Command(BaseCommand):
+    help = 'Simulate federated rounds against the restful service and ' \
+           'report the throughput and latency of each phase as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            help='Base URL of a running restful service, e.g. '
+                 'http://localhost:8000/. By default the service is run in '
+                 'this process with a temporary database and storage')
+        parser.add_argument('--nodes', type=int, default=10,
+                            help='Number of nodes (default 10)')
+        parser.add_argument('--rounds', type=int, default=5,
+                            help='Number of rounds (default 5)')
+        parser.add_argument('--size', type=int, default=10 * 1024 * 1024,
+                            help='Size of the model parameters in bytes '
+                                 '(default 10 MiB)')
+        parser.add_argument(
+            '--worker-classes',
+            help='Comma-separated gunicorn worker classes to compare (e.g. '
+                 'sync,gthread,gevent,uvicorn). The service is run with '
+                 'gunicorn and each worker class in turn')
+        parser.add_argument('--workers', type=int,
+                            help='Number of gunicorn workers when comparing '
+                                 'worker classes (default from '
+                                 'gunicorn.conf.py)')
+        parser.add_argument('--threads', type=int,
+                            help='Number of threads of gthread workers when '
+                                 'comparing worker classes')
+        parser.add_argument('--output',
+                            help='Write the results to this file instead of '
+                                 'the standard output')
+
+    def handle(self, *args, **options):
+        parameters = dict(nodes=options['nodes'], rounds=options['rounds'],
+                          size=options['size'])
+        if options['worker_classes']:
+            results = compare_worker_classes(
+                options['worker_classes'].split(','),
+                workers=options['workers'], threads=options['threads'],
+                **parameters)
+        elif options['url']:
+            results = run_rounds(options['url'], **parameters)
+        else:
+            with in_process_server() as url:
+                results = run_rounds(url, **parameters)
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
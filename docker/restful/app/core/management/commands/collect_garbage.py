@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+import time
+
+from core.retention import collect_garbage
+
+
+class Command(BaseCommand):
+    help = 'Delete uploads and upload sessions according to the retention ' \
+           'settings'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep running, collecting garbage every RETENTION_INTERVAL '
+                 'seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            deleted = collect_garbage()
+            self.stdout.write(
+                f"Deleted {deleted['expired']} expired uploads, "
+                f"{deleted['evicted']} uploads over quota and "
+                f"{deleted['sessions']} stale upload sessions")
+            if not options['loop']:
+                break
+            close_old_connections()
+            time.sleep(settings.RETENTION_INTERVAL)
@@ -0,0 +1,30 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+# Key of the PostgreSQL advisory lock held while migrating
+MIGRATION_LOCK_ID = 7011001
+
+
+class Command(BaseCommand):
+    help = 'Apply migrations, in one task at a time when several tasks ' \
+           'share a PostgreSQL database'
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            self.migrate(options)
+            return
+        # Tasks starting together wait for the first one to migrate, and
+        # then find no migrations left to apply
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_lock(%s)',
+                           [MIGRATION_LOCK_ID])
+            try:
+                self.migrate(options)
+            finally:
+                cursor.execute('SELECT pg_advisory_unlock(%s)',
+                               [MIGRATION_LOCK_ID])
+
+    def migrate(self, options):
+        call_command('migrate', interactive=False,
+                     verbosity=options['verbosity'], stdout=self.stdout)
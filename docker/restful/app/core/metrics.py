@@ -0,0 +1,130 @@
+"""Prometheus metrics of the restful service
+
+When the service runs several worker processes, PROMETHEUS_MULTIPROC_DIR
+must be set to an empty directory shared by the workers, so that a scrape of
+/metrics served by any worker reports the metrics of all of them.
+"""
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, \
+    CONTENT_TYPE_LATEST, REGISTRY, generate_latest, multiprocess
+
+import hmac
+import os
+import time
+
+# Upload and download durations range from milliseconds to minutes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60, 120, 300)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                 0.5, 1)
+
+REQUEST_LATENCY = Histogram(
+    'restful_request_duration_seconds',
+    'Time taken to process requests until the response starts, by route',
+    ['method', 'route', 'status'],
+    buckets=LATENCY_BUCKETS)
+REQUESTS_IN_PROGRESS = Gauge(
+    'restful_requests_in_progress',
+    'Requests currently being processed',
+    multiprocess_mode='livesum')
+RECEIVED_BYTES = Counter(
+    'restful_received_bytes_total',
+    'Bytes received in request bodies (e.g. uploads), by route',
+    ['route'])
+SENT_BYTES = Counter(
+    'restful_sent_bytes_total',
+    'Bytes sent in response bodies (e.g. downloads), by route',
+    ['route'])
+WORKER_BUSY = Counter(
+    'restful_worker_busy_seconds_total',
+    'Time spent processing requests, by worker process. Requests served '
+    'concurrently by an ASGI worker are added together')
+DB_QUERY_LATENCY = Histogram(
+    'restful_db_query_duration_seconds',
+    'Time taken by database queries, by statement type',
+    ['statement'],
+    buckets=QUERY_BUCKETS)
+
+CACHE_HITS = Counter(
+    'restful_cache_hits_total',
+    'Reads of content served from the content cache, by tier (memory or '
+    'disk)',
+    ['tier'])
+CACHE_MISSES = Counter(
+    'restful_cache_misses_total',
+    'Reads of content which had to be loaded from storage')
+
+
+def route_name(request):
+    """Name of the URL pattern matched by a request, which has a bounded
+    number of values unlike the request path"""
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unmatched'
+
+
+def time_query(execute, sql, params, many, context):
+    """Database execute wrapper which records the duration of queries"""
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        statement = sql.lstrip().split(None, 1)[0].upper() if sql else ''
+        if statement not in ('SELECT', 'INSERT', 'UPDATE', 'DELETE'):
+            statement = 'OTHER'
+        DB_QUERY_LATENCY.labels(statement).observe(
+            time.perf_counter() - start)
+
+
+class MetricsMiddleware:
+    """Record the metrics of each request. This must be the first middleware
+    so that the time spent in the others is included"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        REQUESTS_IN_PROGRESS.inc()
+        try:
+            with connections['default'].execute_wrapper(time_query):
+                response = self.get_response(request)
+        finally:
+            REQUESTS_IN_PROGRESS.dec()
+            duration = time.perf_counter() - start
+            WORKER_BUSY.inc(duration)
+
+        route = route_name(request)
+        REQUEST_LATENCY.labels(request.method, route,
+                               response.status_code).observe(duration)
+        received = request.META.get('CONTENT_LENGTH')
+        if received and received.isdigit():
+            RECEIVED_BYTES.labels(route).inc(int(received))
+        # Streaming responses (e.g. downloads) are counted from their
+        # Content-Length, as they are sent after this returns
+        sent = response.get('Content-Length')
+        if sent is None and not response.streaming:
+            sent = len(response.content)
+        if sent is not None:
+            SENT_BYTES.labels(route).inc(int(sent))
+        return response
+
+
+def metrics_view(request):
+    """Return the metrics in the Prometheus text format. If METRICS_TOKEN is
+    set, the request must carry it as a bearer token"""
+    if settings.METRICS_TOKEN and not hmac.compare_digest(
+            request.META.get('HTTP_AUTHORIZATION', ''),
+            f'Bearer {settings.METRICS_TOKEN}'):
+        response = HttpResponse(status=401)
+        response['WWW-Authenticate'] = 'Bearer'
+        return response
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry),
+                        content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.7 on 2026-10-18 12:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='digest',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.7 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_upload_session_digest'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='upload',
+            name='created_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.1.7 on 2026-10-18 12:44
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_upload_created_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='upload',
+            name='last_accessed_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='upload',
+            name='pinned',
+            field=models.BooleanField(default=False),
+        ),
+    ]
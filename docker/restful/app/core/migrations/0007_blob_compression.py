@@ -0,0 +1,28 @@
+# Generated by Django 3.1.7 on 2026-10-18 12:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_upload_retention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='encoding',
+            field=models.CharField(blank=True, editable=False, max_length=16),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='stored_size',
+            field=models.BigIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='uploadsession',
+            name='content_encoding',
+            field=models.CharField(blank=True, max_length=16),
+        ),
+    ]
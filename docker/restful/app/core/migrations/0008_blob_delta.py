@@ -0,0 +1,24 @@
+# Generated by Django 3.1.7 on 2026-10-18 13:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_blob_compression'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='base',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='deltas', to='core.blob'),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='delta_depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+    ]
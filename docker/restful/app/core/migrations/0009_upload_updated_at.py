@@ -0,0 +1,31 @@
+# Generated by Django 3.1.7 on 2026-10-18 13:37
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_created_at(apps, schema_editor):
+    # created_at was updated by every save, so it holds the last change
+    Upload = apps.get_model('core', 'Upload')
+    Upload.objects.update(updated_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_blob_delta'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='upload',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(copy_created_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='upload',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
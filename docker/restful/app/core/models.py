@@ -1,15 +1,395 @@
-from django.db import models
+from django.conf import settings
+from django.core.files import File
+from django.db import models, transaction, IntegrityError
+from django.db.models import F
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.cache import quote_etag
+from django_cleanup import cleanup
 
+import hashlib
+import os
 import uuid
 
+from .cache import content_cache
+from .compression import IDENTITY, storage_encoding, compressed_copy, \
+    hash_decoded, DecodedFile, MIN_COMPRESSION_RATIO
+from .delta import can_be_base, delta_copy, delta_encoding, DeltaFile
+from .downloads import file_etag
+from .storage import supports_presigned_urls, verified_digest
+
 # defining database model
 
+
+def blob_name(digest):
+    """Storage name of the blob with the given digest"""
+    return f'blobs/{digest[:2]}/{digest}'
+
+
+def blob_path(instance, filename):
+    """Storage path of a blob written by the restful service. The name is
+    unique to each write, so that concurrent writes of the same content never
+    replace or delete each other's file, even on storages which overwrite
+    existing files (such as S3). Only blobs written by clients (see
+    BlobManager.adopt) are stored under their blob_name()"""
+    return f'{blob_name(instance.digest)}.{uuid.uuid4().hex}'
+
+
+def hash_file(file, chunk_size=1024 * 1024):
+    """Return the hex SHA-256 digest of a file, reading it in chunks"""
+    sha256 = hashlib.sha256()
+    for chunk in file.chunks(chunk_size):
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class BlobManager(models.Manager):
+
+    def store(self, file, digest=None, encoding=IDENTITY, size=None,
+              base=None):
+        """Return the blob holding the content of `file`, adding a reference
+        to it. The content is only written to storage if no blob with the
+        same digest exists.
+
+        The digest is taken from `digest`, or the `sha256` attribute set by
+        the hashing upload handlers, otherwise the file is read to compute
+        it.
+
+        If `encoding` is given, `file` holds content compressed with that
+        content coding, which is stored as it is. The digest and `size` are
+        those of the decompressed content, and are computed if not given.
+        Otherwise the content is compressed before it is stored, if this
+        saves space, or stored as a delta against the content of the blob
+        `base` if given and this saves more (see core.delta).
+
+        Raises:
+            ValueError: `file` is not valid compressed content
+        """
+        if encoding:
+            if not digest or size is None:
+                digest, size = hash_decoded(file, encoding)
+        else:
+            digest = digest or getattr(file, 'sha256', None) or hash_file(file)
+            size = file.size
+        if self._add_reference(digest):
+            return self.get(digest=digest)
+
+        content = None if encoding else file
+        compressed = None
+        if not encoding and storage_encoding():
+            compressed = compressed_copy(file, storage_encoding())
+        delta = None
+        if not encoding and base is not None and can_be_base(base):
+            max_size = File(compressed).size if compressed \
+                else file.size / MIN_COMPRESSION_RATIO
+            delta = delta_copy(file, base, max_size)
+            if delta:
+                if compressed:
+                    compressed.close()
+                compressed = delta
+        if compressed:
+            file = File(compressed)
+            encoding = delta_encoding() if delta else storage_encoding()
+
+        # The file is written outside of any transaction so that the database
+        # is not locked while a large file is copied to storage
+        blob = self.model(digest=digest, size=size, stored_size=file.size,
+                          encoding=encoding, ref_count=1)
+        if delta:
+            blob.base = base
+            blob.delta_depth = base.delta_depth + 1
+        try:
+            blob.file.save(digest, file, save=False)
+        finally:
+            if compressed:
+                compressed.close()
+        try:
+            with transaction.atomic():
+                blob.save(force_insert=True)
+                # A delta holds a reference to its base
+                if blob.base_id and not self._add_reference(blob.base_id):
+                    raise IntegrityError(f'Base {blob.base_id} was deleted')
+        except IntegrityError:
+            # Another request stored the same content at the same time, in
+            # another file (see blob_path)
+            blob.file.storage.delete(blob.file.name)
+            if not self._add_reference(digest):
+                raise
+            return self.get(digest=digest)
+        # The content is about to be downloaded by the nodes
+        if content is not None and blob.is_cached:
+            content_cache().put(digest, size, content)
+        return blob
+
+    def adopt(self, digest, size):
+        """Return the blob for content which has already been written to
+        storage under its blob name (e.g. directly by a client using a
+        presigned URL), adding a reference to it.
+
+        The digest of the content is checked, so that other content is
+        never deduplicated onto it. S3 verifies the digest when the client
+        sends the checksum required by the presigned URL; otherwise the
+        content is read back and hashed.
+
+        Raises:
+            FileNotFoundError: the content has not been written to storage,
+                or its size does not match
+            ValueError: the digest of the stored content does not match
+        """
+        if self._add_reference(digest):
+            return self.get(digest=digest)
+
+        name = blob_name(digest)
+        storage = self.model._meta.get_field('file').storage
+        if not storage.exists(name) or storage.size(name) != size:
+            raise FileNotFoundError(f'No content of {size} bytes has been '
+                                    f'stored for {digest}')
+        stored_digest = verified_digest(name)
+        if stored_digest is None:
+            with storage.open(name) as file:
+                stored_digest = hash_file(file)
+        if stored_digest != digest:
+            raise ValueError(f'The stored content does not match the digest '
+                             f'{digest}')
+        blob = self.model(digest=digest, file=name, size=size,
+                          stored_size=size, ref_count=1)
+        try:
+            with transaction.atomic():
+                blob.save(force_insert=True)
+        except IntegrityError:
+            if not self._add_reference(digest):
+                raise
+            return self.get(digest=digest)
+        return blob
+
+    def release(self, digest):
+        """Remove a reference to a blob, deleting it (and its file) when it is
+        no longer referenced by any upload"""
+        with transaction.atomic():
+            self.filter(digest=digest).update(ref_count=F('ref_count') - 1)
+            self.filter(digest=digest, ref_count__lte=0).delete()
+
+    def _add_reference(self, digest):
+        return self.filter(digest=digest).update(
+            ref_count=F('ref_count') + 1) > 0
+
+
+class Blob(models.Model):
+    # Content-addressed storage for uploaded files. Uploads with identical
+    # content share a single blob:
+    # - the SHA-256 digest of the content (as primary key)
+    # - the file holding the content
+    # - the size of the content in bytes
+    # - the content coding with which the file is compressed, if any
+    # - the size of the (compressed) file in bytes
+    # - the number of uploads (and deltas) referencing this blob
+    # - the blob against which the file is a delta, if any, and the number
+    #   of deltas in the chain of bases
+    # - a timestamp
+    digest = models.CharField(primary_key=True, max_length=64, editable=False)
+    file = models.FileField(upload_to=blob_path, null=False, editable=False)
+    size = models.BigIntegerField(editable=False)
+    encoding = models.CharField(max_length=16, blank=True, editable=False)
+    stored_size = models.BigIntegerField(null=True, editable=False)
+    ref_count = models.PositiveIntegerField(default=0, editable=False)
+    base = models.ForeignKey('self', null=True, blank=True, editable=False,
+                             on_delete=models.PROTECT, related_name='deltas')
+    delta_depth = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    created_at = models.DateTimeField(auto_now_add=True, editable=False)
+
+    objects = BlobManager()
+
+    def open_stored(self):
+        """Open the stored (compressed) file for reading"""
+        return self.file.storage.open(self.file.name, 'rb')
+
+    def open_content(self):
+        """Open the (decompressed) content for reading. Content which must be
+        decompressed, rebuilt from a delta or fetched from S3 is read through
+        the content cache (see core.cache)"""
+        if not self.is_cached:
+            return self.open_stored()
+        return content_cache().open(self.digest, self.size, self._load)
+
+    def _load(self):
+        file = self.open_stored()
+        if self.base_id:
+            return DeltaFile(file, self.encoding,
+                             base=self.base.open_content())
+        if self.encoding:
+            return DecodedFile(file, self.encoding)
+        return file
+
+    @property
+    def is_cached(self):
+        """Whether the content is read through the content cache rather
+        than straight from the local filesystem"""
+        return bool(self.encoding) or supports_presigned_urls()
+
+    @property
+    def compression_ratio(self):
+        """Size of the content divided by the size of the stored file"""
+        if not self.stored_size:
+            return 1.0
+        return round(self.size / self.stored_size, 3)
+
+    @property
+    def encoded_etag(self):
+        """ETag of the stored file, sent with its Content-Encoding"""
+        if self.base_id:
+            return quote_etag(f'{self.digest}.delta.{self.encoding}')
+        return quote_etag(f'{self.digest}.{self.encoding}')
+
+    @property
+    def delta_etag(self):
+        """ETag of the decompressed delta against the base"""
+        return quote_etag(f'{self.digest}.delta')
+
+
+# Files of uploads are owned by their blob, which may be shared, so they must
+# not be deleted by django_cleanup when an upload is deleted or changed
+@cleanup.ignore
 class Upload(models.Model):
     # Django Database model is defined as follow:
     # - an unique id (as primary key)
     # - a file path
-    # - a timestamp
+    # - when the upload was created, which a new file does not change, and
+    #   when it was last changed
+    # - the blob holding the file content
+    # - the original name of the uploaded file
+    # - whether the upload must be kept by the retention rules
+    # - when the file was last downloaded (or uploaded), for LRU eviction
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     file = models.FileField(upload_to='uploads/%Y/%m/%d', null=False)
 
-    created_at = models.DateTimeField(auto_now=True, blank=False, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True, blank=False,
+                                      editable=False, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True, editable=False)
+
+    blob = models.ForeignKey(Blob, null=True, blank=True, editable=False,
+                             on_delete=models.PROTECT, related_name='uploads')
+    filename = models.CharField(max_length=255, blank=True, editable=False)
+    pinned = models.BooleanField(default=False)
+    last_accessed_at = models.DateTimeField(default=timezone.now, db_index=True,
+                                            editable=False)
+
+    def store_file(self, file, name=None, digest=None, encoding=IDENTITY,
+                   size=None, base=None):
+        """Point this upload at the blob holding the content of `file`, which
+        is compressed with `encoding` if given, or stored as a delta against
+        the content of the upload `base` (see BlobManager.store).
+        Returns the digest of the blob previously referenced, which the
+        caller must release once this upload has been saved"""
+        blob = Blob.objects.store(file, digest=digest, encoding=encoding,
+                                  size=size,
+                                  base=base.blob if base else None)
+        return self._set_blob(blob, name=name or file.name)
+
+    def store_existing(self, digest, size, name):
+        """Point this upload at content which has already been written to
+        storage under its blob name. Returns the digest of the blob
+        previously referenced, as for store_file()"""
+        return self._set_blob(Blob.objects.adopt(digest, size), name=name)
+
+    def _set_blob(self, blob, name):
+        previous_digest = self.blob_id
+        self.blob = blob
+        self.file = blob.file.name
+        self.filename = os.path.basename(name or '')
+        return previous_digest
+
+    @property
+    def size(self):
+        return self.blob.size if self.blob else self.file.size
+
+    @property
+    def stored_size(self):
+        if self.blob and self.blob.stored_size is not None:
+            return self.blob.stored_size
+        return self.size
+
+    @property
+    def compression_ratio(self):
+        return self.blob.compression_ratio if self.blob else 1.0
+
+    @property
+    def delta_base(self):
+        """Digest of the content against which this upload is stored as a
+        delta, if it is"""
+        return self.blob.base_id if self.blob else None
+
+    @property
+    def download_filename(self):
+        return self.filename or os.path.basename(self.file.name)
+
+    @property
+    def etag(self):
+        # Uploads with identical content share the same ETag, so a client
+        # which already holds the content does not need to fetch it again
+        if self.blob_id:
+            return quote_etag(self.blob_id)
+        return file_etag(self.file.name, self.file.size)
+
+
+@receiver(post_delete, sender=Upload)
+def release_upload_file(sender, instance, **kwargs):
+    """Release the blob of a deleted upload, or delete the file of uploads
+    stored before content-addressed storage was introduced"""
+    if instance.blob_id:
+        Blob.objects.release(instance.blob_id)
+    elif instance.file:
+        instance.file.delete(save=False)
+
+
+@receiver(post_delete, sender=Blob)
+def release_delta_base(sender, instance, **kwargs):
+    """Release the base of a deleted delta"""
+    if instance.base_id:
+        Blob.objects.release(instance.base_id)
+
+
+class UploadSession(models.Model):
+    # A resumable upload which is received in several chunks:
+    # - an unique id (as primary key)
+    # - the name of the file being uploaded
+    # - the expected total size in bytes (optional)
+    # - the SHA-256 digest of the content (optional). When the storage
+    #   supports presigned URLs, a session with a digest and size is a direct
+    #   upload: the client sends the content straight to storage
+    # - the content coding with which the client compresses the content sent
+    #   in chunks, if any. The size is that of the compressed content, while
+    #   the digest is that of the decompressed content
+    # - the number of bytes received so far
+    # - the finished Upload, once the session has been finalized
+    # - timestamps
+    # The received bytes are kept in a partial file outside of the media
+    # storage until the session is finalized
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    filename = models.CharField(max_length=255, blank=False)
+    size = models.BigIntegerField(null=True, blank=True)
+    digest = models.CharField(max_length=64, blank=True)
+    content_encoding = models.CharField(max_length=16, blank=True)
+    offset = models.BigIntegerField(default=0, editable=False)
+    upload = models.OneToOneField(Upload, null=True, blank=True,
+                                  on_delete=models.SET_NULL, editable=False)
+
+    created_at = models.DateTimeField(auto_now_add=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True, editable=False)
+
+    @property
+    def partial_path(self):
+        """Path of the file holding the bytes received so far"""
+        return os.path.join(settings.UPLOAD_SESSION_ROOT, str(self.id))
+
+    @property
+    def is_complete(self):
+        """True if all the expected bytes have been received"""
+        return self.size is None or self.offset == self.size
+
+    @property
+    def is_direct(self):
+        """True if the content is sent straight to storage by the client"""
+        return bool(self.digest) and self.size is not None and \
+            not self.content_encoding and supports_presigned_urls()
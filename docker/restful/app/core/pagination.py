@@ -0,0 +1,13 @@
+"""Pagination of the upload listing"""
+
+from rest_framework.pagination import CursorPagination
+
+
+class UploadCursorPagination(CursorPagination):
+    """Paginate uploads with an opaque cursor on the indexed created_at
+    field, so that fetching a page costs the same however many uploads are
+    stored (unlike offset pagination, which counts and skips rows)"""
+    ordering = '-created_at'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
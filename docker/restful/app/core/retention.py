@@ -0,0 +1,145 @@
+"""Deletion of uploads according to the retention settings"""
+
+from django.conf import settings
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+import datetime
+import os
+import time
+
+from .models import Blob, Upload, UploadSession
+from .uploads import remove_partial_file
+
+# Downloads only update the last access time of an upload if it is older than
+# this, so that repeated downloads do not each write to the database
+ACCESS_RESOLUTION = datetime.timedelta(minutes=1)
+
+
+def record_access(upload):
+    """Record that an upload has been downloaded, for LRU eviction"""
+    now = timezone.now()
+    Upload.objects.filter(
+        pk=upload.pk, last_accessed_at__lt=now - ACCESS_RESOLUTION
+    ).update(last_accessed_at=now)
+
+
+def stored_bytes():
+    """Total size of the stored (compressed) files, counting shared content
+    once"""
+    return Blob.objects.aggregate(
+        total=Sum(Coalesce('stored_size', 'size')))['total'] or 0
+
+
+def session_bytes():
+    """Total size of the partial files of upload sessions"""
+    total = 0
+    try:
+        with os.scandir(settings.UPLOAD_SESSION_ROOT) as scan:
+            for entry in scan:
+                if entry.is_file():
+                    total += entry.stat().st_size
+    except FileNotFoundError:
+        pass
+    return total
+
+
+def used_bytes():
+    """Bytes counted against the quota. When uploads are stored on the local
+    disk, this is shared with the partial files of upload sessions and with
+    the disk cache, which is counted at its maximum size as it grows again
+    after uploads are evicted"""
+    used = stored_bytes()
+    if settings.STORAGE_BACKEND == 'filesystem':
+        used += session_bytes() + settings.CACHE_DISK_BYTES
+    return used
+
+
+def _delete_batch(ids):
+    # Deleting the uploads releases their blobs (see release_upload_file)
+    Upload.objects.filter(pk__in=ids).delete()
+    return len(ids)
+
+
+def delete_expired_uploads(max_age, batch_size, pause=0):
+    """Delete the unpinned uploads created more than `max_age` ago"""
+    cutoff = timezone.now() - max_age
+    expired = Upload.objects.filter(pinned=False, created_at__lt=cutoff) \
+        .order_by('created_at')
+    deleted = 0
+    while True:
+        ids = list(expired.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += _delete_batch(ids)
+        time.sleep(pause)
+
+
+def evict_to_quota(quota, batch_size, pause=0):
+    """Delete the least recently accessed unpinned uploads until the used
+    bytes (see used_bytes) fit within `quota`, or only pinned uploads
+    remain"""
+    candidates = Upload.objects.filter(pinned=False) \
+        .order_by('last_accessed_at')
+    deleted = 0
+    excess = used_bytes() - quota
+    while excess > 0:
+        batch = candidates.annotate(
+            stored_size=Coalesce('blob__stored_size', 'blob__size')
+        ).values_list('pk', 'blob_id', 'stored_size',
+                      'blob__ref_count')[:batch_size]
+        # Only delete as many uploads as needed to free the excess. Content
+        # is only freed by deleting the last upload which references it.
+        # The reference count of a blob also counts the deltas stored
+        # against it, so the content of a base is never counted as freed
+        # while deltas need it
+        ids = []
+        freed = 0
+        references = {}
+        for pk, digest, size, ref_count in batch:
+            ids.append(pk)
+            references[digest] = references.get(digest, 0) + 1
+            if digest is None or references[digest] == ref_count:
+                freed += size or 0
+            if freed >= excess:
+                break
+        if not ids:
+            break
+        deleted += _delete_batch(ids)
+        excess = used_bytes() - quota
+        time.sleep(pause)
+    return deleted
+
+
+def delete_stale_sessions(max_age):
+    """Delete upload sessions, and their partial files, which have not been
+    updated for `max_age`"""
+    cutoff = timezone.now() - max_age
+    stale = UploadSession.objects.filter(updated_at__lt=cutoff)
+    deleted = 0
+    for session in stale.iterator():
+        remove_partial_file(session.partial_path)
+        session.delete()
+        deleted += 1
+    return deleted
+
+
+def collect_garbage():
+    """Apply the retention settings. Returns the number of uploads and
+    upload sessions deleted by each rule"""
+    batch_size = settings.RETENTION_BATCH_SIZE
+    pause = settings.RETENTION_BATCH_PAUSE
+    deleted = {'expired': 0, 'evicted': 0, 'sessions': 0}
+
+    if settings.RETENTION_MAX_AGE_DAYS:
+        deleted['expired'] = delete_expired_uploads(
+            datetime.timedelta(days=settings.RETENTION_MAX_AGE_DAYS),
+            batch_size, pause)
+    if settings.RETENTION_QUOTA_BYTES:
+        deleted['evicted'] = evict_to_quota(
+            settings.RETENTION_QUOTA_BYTES, batch_size, pause)
+    if settings.RETENTION_SESSION_MAX_AGE_HOURS:
+        deleted['sessions'] = delete_stale_sessions(
+            datetime.timedelta(hours=settings.RETENTION_SESSION_MAX_AGE_HOURS))
+    return deleted
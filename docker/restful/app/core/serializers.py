@@ -1,9 +1,151 @@
-from rest_framework.serializers import HyperlinkedModelSerializer
+from django.conf import settings
+from django.db import transaction
+from rest_framework.serializers import HyperlinkedModelSerializer, \
+    HyperlinkedIdentityField, ReadOnlyField, SerializerMethodField, \
+    ChoiceField, ValidationError, Serializer, ListField, FileField, \
+    BooleanField, PrimaryKeyRelatedField
 
-from .models import Upload
+from .compression import supported_encodings
+from .models import Blob, Upload, UploadSession, blob_name
+from .storage import presigned_upload_url, upload_headers
+
+import re
 
 
 class UploadSerializer(HyperlinkedModelSerializer):
+    download = HyperlinkedIdentityField(view_name='upload-download')
+    digest = ReadOnlyField(source='blob_id')
+    size = ReadOnlyField()
+    stored_size = ReadOnlyField()
+    compression_ratio = ReadOnlyField()
+    # Content coding with which the client compressed the uploaded file
+    content_encoding = ChoiceField(choices=supported_encodings(),
+                                   allow_blank=True, required=False,
+                                   write_only=True)
+    # Upload against which the file is stored as a delta, if smaller
+    base = PrimaryKeyRelatedField(queryset=Upload.objects.select_related('blob'),
+                                  allow_null=True, required=False,
+                                  write_only=True)
+    delta_base = ReadOnlyField()
+
     class Meta:
         model = Upload
-        fields = '__all__'
+        fields = ['url', 'id', 'file', 'filename', 'digest', 'size',
+                  'stored_size', 'compression_ratio', 'content_encoding',
+                  'base', 'delta_base', 'pinned', 'created_at',
+                  'updated_at', 'last_accessed_at', 'download']
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Compressed files are only served decompressed by the download
+        # action, so clients which fetch the file URL are sent there
+        if instance.blob and instance.blob.encoding:
+            data['file'] = data['download']
+        return data
+
+    def create(self, validated_data):
+        upload = Upload(pinned=validated_data.get('pinned', False))
+        self._store_file(upload, validated_data)
+        upload.save()
+        return upload
+
+    def update(self, instance, validated_data):
+        if 'pinned' in validated_data:
+            instance.pinned = validated_data['pinned']
+        if 'file' not in validated_data:
+            # Pinning an upload does not change its timestamp
+            instance.save(update_fields=['pinned'])
+            return instance
+        previous_digest = self._store_file(instance, validated_data)
+        instance.save()
+        if previous_digest:
+            Blob.objects.release(previous_digest)
+        return instance
+
+    @staticmethod
+    def _store_file(upload, validated_data):
+        try:
+            return upload.store_file(
+                validated_data['file'],
+                encoding=validated_data.get('content_encoding', ''),
+                base=validated_data.get('base'))
+        except ValueError as e:
+            raise ValidationError({'file': str(e)})
+
+
+class UploadBatchSerializer(Serializer):
+    """Many files uploaded in one multipart request, each as a `file` part"""
+    file = ListField(child=FileField(), min_length=1,
+                     max_length=settings.UPLOAD_BATCH_MAX_FILES)
+    # Content coding with which the client compressed all the files
+    content_encoding = ChoiceField(choices=supported_encodings(),
+                                   allow_blank=True, required=False)
+    # Upload against which all the files are stored as deltas, if smaller
+    base = PrimaryKeyRelatedField(queryset=Upload.objects.select_related('blob'),
+                                  allow_null=True, required=False)
+    pinned = BooleanField(default=False)
+
+    def create(self, validated_data):
+        """Store the files and create their uploads, returning the list of
+        uploads in the order of the files"""
+        uploads = []
+        try:
+            # The files are written to storage outside of the transaction,
+            # as for single uploads, and the uploads are then inserted at once
+            for index, file in enumerate(validated_data['file']):
+                upload = Upload(pinned=validated_data['pinned'])
+                try:
+                    upload.store_file(
+                        file,
+                        encoding=validated_data.get('content_encoding', ''),
+                        base=validated_data.get('base'))
+                except ValueError as e:
+                    raise ValidationError({'file': {index: str(e)}})
+                uploads.append(upload)
+            with transaction.atomic():
+                Upload.objects.bulk_create(uploads)
+        except BaseException:
+            for upload in uploads:
+                Blob.objects.release(upload.blob_id)
+            raise
+        return uploads
+
+
+class UploadSessionSerializer(HyperlinkedModelSerializer):
+    upload_url = SerializerMethodField()
+    upload_headers = SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields = ['url', 'id', 'filename', 'size', 'digest',
+                  'content_encoding', 'offset', 'upload', 'upload_url',
+                  'upload_headers', 'created_at', 'updated_at']
+
+    def validate_digest(self, value):
+        value = value.lower()
+        if value and not re.fullmatch(r'[0-9a-f]{64}', value):
+            raise ValidationError('Must be a hex SHA-256 digest.')
+        return value
+
+    def validate_content_encoding(self, value):
+        if value and value not in supported_encodings():
+            raise ValidationError(f'Unsupported content coding {value!r}.')
+        return value
+
+    def get_upload_url(self, session):
+        """Presigned URL to which a direct upload sends its content, unless
+        the content is already stored"""
+        if not self._needs_content(session):
+            return None
+        return presigned_upload_url(blob_name(session.digest), session.digest)
+
+    def get_upload_headers(self, session):
+        """Headers which the PUT to upload_url must have"""
+        if not self._needs_content(session):
+            return None
+        return upload_headers(session.digest)
+
+    @staticmethod
+    def _needs_content(session):
+        return session.is_direct and not session.upload_id and \
+            not Blob.objects.filter(digest=session.digest).exists()
@@ -0,0 +1,23 @@
+"""Storage of the static files of the admin site and browsable API
+
+Static files are collected when the image is built, with a hash of their
+content in their names and precompressed with gzip and brotli, and are served
+by WhiteNoiseMiddleware. Files with hashed names never change, so they are
+served with headers allowing browsers to cache them forever.
+"""
+
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+
+class ImmutableStaticFilesStorage(CompressedManifestStaticFilesStorage):
+    """Static files with hashed names, compressed when collected.
+
+    Django only uses the hashed names when DEBUG is off. Here they are used
+    whenever the files have been collected, so that DEBUG does not prevent
+    browsers from caching them. Without collected files (e.g. when developing
+    with runserver), the files are served under their original names.
+    """
+    manifest_strict = False
+
+    def url(self, name, force=False):
+        return super().url(name, force=force or bool(self.hashed_files))
@@ -0,0 +1,71 @@
+"""Presigned URLs for the storage of uploaded files
+
+Uploaded files are stored either on the local disk of the restful service or
+in an S3 bucket (see STORAGE_BACKEND in the settings). With S3, clients
+transfer file contents directly to and from the bucket using presigned URLs,
+so that the restful service only handles metadata.
+"""
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+import base64
+
+
+def supports_presigned_urls():
+    """True if clients can transfer files directly to and from storage"""
+    return settings.STORAGE_BACKEND == 's3'
+
+
+def _key(name):
+    """S3 key of the file `name`"""
+    return default_storage._normalize_name(default_storage._clean_name(name))
+
+
+def sha256_checksum(digest):
+    """The base64 form of a hex SHA-256 digest used by S3 checksums"""
+    return base64.b64encode(bytes.fromhex(digest)).decode()
+
+
+def presigned_upload_url(name, digest):
+    """URL which allows a client to PUT the content of the file `name`. The
+    request must have the headers given by upload_headers(digest): S3
+    rejects content whose SHA-256 digest is not `digest`"""
+    return default_storage.bucket.meta.client.generate_presigned_url(
+        'put_object', Params={
+            'Bucket': default_storage.bucket_name,
+            'Key': _key(name),
+            'ChecksumSHA256': sha256_checksum(digest)},
+        ExpiresIn=settings.AWS_QUERYSTRING_EXPIRE, HttpMethod='PUT')
+
+
+def upload_headers(digest):
+    """Headers of a PUT to a URL given by presigned_upload_url()"""
+    return {'x-amz-checksum-sha256': sha256_checksum(digest)}
+
+
+def verified_digest(name):
+    """Hex SHA-256 digest which S3 verified when the file `name` was
+    written, or None if the content was written without a checksum (or the
+    storage does not keep checksums)"""
+    if not supports_presigned_urls():
+        return None
+    response = default_storage.bucket.meta.client.head_object(
+        Bucket=default_storage.bucket_name,
+        Key=_key(name), ChecksumMode='ENABLED')
+    checksum = response.get('ChecksumSHA256')
+    # Checksums of multipart uploads are not digests of the whole content
+    if not checksum or '-' in checksum:
+        return None
+    return base64.b64decode(checksum).hex()
+
+
+def presigned_download_url(name, filename, content_encoding=''):
+    """URL which allows a client to GET the file `name`, which is saved as
+    `filename`. If `content_encoding` is given, the response declares that
+    the file is compressed with this content coding"""
+    parameters = {
+        'ResponseContentDisposition': f'attachment; filename="{filename}"'}
+    if content_encoding:
+        parameters['ResponseContentEncoding'] = content_encoding
+    return default_storage.url(name, parameters=parameters)
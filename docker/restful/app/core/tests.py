@@ -1,3 +1,862 @@
-from django.test import TestCase
+import asyncio
+import base64
+import boto3
+import datetime
+import gzip
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import time
+import zstandard
 
-# Create your tests here.
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from asgiref.testing import ApplicationCommunicator
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connections
+from django.templatetags.static import static
+from django.core.servers.basehttp import WSGIServer
+from django.test import TestCase, TransactionTestCase, LiveServerTestCase, \
+    override_settings
+from django.test.testcases import LiveServerThread
+from django.utils import timezone
+from moto import mock_aws
+from prometheus_client import REGISTRY
+from rest_framework.test import APIClient
+
+from .asgi import StreamingASGIHandler
+from .benchmark import run_rounds, QuietWSGIRequestHandler
+from .cache import ContentCache
+from .models import Blob, Upload, UploadSession
+from .retention import collect_garbage
+from .views import UploadSessionViewSet
+
+
+class TemporaryStorageMixin:
+    """Store media and partial uploads in a temporary directory"""
+
+    def setUp(self):
+        super().setUp()
+        self.storage_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.storage_dir, ignore_errors=True)
+        storage_settings = override_settings(
+            MEDIA_ROOT=f'{self.storage_dir}/media/',
+            UPLOAD_SESSION_ROOT=f'{self.storage_dir}/sessions/',
+            CACHE_DIR=f'{self.storage_dir}/cache/')
+        storage_settings.enable()
+        self.addCleanup(storage_settings.disable)
+        self.client = APIClient()
+
+
+class DatabaseConnectionTests(TestCase):
+
+    def test_sqlite_uses_wal(self):
+        """SQLite database files are opened with write-ahead logging"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        settings_dict = dict(connections['default'].settings_dict,
+                             NAME=os.path.join(directory, 'db.sqlite3'))
+        wrapper = type(connections['default'])(settings_dict, alias='wal')
+        self.addCleanup(wrapper.close)
+        with wrapper.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+
+
+class ContentAddressedStorageTests(TemporaryStorageMixin, TransactionTestCase):
+    # Files are deleted by django_cleanup when the transaction is committed
+
+    def upload(self, content, name='params.pt'):
+        response = self.client.post('/upload/', {
+            'file': SimpleUploadedFile(name, content)}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        return response.data
+
+    def test_identical_uploads_share_blob(self):
+        """Identical content is stored once and referenced by each upload"""
+        first = self.upload(b'weights', name='round1.pt')
+        second = self.upload(b'weights', name='round2.pt')
+        self.upload(b'other weights')
+
+        self.assertEqual(first['digest'], second['digest'])
+        self.assertEqual(first['file'], second['file'])
+        self.assertEqual(second['filename'], 'round2.pt')
+        self.assertEqual(Blob.objects.get(digest=first['digest']).ref_count, 2)
+        self.assertEqual(Blob.objects.count(), 2)
+
+    def test_blob_deleted_with_last_upload(self):
+        """A blob and its file are removed once no upload references it"""
+        first = self.upload(b'weights')
+        second = self.upload(b'weights')
+        blob = Blob.objects.get()
+        path = blob.file.path
+
+        self.client.delete(f'/upload/{first["id"]}/')
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        self.assertTrue(os.path.exists(path))
+
+        self.client.delete(f'/upload/{second["id"]}/')
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+
+class UploadSessionTests(TemporaryStorageMixin, TestCase):
+
+    def create_session(self, **data):
+        response = self.client.post('/upload-session/', data, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def send_chunk(self, session_id, offset, data):
+        return self.client.put(f'/upload-session/{session_id}/chunk/', data,
+                               content_type='application/octet-stream',
+                               HTTP_UPLOAD_OFFSET=str(offset))
+
+    def test_chunked_upload_creates_upload(self):
+        """Chunks sent in order are assembled into an ordinary Upload"""
+        session_id = self.create_session(filename='params.pt', size=10)
+
+        response = self.send_chunk(session_id, 0, b'01234')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Upload-Offset'], '5')
+        self.assertEqual(self.send_chunk(session_id, 5, b'56789').status_code,
+                         200)
+
+        response = self.client.post(f'/upload-session/{session_id}/finalize/')
+        self.assertEqual(response.status_code, 201)
+        upload = Upload.objects.get()
+        with upload.file.open('rb') as f:
+            self.assertEqual(f.read(), b'0123456789')
+        self.assertEqual(UploadSession.objects.get().upload, upload)
+
+    def test_resume_from_offset(self):
+        """A client can query the offset and resume after a mismatch"""
+        session_id = self.create_session(filename='params.pt')
+        self.send_chunk(session_id, 0, b'abc')
+
+        response = self.send_chunk(session_id, 0, b'abc')
+        self.assertEqual(response.status_code, 409)
+
+        response = self.client.get(f'/upload-session/{session_id}/')
+        self.assertEqual(response.data['offset'], 3)
+        self.send_chunk(session_id, 3, b'def')
+
+        self.client.post(f'/upload-session/{session_id}/finalize/')
+        with Upload.objects.get().file.open('rb') as f:
+            self.assertEqual(f.read(), b'abcdef')
+
+    def test_finalize_twice(self):
+        """Finalizing again returns the same upload, and a session whose
+        upload was deleted cannot be finalized with no content"""
+        session_id = self.create_session(filename='params.pt', size=10)
+        self.send_chunk(session_id, 0, b'0123456789')
+        first = self.client.post(f'/upload-session/{session_id}/finalize/')
+        self.assertEqual(first.status_code, 201)
+
+        # A request which read the session before it was finalized
+        session = UploadSession.objects.get()
+        session.upload = None
+        UploadSessionViewSet._finalize_chunks(session)
+        self.assertEqual(str(session.upload_id), first.data['id'])
+
+        second = self.client.post(f'/upload-session/{session_id}/finalize/')
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second.data['id'], first.data['id'])
+
+        self.client.delete(f'/upload/{first.data["id"]}/')
+        response = self.client.post(f'/upload-session/{session_id}/finalize/')
+        self.assertEqual(response.status_code, 410)
+        self.assertFalse(Upload.objects.exists())
+
+    def test_finalize_empty_upload(self):
+        """A session of an empty file is finalized without any chunk"""
+        session_id = self.create_session(filename='empty.pt', size=0)
+        response = self.client.post(f'/upload-session/{session_id}/finalize/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['size'], 0)
+
+    def test_finalize_incomplete_upload(self):
+        """Finalizing before all declared bytes arrive is rejected"""
+        session_id = self.create_session(filename='params.pt', size=10)
+        self.send_chunk(session_id, 0, b'01234')
+
+        response = self.client.post(f'/upload-session/{session_id}/finalize/')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Upload.objects.exists())
+        self.assertEqual(self.send_chunk(session_id, 5, b'567890').status_code,
+                         400)
+
+
+class UploadDownloadTests(TemporaryStorageMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        upload = Upload()
+        upload.file.save('params.pt', ContentFile(b'0123456789'))
+        self.url = f'/upload/{upload.id}/download/'
+
+    def test_download(self):
+        """The whole file is returned with validators for later requests"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+
+    def test_replace_file(self):
+        """Replacing the file of an upload keeps its creation time, so the
+        upload is not listed as new, but changes its Last-Modified time"""
+        upload = Upload.objects.get()
+        yesterday = timezone.now() - datetime.timedelta(days=1)
+        Upload.objects.update(created_at=yesterday, updated_at=yesterday)
+        response = self.client.put(f'/upload/{upload.id}/', {
+            'file': SimpleUploadedFile('params.pt', b'9876543210')},
+            format='multipart')
+        self.assertEqual(response.status_code, 200)
+        upload.refresh_from_db()
+        self.assertEqual(upload.created_at, yesterday)
+        self.assertGreater(upload.updated_at, yesterday)
+        response = self.client.get('/upload/', {
+            'created_after': (yesterday + datetime.timedelta(minutes=1))
+            .isoformat()})
+        self.assertEqual(response.data['results'], [])
+
+    def test_if_none_match(self):
+        """A client which already holds the file is answered with 304"""
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_range(self):
+        """Byte ranges are served with 206 and 416 when unsatisfiable"""
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=20-')
+        self.assertEqual(response.status_code, 416)
+
+    def test_if_range_mismatch(self):
+        """A stale If-Range validator returns the whole file"""
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-5',
+                                   HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+
+
+class BatchUploadTests(TemporaryStorageMixin, TestCase):
+
+    def batch(self, files, **data):
+        return self.client.post('/upload/batch/', {
+            'file': [SimpleUploadedFile(name, content)
+                     for name, content in files], **data},
+            format='multipart')
+
+    def test_batch_upload(self):
+        """All the files of a batch are uploaded in one request"""
+        files = [(f'node_{i}.pt', b'params %d' % (i % 2)) for i in range(3)]
+        response = self.batch(files, pinned='true')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([upload['filename'] for upload in response.data],
+                         ['node_0.pt', 'node_1.pt', 'node_2.pt'])
+        self.assertEqual(Upload.objects.filter(pinned=True).count(), 3)
+        self.assertEqual(Blob.objects.get(
+            digest=response.data[0]['digest']).ref_count, 2)
+        self.assertIsNotNone(Upload.objects.first().created_at)
+
+        download = self.client.get(response.data[1]['download'])
+        self.assertEqual(b''.join(download.streaming_content), b'params 1')
+
+    def test_invalid_file(self):
+        """No uploads are created if any file of the batch is invalid"""
+        response = self.batch([('a.pt', gzip.compress(b'a')),
+                               ('b.pt', b'not gzip')],
+                              content_encoding='gzip')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('1', str(response.data['file']))
+        self.assertFalse(Upload.objects.exists())
+        self.assertFalse(Blob.objects.filter(ref_count__gt=0).exists())
+
+
+class UploadListTests(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        start = timezone.now() - datetime.timedelta(days=1)
+        self.uploads = []
+        for i in range(5):
+            blob = Blob.objects.create(digest=f'{i:064x}', size=1,
+                                       ref_count=1, file=f'blobs/{i:064x}')
+            upload = Upload.objects.create(blob=blob, file=blob.file.name)
+            # created_at is set on save, so it is changed afterwards
+            Upload.objects.filter(pk=upload.pk).update(
+                created_at=start + datetime.timedelta(minutes=i))
+            upload.refresh_from_db()
+            self.uploads.append(upload)
+
+    def ids(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.data['results']]
+
+    def expected(self, *indices):
+        return [str(self.uploads[i].id) for i in indices]
+
+    def test_cursor_pagination(self):
+        """Pages are fetched by following the next cursor, newest first"""
+        response = self.client.get('/upload/', {'page_size': 2})
+        self.assertEqual(self.ids(response), self.expected(4, 3))
+        response = self.client.get(response.data['next'])
+        self.assertEqual(self.ids(response), self.expected(2, 1))
+        response = self.client.get(response.data['next'])
+        self.assertEqual(self.ids(response), self.expected(0))
+        self.assertIsNone(response.data['next'])
+
+    def test_filter_newer_uploads(self):
+        """Only uploads newer than a timestamp or an upload are listed"""
+        response = self.client.get('/upload/', {
+            'created_after': self.uploads[2].created_at.isoformat(),
+            'ordering': 'created_at'})
+        self.assertEqual(self.ids(response), self.expected(3, 4))
+
+        response = self.client.get('/upload/', {'after': self.uploads[3].id})
+        self.assertEqual(self.ids(response), self.expected(4))
+
+        response = self.client.get('/upload/', {'created_after': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/upload/', {'after': 'unknown'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(STORAGE_COMPRESSION='zstd')
+class CompressionTests(TemporaryStorageMixin, TestCase):
+
+    content = b'0.5 ' * 10000
+
+    def upload(self, content, **data):
+        response = self.client.post('/upload/', {
+            'file': SimpleUploadedFile('params.pt', content), **data},
+            format='multipart')
+        return response
+
+    def test_stored_compressed(self):
+        """Compressible content is stored compressed, and decompressed for
+        clients which do not accept its content coding"""
+        data = self.upload(self.content).data
+        blob = Blob.objects.get()
+        self.assertEqual(blob.encoding, 'zstd')
+        self.assertEqual(data['size'], len(self.content))
+        self.assertEqual(data['stored_size'], blob.file.size)
+        self.assertGreater(data['compression_ratio'], 10)
+        self.assertEqual(data['file'], data['download'])
+
+        response = self.client.get(data['download'],
+                                   HTTP_ACCEPT_ENCODING='gzip, zstd')
+        self.assertEqual(response['Content-Encoding'], 'zstd')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        body = b''.join(response.streaming_content)
+        self.assertEqual(len(body), data['stored_size'])
+        self.assertEqual(zstandard.ZstdDecompressor().decompressobj()
+                         .decompress(body), self.content)
+
+        response = self.client.get(data['download'], HTTP_RANGE='bytes=4-7')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(b''.join(response.streaming_content), b'0.5 ')
+
+    def test_incompressible_content(self):
+        """Content which does not compress well is stored as it is"""
+        data = self.upload(os.urandom(1000)).data
+        self.assertEqual(Blob.objects.get().encoding, '')
+        self.assertEqual(data['compression_ratio'], 1.0)
+        self.assertNotEqual(data['file'], data['download'])
+
+    def test_compressed_upload(self):
+        """Content compressed by the client is stored as it is"""
+        compressed = gzip.compress(self.content)
+        data = self.upload(compressed, content_encoding='gzip').data
+        blob = Blob.objects.get()
+        self.assertEqual(blob.encoding, 'gzip')
+        self.assertEqual(data['digest'],
+                         hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(data['size'], len(self.content))
+        with blob.file.open('rb') as f:
+            self.assertEqual(f.read(), compressed)
+
+        response = self.upload(b'not gzip', content_encoding='gzip')
+        self.assertEqual(response.status_code, 400)
+
+    def test_compressed_session(self):
+        """Compressed content may be sent in chunks"""
+        compressed = gzip.compress(self.content)
+        response = self.client.post('/upload-session/', {
+            'filename': 'params.pt', 'size': len(compressed),
+            'content_encoding': 'gzip'}, format='json')
+        session_id = response.data['id']
+        response = self.client.put(f'/upload-session/{session_id}/chunk/',
+                                   compressed,
+                                   content_type='application/octet-stream',
+                                   HTTP_UPLOAD_OFFSET='0',
+                                   HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(f'/upload-session/{session_id}/finalize/')
+        self.assertEqual(response.data['digest'],
+                         hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(Blob.objects.get().encoding, 'gzip')
+
+
+class DeltaTests(TemporaryStorageMixin, TestCase):
+
+    base_content = bytes(range(256)) * 400
+
+    def upload(self, content, base=None):
+        data = {'file': SimpleUploadedFile('params.pt', content)}
+        if base:
+            data['base'] = base
+        return self.client.post('/upload/', data, format='multipart').data
+
+    def updated(self, content, offset):
+        # Parameters of the next round, with a few bytes changed
+        return content[:offset] + b'changed' + content[offset + 7:]
+
+    def test_delta_upload(self):
+        """An upload naming a base is stored as a small delta and rebuilt
+        when downloaded"""
+        base = self.upload(self.base_content)
+        content = self.updated(self.base_content, 5000) + b'extra'
+        data = self.upload(content, base=base['id'])
+        self.assertEqual(data['delta_base'], base['digest'])
+        self.assertEqual(data['size'], len(content))
+        self.assertLess(data['stored_size'], 200)
+
+        response = self.client.get(data['download'])
+        self.assertNotIn('Delta-Base', response)
+        self.assertEqual(b''.join(response.streaming_content), content)
+        response = self.client.get(data['download'], HTTP_RANGE='bytes=4998-')
+        self.assertEqual(b''.join(response.streaming_content),
+                         content[4998:])
+
+    def test_download_delta(self):
+        """A client holding the base downloads the delta only"""
+        base = self.upload(self.base_content)
+        content = self.updated(self.base_content, 100)
+        data = self.upload(content, base=base['id'])
+
+        response = self.client.get(data['download'],
+                                   {'base': base['digest']})
+        self.assertEqual(response['Delta-Base'], base['digest'])
+        delta = b''.join(response.streaming_content)
+        self.assertEqual(len(delta), len(content))
+        self.assertEqual(bytes(a ^ b for a, b in
+                               zip(delta, self.base_content)), content)
+
+        response = self.client.get(data['download'], {'base': base['digest']},
+                                   HTTP_ACCEPT_ENCODING='zstd')
+        self.assertEqual(response['Content-Encoding'], 'zstd')
+        self.assertEqual(int(response['Content-Length']), data['stored_size'])
+
+    def test_chain(self):
+        """Deltas may be stored against deltas, and bases are kept until
+        their last delta is deleted"""
+        first = self.upload(self.base_content)
+        second_content = self.updated(self.base_content, 100)
+        second = self.upload(second_content, base=first['id'])
+        third_content = self.updated(second_content, 200)
+        third = self.upload(third_content, base=second['id'])
+        self.assertEqual(third['delta_base'], second['digest'])
+
+        self.client.delete(f'/upload/{first["id"]}/')
+        self.client.delete(f'/upload/{second["id"]}/')
+        self.assertEqual(Blob.objects.count(), 3)
+        response = self.client.get(third['download'])
+        self.assertEqual(b''.join(response.streaming_content), third_content)
+
+        self.client.delete(f'/upload/{third["id"]}/')
+        self.assertFalse(Blob.objects.exists())
+
+    def test_unrelated_base(self):
+        """Content which does not resemble the base is stored in full"""
+        base = self.upload(self.base_content)
+        data = self.upload(os.urandom(1000), base=base['id'])
+        self.assertIsNone(data['delta_base'])
+
+
+class ContentCacheTests(TemporaryStorageMixin, TestCase):
+
+    def load_counter(self, content, delay=0.1):
+        loads = []
+
+        def load():
+            loads.append(1)
+            time.sleep(delay)
+            return io.BytesIO(content)
+        return loads, load
+
+    def concurrent_reads(self, cache, content, readers=8):
+        loads, load = self.load_counter(content)
+        with ThreadPoolExecutor(max_workers=readers) as executor:
+            results = list(executor.map(
+                lambda _: cache.open('digest', len(content), load).read(),
+                range(readers)))
+        self.assertEqual(results, [content] * readers)
+        return len(loads)
+
+    def test_single_flight(self):
+        """Concurrent reads of content which is not cached load it once"""
+        disk = ContentCache(f'{self.storage_dir}/cache', disk_bytes=100,
+                            memory_bytes=0, memory_item_bytes=0)
+        self.assertEqual(self.concurrent_reads(disk, b'weights'), 1)
+        memory = ContentCache(f'{self.storage_dir}/cache', disk_bytes=0,
+                              memory_bytes=100, memory_item_bytes=100)
+        self.assertEqual(self.concurrent_reads(memory, b'weights'), 1)
+
+    def test_lru_eviction(self):
+        """The least recently used content is evicted when the cache is
+        full"""
+        cache = ContentCache(f'{self.storage_dir}/cache', disk_bytes=10,
+                             memory_bytes=10, memory_item_bytes=10)
+        for key in ('a', 'b', 'c'):
+            loads, load = self.load_counter(key.encode() * 4, delay=0)
+            cache.open(key, 4, load).close()
+            # Files are ordered by modification time
+            os.utime(f'{self.storage_dir}/cache/{key}',
+                     (time.time(), time.time() - 10 + ord(key)))
+        self.assertFalse(os.path.exists(f'{self.storage_dir}/cache/a'))
+        self.assertTrue(os.path.exists(f'{self.storage_dir}/cache/c'))
+        self.assertNotIn('a', cache.memory)
+        self.assertIn('c', cache.memory)
+
+    def test_uploaded_content_is_cached(self):
+        """Compressed uploads are cached when uploaded, so downloads of
+        their decompressed content are hits"""
+        content = b'0.5 ' * 10000
+        data = self.client.post('/upload/', {
+            'file': SimpleUploadedFile('params.pt', content)},
+            format='multipart').data
+        hits = REGISTRY.get_sample_value('restful_cache_hits_total',
+                                         {'tier': 'disk'}) or 0
+        response = self.client.get(data['download'])
+        self.assertEqual(b''.join(response.streaming_content), content)
+        self.assertEqual(REGISTRY.get_sample_value(
+            'restful_cache_hits_total', {'tier': 'disk'}), hits + 1)
+
+
+@override_settings(RETENTION_BATCH_SIZE=2, RETENTION_BATCH_PAUSE=0,
+                   RETENTION_MAX_AGE_DAYS=None, RETENTION_QUOTA_BYTES=None)
+class RetentionTests(TemporaryStorageMixin, TestCase):
+
+    def upload(self, content, age_days=0, pinned=False):
+        upload = Upload(pinned=pinned)
+        upload.store_file(ContentFile(content, name='params.pt'))
+        upload.save()
+        timestamp = timezone.now() - datetime.timedelta(days=age_days)
+        Upload.objects.filter(pk=upload.pk).update(
+            created_at=timestamp, last_accessed_at=timestamp)
+        return upload
+
+    def remaining(self):
+        return set(Upload.objects.values_list('pk', flat=True))
+
+    @override_settings(RETENTION_MAX_AGE_DAYS=7)
+    def test_max_age(self):
+        """Unpinned uploads older than the maximum age are deleted"""
+        old = [self.upload(b'old %d' % i, age_days=10) for i in range(3)]
+        pinned = self.upload(b'pinned', age_days=10, pinned=True)
+        recent = self.upload(b'recent', age_days=1)
+
+        self.assertEqual(collect_garbage()['expired'], 3)
+        self.assertEqual(self.remaining(), {pinned.pk, recent.pk})
+        self.assertFalse(Blob.objects.filter(
+            digest__in=[upload.blob_id for upload in old]).exists())
+
+    @override_settings(RETENTION_QUOTA_BYTES=10, CACHE_DISK_BYTES=0)
+    def test_quota_evicts_least_recently_accessed(self):
+        """Uploads are evicted by last access until the quota is met"""
+        first = self.upload(b'0123', age_days=3)
+        second = self.upload(b'4567', age_days=2, pinned=True)
+        third = self.upload(b'89ab', age_days=1)
+
+        # Downloading the first upload makes the third the least recent
+        self.client.get(f'/upload/{first.id}/download/')
+        self.assertEqual(collect_garbage()['evicted'], 1)
+        self.assertEqual(self.remaining(), {first.pk, second.pk})
+
+    @override_settings(RETENTION_QUOTA_BYTES=20, CACHE_DISK_BYTES=6)
+    def test_quota_counts_disk_usage(self):
+        """The disk cache and partial uploads count against the quota"""
+        first = self.upload(b'0123', age_days=3)
+        second = self.upload(b'4567', age_days=2)
+        third = self.upload(b'89ab', age_days=1)
+        self.assertEqual(collect_garbage()['evicted'], 0)
+
+        session = UploadSession.objects.create(filename='params.pt')
+        os.makedirs(os.path.dirname(session.partial_path))
+        with open(session.partial_path, 'wb') as partial:
+            partial.write(b'0123456')
+        self.assertEqual(collect_garbage()['evicted'], 2)
+        self.assertEqual(self.remaining(), {third.pk})
+
+    def test_pin(self):
+        """Pinning an upload through the API keeps its timestamp"""
+        upload = self.upload(b'weights', age_days=10)
+        response = self.client.patch(f'/upload/{upload.id}/',
+                                     {'pinned': True}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['pinned'])
+        with override_settings(RETENTION_MAX_AGE_DAYS=7):
+            self.assertEqual(collect_garbage()['expired'], 0)
+
+
+class MetricsTests(TemporaryStorageMixin, TestCase):
+
+    def test_scrape(self):
+        """Request, byte and query metrics are exposed to Prometheus"""
+        response = self.client.post('/upload/', {
+            'file': SimpleUploadedFile('params.pt', b'weights')},
+            format='multipart')
+        self.client.get(response.data['download'])
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        metrics = response.content.decode()
+        self.assertIn('restful_request_duration_seconds_bucket{'
+                      'le="0.005",method="POST",route="upload-list",'
+                      'status="201"}', metrics)
+        self.assertIn('restful_sent_bytes_total{route="upload-download"}',
+                      metrics)
+        self.assertIn('restful_received_bytes_total{route="upload-list"}',
+                      metrics)
+        self.assertIn('restful_requests_in_progress', metrics)
+        self.assertIn('restful_worker_busy_seconds_total', metrics)
+        self.assertIn('restful_db_query_duration_seconds_count{'
+                      'statement="INSERT"}', metrics)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token(self):
+        """With a token set, only scrapes carrying it can read metrics"""
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        response = self.client.get('/metrics',
+                                   HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 401)
+        response = self.client.get('/metrics',
+                                   HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+
+class HealthCheckTests(TestCase):
+
+    def test_healthz(self):
+        """The readiness check answers without touching the database"""
+        with self.assertNumQueries(0):
+            response = self.client.get('/healthz')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'status': 'ok'})
+
+
+class MigrateLockedTests(TestCase):
+
+    def test_migrate_locked(self):
+        """The database is left fully migrated"""
+        out = io.StringIO()
+        call_command('migrate_locked', stdout=out)
+        self.assertIn('No migrations to apply', out.getvalue())
+
+
+class StaticFilesTests(TestCase):
+
+    def test_immutable_static_files(self):
+        """Collected static files have hashed names, and are served
+        precompressed with headers allowing browsers to cache them
+        forever"""
+        static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_root, ignore_errors=True)
+        with override_settings(STATIC_ROOT=static_root):
+            call_command('collectstatic', interactive=False, verbosity=0,
+                         ignore_patterns=['admin', 'docs'])
+            url = static('rest_framework/css/bootstrap.min.css')
+            self.assertRegex(url, r'bootstrap\.min\.[0-9a-f]{12}\.css$')
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, br')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Encoding'], 'br')
+            self.assertIn('immutable', response['Cache-Control'])
+
+
+class SingleThreadedLiveServerThread(LiveServerThread):
+    # The live server threads share the connection to the in-memory test
+    # database, which cannot be used by concurrent requests
+
+    def _create_server(self):
+        return WSGIServer((self.host, self.port), QuietWSGIRequestHandler,
+                          allow_reuse_address=False)
+
+
+class BenchmarkTests(TemporaryStorageMixin, LiveServerTestCase):
+    server_thread_class = SingleThreadedLiveServerThread
+
+    def test_rounds(self):
+        """The benchmark reports each phase of the simulated rounds"""
+        results = run_rounds(f'{self.live_server_url}/', nodes=2, rounds=2,
+                             size=1000)
+        self.assertEqual(Upload.objects.count(), 6)
+        downloads = results['phases']['node_download']
+        self.assertEqual(downloads['requests'], 4)
+        self.assertEqual(downloads['errors'], 0)
+        self.assertLessEqual(downloads['latency_s']['p50'],
+                             downloads['latency_s']['p99'])
+
+
+class StreamingASGIHandlerTests(TemporaryStorageMixin, TransactionTestCase):
+    # Views run in other threads, so test data must be committed
+
+    def request(self, method, path, body=b'', headers=()):
+        """Send a request to the ASGI handler, returning the status and the
+        response body messages"""
+        async def communicate():
+            communicator = ApplicationCommunicator(StreamingASGIHandler(), {
+                'type': 'http', 'method': method, 'path': path,
+                'query_string': b'', 'headers': list(headers)})
+            await communicator.send_input({'type': 'http.request',
+                                           'body': body})
+            start = await communicator.receive_output(timeout=5)
+            messages = [await communicator.receive_output(timeout=5)]
+            while messages[-1].get('more_body'):
+                messages.append(await communicator.receive_output(timeout=5))
+            return start['status'], messages
+        return asyncio.run(communicate())
+
+    def test_download_is_streamed(self):
+        """Downloads are sent in several blocks as they are read"""
+        content = os.urandom(StreamingASGIHandler.chunk_size * 2 + 10)
+        upload = Upload()
+        upload.store_file(ContentFile(content, name='params.pt'))
+        upload.save()
+
+        status, messages = self.request('GET', f'/upload/{upload.id}/download/')
+        self.assertEqual(status, 200)
+        self.assertGreater(len(messages), 3)
+        self.assertEqual(b''.join(m.get('body', b'') for m in messages),
+                         content)
+
+    def test_chunk_upload(self):
+        """Request bodies are passed to the upload views"""
+        session = UploadSession.objects.create(filename='params.pt', size=6)
+        status, _ = self.request(
+            'PUT', f'/upload-session/{session.id}/chunk/', body=b'abcdef',
+            headers=[(b'upload-offset', b'0'), (b'content-length', b'6'),
+                     (b'content-type', b'application/octet-stream')])
+        self.assertEqual(status, 200)
+        session.refresh_from_db()
+        self.assertEqual(session.offset, 6)
+
+
+@override_settings(
+    STORAGE_BACKEND='s3',
+    DEFAULT_FILE_STORAGE='storages.backends.s3boto3.S3Boto3Storage',
+    AWS_STORAGE_BUCKET_NAME='passian-uploads',
+    AWS_S3_REGION_NAME='eu-west-2',
+    AWS_S3_SIGNATURE_VERSION='s3v4',
+    AWS_DEFAULT_ACL=None,
+    AWS_QUERYSTRING_EXPIRE=3600,
+    CACHE_DISK_BYTES=0)
+class S3StorageTests(TestCase):
+    """Direct transfers to and from an S3 bucket, using moto in place of S3"""
+
+    def setUp(self):
+        super().setUp()
+        mock = mock_aws()
+        mock.start()
+        self.addCleanup(mock.stop)
+        self.s3 = boto3.client('s3', region_name='eu-west-2')
+        self.s3.create_bucket(
+            Bucket='passian-uploads',
+            CreateBucketConfiguration={'LocationConstraint': 'eu-west-2'})
+        self.client = APIClient()
+        self.content = b'weights'
+        self.digest = hashlib.sha256(self.content).hexdigest()
+
+    def create_session(self):
+        response = self.client.post('/upload-session/', {
+            'filename': 'params.pt', 'size': len(self.content),
+            'digest': self.digest}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data
+
+    def test_direct_upload(self):
+        """Content is sent to a presigned URL and only finalized here"""
+        session = self.create_session()
+        self.assertIn('X-Amz-Signature', session['upload_url'])
+        response = self.client.post(
+            f'/upload-session/{session["id"]}/finalize/')
+        self.assertEqual(response.status_code, 400)
+
+        # The client sends the content straight to the bucket, with the
+        # checksum of the content
+        self.assertEqual(session['upload_headers'], {
+            'x-amz-checksum-sha256':
+                base64.b64encode(bytes.fromhex(self.digest)).decode()})
+        self.s3.put_object(Bucket='passian-uploads',
+                           Key=f'blobs/{self.digest[:2]}/{self.digest}',
+                           Body=self.content)
+        response = self.client.post(
+            f'/upload-session/{session["id"]}/finalize/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['digest'], self.digest)
+
+        # Content which is already stored does not need to be sent again
+        session = self.create_session()
+        self.assertIsNone(session['upload_url'])
+        response = self.client.post(
+            f'/upload-session/{session["id"]}/finalize/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+
+    def test_direct_upload_digest(self):
+        """Content which does not match the digest of the session is not
+        stored"""
+        session = self.create_session()
+        self.s3.put_object(Bucket='passian-uploads',
+                           Key=f'blobs/{self.digest[:2]}/{self.digest}',
+                           Body=b'forgery')
+        response = self.client.post(
+            f'/upload-session/{session["id"]}/finalize/')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Blob.objects.exists())
+
+    def test_concurrent_store(self):
+        """A request which loses the race to store the same content does not
+        delete the content stored by the winner"""
+        blob = Blob.objects.store(ContentFile(self.content, name='a.pt'))
+        # The second request finds no blob, then fails to insert its own
+        with mock.patch.object(Blob.objects, '_add_reference',
+                               side_effect=[False, True]):
+            stored = Blob.objects.store(ContentFile(self.content,
+                                                    name='b.pt'))
+        self.assertEqual(stored, blob)
+        keys = [item['Key'] for item in self.s3.list_objects_v2(
+            Bucket='passian-uploads')['Contents']]
+        self.assertEqual(keys, [blob.file.name])
+        with stored.open_content() as content:
+            self.assertEqual(content.read(), self.content)
+
+    def test_download_redirect(self):
+        """Downloads are redirected to a presigned URL"""
+        upload = Upload()
+        upload.store_file(ContentFile(self.content, name='params.pt'))
+        upload.save()
+
+        response = self.client.get(f'/upload/{upload.id}/download/')
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('X-Amz-Signature', response['Location'])
+
+        response = self.client.get(f'/upload/{upload.id}/download/',
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
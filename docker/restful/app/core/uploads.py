@@ -0,0 +1,106 @@
+"""Helpers for receiving upload bodies without holding them in memory"""
+
+from contextlib import contextmanager
+from django.core.files.uploadhandler import MemoryFileUploadHandler, \
+    TemporaryFileUploadHandler
+
+import fcntl
+import hashlib
+import os
+
+
+class IncompleteChunk(Exception):
+    """The client sent fewer bytes than it announced"""
+
+
+class PartialFileMissing(Exception):
+    """The partial upload file does not exist, e.g. because the session was
+    finalized and the file removed"""
+
+
+def copy_stream(source, destination, length, chunk_size):
+    """Copy exactly `length` bytes from `source` to `destination`, reading at
+    most `chunk_size` bytes at a time. Returns the number of bytes copied.
+
+    Raises:
+        IncompleteChunk: the source stream ended before `length` bytes
+    """
+    copied = 0
+    while copied < length:
+        chunk = source.read(min(chunk_size, length - copied))
+        if not chunk:
+            raise IncompleteChunk(
+                f"Expected {length} bytes but only received {copied}")
+        destination.write(chunk)
+        copied += len(chunk)
+    return copied
+
+
+@contextmanager
+def locked_partial_file(path, create=True):
+    """Open a partial upload file for writing, holding an exclusive lock so
+    that concurrent requests for the same session cannot interleave writes.
+    The file is created if it does not exist, unless `create` is False.
+
+    Raises:
+        BlockingIOError: another request is already writing to this file
+        PartialFileMissing: the file does not exist and `create` is False
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        fd = os.open(path, os.O_RDWR | (os.O_CREAT if create else 0), 0o640)
+    except FileNotFoundError:
+        raise PartialFileMissing(path)
+    with os.fdopen(fd, 'r+b') as partial:
+        fcntl.flock(partial, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        try:
+            yield partial
+        finally:
+            fcntl.flock(partial, fcntl.LOCK_UN)
+
+
+def remove_partial_file(path):
+    """Remove a partial upload file if it exists"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class HashingUploadHandlerMixin:
+    """Compute the SHA-256 digest of an uploaded file while it is being
+    received, and store it in the `sha256` attribute of the uploaded file.
+    This avoids reading the file again to find out whether its content is
+    already stored"""
+
+    def new_file(self, *args, **kwargs):
+        # Set before calling the parent, which may raise StopFutureHandlers
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.sha256.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadHandlerMixin,
+                                     MemoryFileUploadHandler):
+    """Keep small uploads in memory, computing their digest"""
+
+    def receive_data_chunk(self, raw_data, start):
+        # Only hash the data if this handler keeps it, otherwise it is passed
+        # on to the next handler which hashes it
+        if self.activated:
+            self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadHandlerMixin,
+                                        TemporaryFileUploadHandler):
+    """Stream large uploads to a temporary file, computing their digest"""
+
+    def receive_data_chunk(self, raw_data, start):
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
@@ -1,8 +1,14 @@
+from django.urls import path
 from rest_framework import routers
 
-from.views import UploadViewSet
+from .metrics import metrics_view
+from .views import healthz_view, UploadViewSet, UploadSessionViewSet
 
 router = routers.DefaultRouter()
 router.register(r'upload', UploadViewSet)
+router.register(r'upload-session', UploadSessionViewSet)
 
-urlpatterns = router.urls
+urlpatterns = router.urls + [
+    path('metrics', metrics_view, name='metrics'),
+    path('healthz', healthz_view, name='healthz'),
+]
@@ -1,9 +1,351 @@
-from rest_framework.viewsets import ModelViewSet
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.files import File
+from django.db import transaction
+from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.dateparse import parse_datetime
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, ValidationError, \
+    UnsupportedMediaType
+from rest_framework.filters import OrderingFilter
+from rest_framework.mixins import CreateModelMixin, RetrieveModelMixin, \
+    DestroyModelMixin
+from rest_framework.response import Response
+from rest_framework.viewsets import ModelViewSet, GenericViewSet
 
-from .models import Upload
-from .serializers import UploadSerializer
+from .compression import accepts_encoding, hash_decoded, DecodedFile
+from .downloads import serve_file, redirect_to_storage
+from .models import Upload, UploadSession, hash_file
+from .pagination import UploadCursorPagination
+from .retention import record_access
+from .serializers import UploadSerializer, UploadSessionSerializer, \
+    UploadBatchSerializer
+from .storage import supports_presigned_urls, presigned_download_url
+from .uploads import copy_stream, locked_partial_file, remove_partial_file, \
+    IncompleteChunk, PartialFileMissing
+
+
+class Conflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'The request conflicts with the current upload state.'
+    default_code = 'conflict'
+
+
+class Gone(APIException):
+    status_code = status.HTTP_410_GONE
+    default_detail = 'The content of this upload session is no longer ' \
+                     'available.'
+    default_code = 'gone'
+
+
+def healthz_view(request):
+    """Readiness check of the load balancer. The service is ready as soon as
+    it serves requests, so this does not query the database or storage, and
+    stays cheap when checked every few seconds"""
+    return JsonResponse({'status': 'ok'})
 
 
 class UploadViewSet(ModelViewSet):
+    """Uploaded files
+
+    The list is paginated with a cursor, most recent first. It accepts the
+    query parameters:
+    - created_after: only uploads created after this ISO 8601 timestamp
+    - after: only uploads created after the upload with this id
+    - ordering: created_at to list the oldest first
+    - page_size: number of uploads per page
+    """
     serializer_class = UploadSerializer
-    queryset = Upload.objects.all().order_by('-created_at')
+    queryset = Upload.objects.select_related('blob').order_by('-created_at')
+    pagination_class = UploadCursorPagination
+    filter_backends = [OrderingFilter]
+    ordering_fields = ['created_at']
+    ordering = ['-created_at']
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action != 'list':
+            return queryset
+
+        created_after = self.request.query_params.get('created_after')
+        if created_after:
+            timestamp = parse_datetime(created_after)
+            if timestamp is None:
+                raise ValidationError(f'Invalid created_after timestamp '
+                                      f'{created_after!r}.')
+            if timezone.is_naive(timestamp):
+                timestamp = timezone.make_aware(timestamp, timezone.utc)
+            queryset = queryset.filter(created_at__gt=timestamp)
+
+        after = self.request.query_params.get('after')
+        if after:
+            try:
+                upload = Upload.objects.only('created_at').get(pk=after)
+            except (Upload.DoesNotExist, DjangoValidationError):
+                raise ValidationError(f'Unknown upload {after!r}.')
+            queryset = queryset.filter(created_at__gt=upload.created_at)
+        return queryset
+
+    @action(detail=False, methods=['post'],
+            serializer_class=UploadBatchSerializer)
+    def batch(self, request):
+        """Upload many files in one multipart request, each sent as a `file`
+        part. All the uploads are created together, or none if any file is
+        invalid, and are returned in the order of the files"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        uploads = serializer.save()
+        data = UploadSerializer(uploads, many=True,
+                                context=self.get_serializer_context()).data
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """Stream the uploaded file, supporting conditional and range
+        requests so that clients can skip or resume downloads. When files
+        are stored in S3 the client is redirected to a presigned URL.
+
+        Files stored compressed are sent as they are to clients which accept
+        their content coding, and decompressed for other clients.
+
+        Files stored as a delta are rebuilt from the delta and its base,
+        unless the `base` query parameter gives the digest of the base, which
+        the client already holds. The delta is then sent instead, with the
+        digest of the base in the Delta-Base header"""
+        upload = self.get_object()
+        record_access(upload)
+        blob = upload.blob
+        encoding = blob.encoding if blob else ''
+        etag = upload.etag
+        if blob and blob.base_id:
+            if request.query_params.get('base') != blob.base_id:
+                return serve_file(
+                    request,
+                    file=blob.open_content(),
+                    size=upload.size,
+                    etag=etag,
+                    last_modified=int(upload.updated_at.timestamp()),
+                    filename=upload.download_filename)
+            etag = blob.delta_etag
+        if not encoding:
+            return self._send(request, upload, etag=etag)
+
+        if accepts_encoding(request.META.get('HTTP_ACCEPT_ENCODING'),
+                            encoding):
+            response = self._send(request, upload,
+                                  etag=blob.encoded_etag,
+                                  content_encoding=encoding)
+        else:
+            # The decompressed delta is not cached, unlike full content
+            response = serve_file(
+                request,
+                file=DecodedFile(blob.open_stored(), encoding)
+                if blob.base_id else blob.open_content(),
+                size=upload.size,
+                etag=etag,
+                last_modified=int(upload.updated_at.timestamp()),
+                filename=upload.download_filename)
+        patch_vary_headers(response, ['Accept-Encoding'])
+        if blob.base_id:
+            response['Delta-Base'] = blob.base_id
+        return response
+
+    @staticmethod
+    def _send(request, upload, etag, content_encoding=''):
+        """Send the stored file as it is"""
+        last_modified = int(upload.updated_at.timestamp())
+        if supports_presigned_urls():
+            return redirect_to_storage(
+                request,
+                url=presigned_download_url(upload.file.name,
+                                           upload.download_filename,
+                                           content_encoding=content_encoding),
+                etag=etag,
+                last_modified=last_modified)
+        return serve_file(request,
+                          file=upload.file.storage.open(upload.file.name, 'rb'),
+                          size=upload.stored_size,
+                          etag=etag,
+                          last_modified=last_modified,
+                          filename=upload.download_filename,
+                          content_encoding=content_encoding)
+
+
+class UploadSessionViewSet(CreateModelMixin,
+                           RetrieveModelMixin,
+                           DestroyModelMixin,
+                           GenericViewSet):
+    """Resumable chunked uploads
+
+    - POST upload-session/ with a filename (and optionally the total size)
+      creates a session. If the client compresses the content, the session
+      is created with its content_encoding
+    - PUT upload-session/<id>/chunk/ sends the next chunk as the raw request
+      body. The Upload-Offset header must match the session offset, so a
+      client that lost its connection queries the session and resumes from
+      the returned offset
+    - GET upload-session/<id>/ returns the current offset
+    - POST upload-session/<id>/finalize/ creates the Upload
+    """
+    serializer_class = UploadSessionSerializer
+    queryset = UploadSession.objects.all().order_by('-created_at')
+
+    @action(detail=True, methods=['put', 'patch'])
+    def chunk(self, request, pk=None):
+        session = self.get_object()
+        if session.upload_id:
+            raise Conflict('This upload session has already been finalized.')
+        if session.is_direct:
+            raise Conflict('The content of a direct upload must be sent to '
+                           'its upload_url.')
+
+        content_encoding = request.META.get('HTTP_CONTENT_ENCODING')
+        if content_encoding and content_encoding != session.content_encoding:
+            raise UnsupportedMediaType(
+                content_encoding,
+                detail=f'Chunks must be sent with the content_encoding of '
+                       f'the session ({session.content_encoding or "none"}).')
+
+        offset = self._get_int(request, 'HTTP_UPLOAD_OFFSET', 'offset')
+        length = self._get_int(request, 'CONTENT_LENGTH')
+        if offset is None:
+            raise ValidationError('The Upload-Offset header is required.')
+        if length is None:
+            raise ValidationError('The Content-Length header is required.')
+
+        try:
+            with locked_partial_file(session.partial_path) as partial:
+                # Re-read the offset now that we hold the lock
+                session.refresh_from_db()
+                if offset != session.offset:
+                    raise Conflict(f'Expected Upload-Offset {session.offset}.')
+                if session.size is not None and offset + length > session.size:
+                    raise ValidationError('Chunk extends beyond the declared '
+                                          'size of the upload.')
+
+                # Discard any bytes left over from an interrupted chunk
+                partial.truncate(offset)
+                partial.seek(offset)
+                if length:
+                    try:
+                        copy_stream(source=request.stream,
+                                    destination=partial,
+                                    length=length,
+                                    chunk_size=settings.UPLOAD_CHUNK_SIZE)
+                    except IncompleteChunk as e:
+                        partial.truncate(offset)
+                        raise ValidationError(str(e))
+                partial.flush()
+
+                session.offset = offset + length
+                session.save(update_fields=['offset', 'updated_at'])
+        except BlockingIOError:
+            raise Conflict('Another chunk is already being written to this '
+                           'upload session.')
+
+        serializer = self.get_serializer(session)
+        return Response(serializer.data,
+                        headers={'Upload-Offset': str(session.offset)})
+
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        """Create the upload of the session, or return it if the session has
+        already been finalized"""
+        session = self.get_object()
+        if not session.upload_id:
+            if session.is_direct:
+                self._finalize_direct(session)
+            else:
+                self._finalize_chunks(session)
+
+        serializer = UploadSerializer(session.upload,
+                                      context=self.get_serializer_context())
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @staticmethod
+    def _finalize_direct(session):
+        with transaction.atomic():
+            # Concurrent requests finalize the session once
+            session.upload_id = UploadSession.objects.select_for_update() \
+                .values_list('upload_id', flat=True).get(pk=session.pk)
+            if session.upload_id:
+                return
+            upload = Upload()
+            try:
+                upload.store_existing(session.digest, session.size,
+                                      name=session.filename)
+            except (FileNotFoundError, ValueError) as e:
+                raise ValidationError(str(e))
+            upload.save()
+            session.upload = upload
+            session.save(update_fields=['upload', 'updated_at'])
+
+    @staticmethod
+    def _finalize_chunks(session):
+        # The partial file of a session which has received content is only
+        # missing once the session has been finalized. It must not be
+        # created again, which would finalize the session with no content
+        try:
+            with locked_partial_file(session.partial_path,
+                                     create=not session.offset) as partial:
+                # Another request may have finalized the session while this
+                # request waited
+                session.refresh_from_db()
+                if session.upload_id:
+                    return
+                if not session.is_complete:
+                    raise ValidationError(f'Only {session.offset} of '
+                                          f'{session.size} bytes received.')
+                # The digest cannot be carried across the requests which
+                # sent the chunks, so the file is read once to compute it
+                size = None
+                if session.content_encoding:
+                    try:
+                        digest, size = hash_decoded(File(partial),
+                                                    session.content_encoding)
+                    except ValueError as e:
+                        raise ValidationError(str(e))
+                else:
+                    digest = hash_file(File(partial))
+                if session.digest and digest != session.digest:
+                    raise ValidationError('The content received does not '
+                                          'match the digest of the session.')
+                upload = Upload()
+                upload.store_file(File(partial), name=session.filename,
+                                  digest=digest,
+                                  encoding=session.content_encoding,
+                                  size=size)
+                upload.save()
+                session.upload = upload
+                session.save(update_fields=['upload', 'updated_at'])
+                remove_partial_file(session.partial_path)
+        except PartialFileMissing:
+            session.refresh_from_db()
+            if not session.upload_id:
+                # The upload was deleted after the session was finalized
+                raise Gone()
+        except BlockingIOError:
+            raise Conflict('A chunk is still being written to this '
+                           'upload session.')
+
+    def perform_destroy(self, instance):
+        remove_partial_file(instance.partial_path)
+        instance.delete()
+
+    @staticmethod
+    def _get_int(request, meta_key, query_key=None):
+        value = request.META.get(meta_key)
+        if value in (None, '') and query_key:
+            value = request.query_params.get(query_key)
+        if value in (None, ''):
+            return None
+        try:
+            value = int(value)
+        except ValueError:
+            raise ValidationError(f'Invalid integer value {value!r}.')
+        if value < 0:
+            raise ValidationError(f'Invalid negative value {value}.')
+        return value
@@ -9,8 +9,12 @@ https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+
+from core.asgi import StreamingASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fedbiomed.settings')
 
-application = get_asgi_application()
+# As get_asgi_application(), using a handler which streams file downloads
+django.setup(set_prefix=False)
+application = StreamingASGIHandler()
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/3.1/ref/settings/
 import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -48,12 +50,14 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
-    'django_cleanup',
-    'core'
+    'django_cleanup.apps.CleanupConfig',
+    'core.apps.CoreConfig'
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -86,12 +90,53 @@ WSGI_APPLICATION = 'fedbiomed.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DATABASE_ENGINE selects 'postgres' for production, or 'sqlite' which is
+# only intended as a fallback for development. Connections are kept open for
+# DATABASE_CONN_MAX_AGE seconds and reused across requests; persistent
+# connections are checked before each request (see core.db)
+
+DATABASE_ENGINE = os.getenv('DATABASE_ENGINE', 'sqlite')
+# Under ASGI (SERVER_MODE, set by the entrypoint for uvicorn workers) each
+# request runs in its own thread, and under gevent workers in its own
+# greenlet. Django keeps a connection for each of them, so connections
+# cannot be reused by later requests: kept open, they would pile up until
+# they are garbage collected and could exhaust the connections allowed by
+# the database. They are closed after each request by default
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi')
+_PER_REQUEST_CONNECTIONS = SERVER_MODE == 'asgi' or \
+    os.getenv('GUNICORN_WORKER_CLASS') == 'gevent'
+DATABASE_CONN_MAX_AGE = int(os.getenv(
+    'DATABASE_CONN_MAX_AGE', '0' if _PER_REQUEST_CONNECTIONS else '60'))
+
+if DATABASE_ENGINE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('DATABASE_NAME', 'fedbiomed'),
+            'USER': os.getenv('DATABASE_USER'),
+            'PASSWORD': os.getenv('DATABASE_PASSWORD'),
+            'HOST': os.getenv('DATABASE_HOST'),
+            'PORT': os.getenv('DATABASE_PORT', '5432'),
+            'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+            'OPTIONS': {
+                'connect_timeout': 10,
+            },
+        }
+    }
+elif DATABASE_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+            'OPTIONS': {
+                # Wait for concurrent writers instead of failing immediately
+                'timeout': 20,
+            },
+        }
     }
-}
+else:
+    raise ImproperlyConfigured(f'Unknown DATABASE_ENGINE {DATABASE_ENGINE}')
 
 
 # Password validation
@@ -134,5 +179,106 @@ USE_TZ = True
 STATIC_ROOT = os.path.join(BASE_DIR, 'data/static/')
 STATIC_URL = FORCE_SCRIPT_NAME + '/static/'
 
-MEDIA_ROOT = os.path.join(BASE_DIR, 'data/media/')
+# Static files are collected with hashed names and precompressed when the
+# image is built (see core.staticfiles), and served by WhiteNoise with
+# immutable cache headers. They never change while the service runs
+STATICFILES_STORAGE = 'core.staticfiles.ImmutableStaticFilesStorage'
+WHITENOISE_AUTOREFRESH = False
+
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', os.path.join(BASE_DIR, 'data/media/'))
 MEDIA_URL = FORCE_SCRIPT_NAME + '/media/'
+
+# Storage of uploaded files: 'filesystem' stores them in MEDIA_ROOT, 's3'
+# stores them in an S3 bucket (or an S3-compatible server such as minio, by
+# setting STORAGE_ENDPOINT_URL). With S3, clients are given presigned URLs to
+# transfer file contents directly to and from the bucket
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'filesystem')
+
+if STORAGE_BACKEND == 's3':
+    DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+    AWS_STORAGE_BUCKET_NAME = os.getenv('STORAGE_BUCKET_NAME')
+    AWS_S3_REGION_NAME = os.getenv('STORAGE_REGION') or None
+    AWS_S3_ENDPOINT_URL = os.getenv('STORAGE_ENDPOINT_URL') or None
+    AWS_S3_ADDRESSING_STYLE = 'path' if AWS_S3_ENDPOINT_URL else 'virtual'
+    AWS_S3_SIGNATURE_VERSION = 's3v4'
+    AWS_DEFAULT_ACL = None
+    AWS_QUERYSTRING_EXPIRE = int(os.getenv('STORAGE_URL_EXPIRY', '3600'))
+elif STORAGE_BACKEND != 'filesystem':
+    raise ImproperlyConfigured(f'Unknown STORAGE_BACKEND {STORAGE_BACKEND}')
+
+# Bearer token required to read /metrics. The metrics are readable by any
+# client of the service if this is not set
+METRICS_TOKEN = os.getenv('METRICS_TOKEN') or None
+
+# Content coding used to compress stored files: 'zstd' (or 'gzip' if the
+# zstandard package is not installed), 'gzip', or 'none' to store files
+# uncompressed. Files which do not compress well are stored uncompressed.
+# STORAGE_COMPRESSION_LEVEL overrides the default level of the coding.
+# With S3, files are stored uncompressed by default: clients cannot compress
+# what they send to a presigned URL, and compressed files are only sent from
+# a presigned URL to clients accepting their content coding, so compression
+# would make the service proxy uploads and most downloads
+STORAGE_COMPRESSION = os.getenv(
+    'STORAGE_COMPRESSION', 'none' if STORAGE_BACKEND == 's3' else 'zstd')
+if STORAGE_COMPRESSION == 'none':
+    STORAGE_COMPRESSION = ''
+elif STORAGE_COMPRESSION not in ('zstd', 'gzip'):
+    raise ImproperlyConfigured(
+        f'Unknown STORAGE_COMPRESSION {STORAGE_COMPRESSION}')
+STORAGE_COMPRESSION_LEVEL = int(os.getenv('STORAGE_COMPRESSION_LEVEL') or 0) \
+    or None
+
+# Upload handlers compute the digest of each file while it is received, which
+# is used to store identical files only once
+FILE_UPLOAD_HANDLERS = [
+    'core.uploads.HashingMemoryFileUploadHandler',
+    'core.uploads.HashingTemporaryFileUploadHandler',
+]
+
+# Read-through cache of content which must be decompressed, rebuilt from a
+# delta or fetched from S3 (see core.cache). Content is kept in the memory of
+# each worker, up to CACHE_MEMORY_BYTES in total and CACHE_MEMORY_ITEM_BYTES
+# per file, and in CACHE_DIR, shared by the workers, up to CACHE_DISK_BYTES.
+# Setting a size to 0 disables that tier
+CACHE_DIR = os.getenv('CACHE_DIR', os.path.join(BASE_DIR, 'data/cache/'))
+CACHE_DISK_BYTES = int(os.getenv('CACHE_DISK_BYTES', 4 * 1024 ** 3))
+CACHE_MEMORY_BYTES = int(os.getenv('CACHE_MEMORY_BYTES', 256 * 1024 ** 2))
+CACHE_MEMORY_ITEM_BYTES = int(os.getenv('CACHE_MEMORY_ITEM_BYTES',
+                                        32 * 1024 ** 2))
+
+# Maximum number of deltas in a chain of uploads stored as deltas against
+# the previous one. Downloading the full content of the last upload reads the
+# files of every upload in the chain, so longer chains are stored in full
+DELTA_MAX_DEPTH = int(os.getenv('DELTA_MAX_DEPTH') or 8)
+
+# Maximum number of files in one batch upload request
+UPLOAD_BATCH_MAX_FILES = int(os.getenv('UPLOAD_BATCH_MAX_FILES') or 1000)
+
+# Partially received files from resumable upload sessions. These are kept
+# outside MEDIA_ROOT so that they are never served before being finalized
+UPLOAD_SESSION_ROOT = os.getenv('UPLOAD_SESSION_ROOT',
+                                os.path.join(BASE_DIR, 'data/sessions/'))
+
+# Number of bytes read from the request body at a time when receiving chunks
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Retention of uploaded files, applied by the collect_garbage command. Uploads
+# which are pinned are always kept. Otherwise uploads are deleted once they
+# are older than RETENTION_MAX_AGE_DAYS, and the least recently downloaded
+# uploads are deleted while the stored content exceeds RETENTION_QUOTA_BYTES.
+# Either rule is disabled if its variable is not set
+RETENTION_MAX_AGE_DAYS = float(os.getenv('RETENTION_MAX_AGE_DAYS') or 0) or None
+RETENTION_QUOTA_BYTES = int(os.getenv('RETENTION_QUOTA_BYTES') or 0) or None
+
+# Upload sessions which have not received a chunk for this many hours are
+# deleted with their partial files
+RETENTION_SESSION_MAX_AGE_HOURS = float(
+    os.getenv('RETENTION_SESSION_MAX_AGE_HOURS', '24'))
+
+# Uploads are deleted in batches of RETENTION_BATCH_SIZE, pausing for
+# RETENTION_BATCH_PAUSE seconds between batches so that requests are not
+# blocked for long. With --loop, garbage is collected every
+# RETENTION_INTERVAL seconds
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', '100'))
+RETENTION_BATCH_PAUSE = float(os.getenv('RETENTION_BATCH_PAUSE', '0.5'))
+RETENTION_INTERVAL = int(os.getenv('RETENTION_INTERVAL', '600'))
@@ -29,11 +29,10 @@ from django.views.static import serve
 from django.conf.urls import url
 
 
-# Serve files in production
+# Serve files in production. Static files are served by WhiteNoiseMiddleware
 if not settings.DEBUG:
     urlpatterns += [
         url(r'^media/(?P<path>.*)$', serve, {'document_root': settings.MEDIA_ROOT}),
-        url(r'^static/(?P<path>.*)$', serve, {'document_root': settings.STATIC_ROOT}),
     ]
 else:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -0,0 +1,54 @@
+"""gunicorn settings, read from the working directory when gunicorn starts
+
+The settings are taken from GUNICORN_* environment variables, which the AWS
+deployment derives from the cpu and memory of the restful task:
+- GUNICORN_WORKER_CLASS: sync, gthread, gevent or uvicorn. uvicorn workers
+  serve the ASGI application (see entrypoint.bash), the others the WSGI
+  application
+- GUNICORN_WORKERS: number of worker processes
+- GUNICORN_THREADS: number of threads of each gthread worker
+- GUNICORN_TIMEOUT: seconds after which a silent worker is restarted
+- GUNICORN_GRACEFUL_TIMEOUT: seconds given to workers to finish their
+  requests when restarting
+- GUNICORN_KEEPALIVE: seconds for which idle connections are kept open
+- GUNICORN_LOG_LEVEL: debug, info, warning, error or critical
+- GUNICORN_BIND: address on which to listen
+"""
+
+import multiprocessing
+import os
+
+WORKER_CLASSES = {
+    'sync': 'sync',
+    'gthread': 'gthread',
+    'gevent': 'gevent',
+    'uvicorn': 'uvicorn.workers.UvicornWorker',
+}
+
+_worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+if _worker_class not in WORKER_CLASSES:
+    raise ValueError(f'Unknown GUNICORN_WORKER_CLASS {_worker_class}')
+_cpus = multiprocessing.cpu_count()
+
+worker_class = WORKER_CLASSES[_worker_class]
+# Synchronous workers each serve one request at a time, so more are needed
+workers = int(os.getenv('GUNICORN_WORKERS') or
+              (2 * _cpus + 1 if _worker_class == 'sync' else max(2, _cpus)))
+threads = int(os.getenv('GUNICORN_THREADS') or
+              (8 if _worker_class == 'gthread' else 1))
+# Large files may take minutes to transfer over the VPN
+timeout = int(os.getenv('GUNICORN_TIMEOUT') or 300)
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT') or 30)
+# Longer than the idle timeout of the load balancer, so that the load
+# balancer closes idle connections before gunicorn does
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE') or 65)
+loglevel = os.getenv('GUNICORN_LOG_LEVEL') or 'info'
+bind = os.getenv('GUNICORN_BIND') or '0.0.0.0:8000'
+
+
+def child_exit(server, worker):
+    """Remove the live metrics (e.g. requests in progress) of a worker which
+    has exited"""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -4,13 +4,40 @@
 
 echo "UCL PASSIAN Fed-BioMed restful container"
 
-# Remove the database
-rm -rf /app/db.sqlite3
+# Static files were collected when the image was built. In a pre-baked image
+# the SQLite database was migrated too, so the container starts serving at
+# once. Otherwise the database is kept across restarts and migrations are
+# applied to it, by one task at a time when several share a database
+if [ "${PREBAKED}" == "1" ] && [ "${DATABASE_ENGINE:-sqlite}" == "sqlite" ] \
+    && [ -z "${SQLITE_PATH}" ]; then
+  echo "Using the database migrated when the image was built"
+else
+  python manage.py migrate_locked
+fi
 
-python manage.py migrate
-python manage.py collectstatic --link --noinput
-python manage.py createsuperuser --noinput
+# The superuser is given by DJANGO_SUPERUSER_* when the container starts.
+# Creating it fails harmlessly if it already exists
+python manage.py createsuperuser --noinput || true
 
-echo "Running gunicorn..."
-gunicorn -w 4 -b 0.0.0.0:8000 --log-level debug fedbiomed.wsgi
+# Metrics are shared between the gunicorn workers through this directory,
+# which must be emptied before the workers start
+export PROMETHEUS_MULTIPROC_DIR=/tmp/prometheus
+rm -rf "${PROMETHEUS_MULTIPROC_DIR}"
+mkdir -p "${PROMETHEUS_MULTIPROC_DIR}"
+
+# Delete uploads according to the retention settings in the background
+python manage.py collect_garbage --loop &
+
+# The worker model and sizing are read from GUNICORN_* environment variables
+# by gunicorn.conf.py. uvicorn workers serve requests from event loops, so
+# that slow clients do not each hold a worker, using the ASGI application
+if [ "${GUNICORN_WORKER_CLASS}" == "uvicorn" ]; then
+  export SERVER_MODE=asgi
+  APPLICATION=fedbiomed.asgi:application
+else
+  export SERVER_MODE=wsgi
+  APPLICATION=fedbiomed.wsgi
+fi
+echo "Running gunicorn with ${GUNICORN_WORKER_CLASS:-sync} workers..."
+gunicorn --config gunicorn.conf.py "${APPLICATION}"
 echo "...Gunicorn complete. Container will now exit"
@@ -12,4 +12,5 @@ docker rm -f jupyter
 docker rm -f tensorboard
 docker rm -f node
 docker rm -f restful
+docker rm -f minio
 docker rm -f mqtt
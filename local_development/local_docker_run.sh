@@ -16,6 +16,7 @@ NODE_IP="172.18.0.24"
 GUI_IP="172.18.0.25"
 JUPYTER_IP="172.18.0.26"
 TENSORBOARD_IP="172.18.0.27"
+MINIO_IP="172.18.0.28"
 RESTFUL_PORT="8000"
 MQTT_PORT="1883"
 NETWORK="fbm_net"
@@ -24,6 +25,10 @@ ENABLE_TRAINING_PLAN_APPROVAL="TRUE"
 ALLOW_DEFAULT_TRAINING_PLANS="FALSE"
 GUI_DEFAULT_ADMIN_EMAIL="admin@passian.local"
 GUI_DEFAULT_ADMIN_PW="passian"
+MINIO_PORT="9000"
+MINIO_USER="passian"
+MINIO_PASSWORD="passianminio"
+UPLOADS_BUCKET="passian-uploads"
 
 # These variables will be provided to the containers
 export MQTT_BROKER="${MQTT_IP}"
@@ -40,9 +45,11 @@ export GUI_DEFAULT_ADMIN_PW="${GUI_DEFAULT_ADMIN_PW}"
 # You can delete this folder to reset the system
 NODE_STORAGE="${REPO_DIR}/.local_docker_storage/node"
 RESEARCHER_STORAGE="${REPO_DIR}/.local_docker_storage/researcher"
+MINIO_STORAGE="${REPO_DIR}/.local_docker_storage/minio"
 
 # Create local folders if they don't already exist
 mkdir -p "${NODE_STORAGE}/config" "${NODE_STORAGE}/data" "${NODE_STORAGE}/etc" "${NODE_STORAGE}/var" "${NODE_STORAGE}/common"
+mkdir -p "${MINIO_STORAGE}"
 mkdir -p "${RESEARCHER_STORAGE}/config" "${RESEARCHER_STORAGE}/data" "${RESEARCHER_STORAGE}/etc" "${RESEARCHER_STORAGE}/samples" "${RESEARCHER_STORAGE}/runs" "${RESEARCHER_STORAGE}/var"
 
 # Create the docker network
@@ -52,8 +59,24 @@ docker network inspect "${NETWORK}" >/dev/null 2>&1 || \
 # Run MQTT
 docker start mqtt 2>/dev/null || docker run --rm -d -p 1883:1883 --net "${NETWORK}" --ip "${MQTT_IP}" --name mqtt passian/mqtt
 
+# Run minio, a local S3-compatible server which stands in for the S3 uploads bucket
+docker start minio 2>/dev/null || docker run --rm -d -p ${MINIO_PORT}:9000 --net "${NETWORK}" --ip "${MINIO_IP}" \
+  -e MINIO_ROOT_USER="${MINIO_USER}" -e MINIO_ROOT_PASSWORD="${MINIO_PASSWORD}" \
+  --mount type=bind,source="${MINIO_STORAGE}",target=/data \
+  --name minio minio/minio server /data
+
+# Create the uploads bucket
+until docker run --rm --net "${NETWORK}" \
+  -e MC_HOST_local="http://${MINIO_USER}:${MINIO_PASSWORD}@${MINIO_IP}:9000" \
+  minio/mc mb --ignore-existing "local/${UPLOADS_BUCKET}"; do
+  sleep 1
+done
+
 # Run restful
-docker start restful 2>/dev/null || docker run --rm -d -p 8000:8000 --net "${NETWORK}" --ip "${RESTFUL_IP}" --name restful passian/restful
+docker start restful 2>/dev/null || docker run --rm -d -p 8000:8000 --net "${NETWORK}" --ip "${RESTFUL_IP}" \
+  -e STORAGE_BACKEND=s3 -e STORAGE_BUCKET_NAME="${UPLOADS_BUCKET}" -e STORAGE_ENDPOINT_URL="http://${MINIO_IP}:9000" \
+  -e STORAGE_REGION=us-east-1 -e AWS_ACCESS_KEY_ID="${MINIO_USER}" -e AWS_SECRET_ACCESS_KEY="${MINIO_PASSWORD}" \
+  --name restful passian/restful
 
 # Run gui
 # Note the mounts correspond to the volumes in docker-compose
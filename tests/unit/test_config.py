@@ -1,5 +1,6 @@
 import configparser
 from dataclasses import dataclass
+from typing import List
 
 from aws_fbm.utils.config import read_config_file, Config, NetworkConfig, \
     NodeConfig, parse_config, convert_inputs, convert_to
@@ -180,9 +181,12 @@ def test_convert_to():
         'false2': 'false',
         'false3': 'FALSE',
         'false4': 'NO',
-        'false5': '0'
+        'false5': '0',
+        'listtype': 'g5.xlarge, g4dn.xlarge'
     }
     assert convert_to(config['test'], key="stringtype", field_type=str) == 'my-string'
+    assert convert_to(config['test'], key="listtype", field_type=List[str]) == \
+        ['g5.xlarge', 'g4dn.xlarge']
     assert convert_to(config['test'], key="true1", field_type=bool)
     assert convert_to(config['test'], key="true2", field_type=bool)
     assert convert_to(config['test'], key="true3", field_type=bool)
@@ -0,0 +1,21 @@
+import pytest
+
+from aws_fbm.fbm_constructs.fargate_service import ServiceScaling, \
+    healthy_percents
+
+
+def test_service_scaling():
+    assert not ServiceScaling().scales
+    assert ServiceScaling(min_count=1, max_count=4, cpu_percent=60).scales
+    with pytest.raises(ValueError):
+        ServiceScaling(min_count=2, max_count=1)
+    with pytest.raises(ValueError):
+        ServiceScaling(min_count=1, max_count=4)
+
+
+def test_healthy_percents():
+    assert healthy_percents(ServiceScaling()) == (0, 100)
+    assert healthy_percents(ServiceScaling(min_count=2, max_count=2)) == \
+        (50, 200)
+    assert healthy_percents(ServiceScaling(min_count=1, max_count=4,
+                                           cpu_percent=60)) == (50, 200)
@@ -0,0 +1,14 @@
+from aws_fbm.lambdas.start_data_sync.index import changed_directories, \
+    include_filter
+
+
+def test_changed_directories():
+    assert changed_directories(["a/b/c.png", "a/b/d.png", "a/x.csv", "ab/z",
+                                "c/d/"]) == ["a", "ab", "c"]
+    assert changed_directories(["a/b/c.png", "top.csv"]) == [""]
+
+
+def test_include_filter():
+    assert include_filter(["a", "ab/c"]) == "/a|/ab/c"
+    assert include_filter([""]) is None
+    assert include_filter(["x" * 100000, "y" * 10000]) is None
@@ -1,6 +1,8 @@
 import pathlib
 
-from aws_fbm.utils.utils import repo_path, bool_to_str
+import pytest
+
+from aws_fbm.utils.utils import repo_path, bool_to_str, gunicorn_environment
 
 
 def test_repo_path():
@@ -12,3 +14,32 @@ def test_repo_path():
 def test_bool_to_str():
     assert bool_to_str(True) == "True"
     assert bool_to_str(False) == "False"
+
+
+def test_gunicorn_environment():
+    sync = gunicorn_environment(cpu=512, memory_limit_mib=4096,
+                                worker_class="sync")
+    assert sync["GUNICORN_WORKER_CLASS"] == "sync"
+    assert sync["GUNICORN_WORKERS"] == "3"
+    assert "GUNICORN_THREADS" not in sync
+
+    gthread = gunicorn_environment(cpu=4096, memory_limit_mib=8192,
+                                   worker_class="gthread")
+    assert gthread["GUNICORN_WORKERS"] == "4"
+    assert gthread["GUNICORN_THREADS"] == "8"
+
+    # Workers are limited by the memory of the task
+    uvicorn = gunicorn_environment(cpu=4096, memory_limit_mib=512,
+                                   worker_class="uvicorn")
+    assert uvicorn["GUNICORN_WORKERS"] == "2"
+
+    overridden = gunicorn_environment(cpu=512, memory_limit_mib=4096,
+                                      worker_class="gthread", workers=6,
+                                      threads=16, log_level="debug")
+    assert overridden["GUNICORN_WORKERS"] == "6"
+    assert overridden["GUNICORN_THREADS"] == "16"
+    assert overridden["GUNICORN_LOG_LEVEL"] == "debug"
+
+    with pytest.raises(ValueError):
+        gunicorn_environment(cpu=512, memory_limit_mib=4096,
+                             worker_class="eventlet")